@@ -1,2 +1,9 @@
-from .get_llm import get_llm
-from .get_embed import get_embedding_model
\ No newline at end of file
+# 按需导入：get_embed 依赖 chromadb，导入很慢，只有真正用到时才加载
+def __getattr__(name):
+    if name == "get_llm":
+        from .get_llm import get_llm
+        return get_llm
+    if name == "get_embedding_model":
+        from .get_embed import get_embedding_model
+        return get_embedding_model
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -0,0 +1,313 @@
+"""
+分析请求的准入控制：限制同时在途的分析数，超出部分进入按用户加权公平调度的有界等待队列
+
+- 在途数未满：直接放行
+- 在途数已满且队列未满：排队等待，超过等待时限则拒绝
+- 队列已满：立即拒绝，调用方返回 429 + Retry-After
+这样过载时上游模型调用量保持恒定，延迟平滑上升而不是整体崩溃。
+
+按用户（username）的公平性：
+- 每个用户一个等待队列，空出的名额按虚拟完成时间（加权公平队列）在有排队的用户之间分配，
+  权重见 ADMISSION_USER_WEIGHTS；刚开始排队的用户从当前虚拟时间起步，不会因为之前空闲而攒下优先权，也不会被饿死
+- 单个用户同时在途不超过 ADMISSION_USER_MAX_INFLIGHT，排队不超过 ADMISSION_USER_MAX_QUEUE
+- 每个用户一个令牌桶配额（每分钟 ADMISSION_USER_RATE 次，突发 ADMISSION_USER_BURST 次），超出时直接拒绝
+一个脚本一次提交几十张图片时，只会占满自己的份额，其他用户的排队时间基本不受影响。
+
+批量接口的一批图片只扣一次配额（charge），各项以 batch=True 申请名额：同一批次的图片在自己的在途上限后排队，
+这种排队来自批次自身的并发，不受用户排队上限与等待时限约束。
+任务队列的 worker 通过 has_room 跳过已达在途上限的用户，名额释放或排队请求离开时通过 add_release_listener 注册的回调得到通知。
+"""
+import asyncio
+import json
+import math
+import os
+import time
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+from typing import Callable, Dict, List, Optional
+
+from app.agent_utils import metrics
+from app.agent_utils.upstream import TokenBucket
+
+ADMISSION_MAX_INFLIGHT = int(os.getenv("ADMISSION_MAX_INFLIGHT", "8"))
+ADMISSION_MAX_QUEUE = int(os.getenv("ADMISSION_MAX_QUEUE", "32"))
+ADMISSION_QUEUE_TIMEOUT = float(os.getenv("ADMISSION_QUEUE_TIMEOUT", "20"))
+ADMISSION_USER_MAX_INFLIGHT = int(os.getenv("ADMISSION_USER_MAX_INFLIGHT", "2"))
+ADMISSION_USER_MAX_QUEUE = int(os.getenv("ADMISSION_USER_MAX_QUEUE", "8"))
+ADMISSION_USER_RATE = float(os.getenv("ADMISSION_USER_RATE", "30"))  # 每分钟次数，<= 0 时不限
+ADMISSION_USER_BURST = float(os.getenv("ADMISSION_USER_BURST", "10"))
+# 用户权重，例如 {"canteen_kiosk": 4}；未列出的用户权重为 1
+ADMISSION_USER_WEIGHTS: Dict[str, float] = json.loads(os.getenv("ADMISSION_USER_WEIGHTS", "{}"))
+# 保留统计信息的空闲用户数上限
+ADMISSION_TRACKED_USERS = int(os.getenv("ADMISSION_TRACKED_USERS", "1000"))
+
+
+class AdmissionRejected(Exception):
+    """准入被拒绝，retry_after 为建议的重试等待秒数"""
+
+    def __init__(self, message: str, retry_after: int):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class AdmissionTicket:
+    """一次准入凭证，release 可重复调用"""
+
+    def __init__(self, controller: "AdmissionController", user: "_UserState"):
+        self._controller = controller
+        self._user = user
+        self._start = time.monotonic()
+        self._released = False
+
+    def release(self):
+        if self._released:
+            return
+        self._released = True
+        self._controller._release(self._user, time.monotonic() - self._start)
+
+
+class _UserState:
+    """单个用户的等待队列、在途数、虚拟完成时间、配额与统计"""
+
+    def __init__(self, weight: float, rate: float, burst: float):
+        self.weight = weight
+        self.waiters: deque = deque()
+        self.inflight = 0
+        self.finish = 0.0
+        self.bucket = TokenBucket(rate, burst * 60 / rate) if rate > 0 else None
+        self.admitted = 0
+        self.rejected = 0
+        self.wait_sum = 0.0
+        self.wait_max = 0.0
+
+    @property
+    def idle(self) -> bool:
+        return not self.waiters and not self.inflight
+
+
+class AdmissionController:
+    def __init__(self, max_inflight: int = ADMISSION_MAX_INFLIGHT, max_queue: int = ADMISSION_MAX_QUEUE,
+                 queue_timeout: float = ADMISSION_QUEUE_TIMEOUT,
+                 user_max_inflight: int = ADMISSION_USER_MAX_INFLIGHT,
+                 user_max_queue: int = ADMISSION_USER_MAX_QUEUE,
+                 user_rate: float = ADMISSION_USER_RATE, user_burst: float = ADMISSION_USER_BURST,
+                 user_weights: Optional[Dict[str, float]] = None):
+        """
+        :param max_inflight: 同时在途的分析数上限
+        :param max_queue: 等待队列长度上限
+        :param queue_timeout: 单个请求在队列中的最长等待秒数
+        :param user_max_inflight: 单个用户同时在途的分析数上限
+        :param user_max_queue: 单个用户排队的请求数上限
+        :param user_rate: 单个用户每分钟可发起的分析数（令牌桶速率），<= 0 时不限
+        :param user_burst: 令牌桶容量，即允许的突发次数
+        :param user_weights: 用户权重，权重越大分到的名额越多
+        """
+        self.max_inflight = max_inflight
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.user_max_inflight = user_max_inflight
+        self.user_max_queue = user_max_queue
+        self.user_rate = user_rate
+        self.user_burst = user_burst
+        self.user_weights = ADMISSION_USER_WEIGHTS if user_weights is None else user_weights
+
+        self._inflight = 0
+        self._queued = 0
+        self._users: "OrderedDict[str, _UserState]" = OrderedDict()
+        # 已分配请求中最大的虚拟起始时间，新开始排队的用户从这里起步
+        self._virtual_time = 0.0
+        # 单次分析耗时的指数滑动平均，用于估算 Retry-After
+        self._avg_service_time = 10.0
+        # 名额释放后调用的回调（任务队列据此重新挑选可执行的任务）
+        self._release_listeners: List[Callable[[], None]] = []
+
+    @property
+    def inflight(self) -> int:
+        return self._inflight
+
+    @property
+    def queue_depth(self) -> int:
+        return self._queued
+
+    def retry_after(self) -> int:
+        """按当前排队长度与平均耗时估算多久后可能有空位"""
+        batches = (self._queued + 1) / self.max_inflight
+        return max(1, math.ceil(batches * self._avg_service_time))
+
+    def charge(self, user: Optional[str] = None):
+        """扣除用户的一次配额，配额不足时抛出 AdmissionRejected；批量接口按批次调用一次"""
+        self._take_quota(self._user(user or ""))
+
+    def has_room(self, user: Optional[str] = None) -> bool:
+        """用户当前能否不排队地拿到名额（在途与排队数之和未达单用户在途上限）"""
+        state = self._users.get(user or "")
+        return state is None or state.inflight + len(state.waiters) < self.user_max_inflight
+
+    def add_release_listener(self, callback: Callable[[], None]):
+        """注册名额释放或排队请求离开后的回调（在事件循环线程中同步调用，不能阻塞）"""
+        self._release_listeners.append(callback)
+
+    async def acquire(self, patient: bool = False, user: Optional[str] = None,
+                      batch: bool = False) -> AdmissionTicket:
+        """
+        获取一个在途名额
+
+        :param patient: 后台任务（如任务队列 worker）使用，不受队列上限、等待时限与用户配额约束，只排队不拒绝
+                        （worker 数已经限制了任务的速率，在配额上等待会让一个用户的任务占住 worker）
+        :param user: 用户名，公平调度、在途上限与配额都按用户计算；为 None 时归入同一个匿名用户
+        :param batch: 批量接口的单项：配额已由 charge 按批次扣除，不受用户排队上限与等待时限约束，
+                      仍受全局队列上限约束
+        """
+        start = time.monotonic()
+        state = self._user(user or "")
+        if not patient and not batch:
+            self._take_quota(state)
+
+        waiter = asyncio.get_running_loop().create_future()
+        self._enqueue(state, waiter)
+        self._dispatch()
+        if waiter.done():
+            return self._admit(state, start)
+
+        if not patient and not batch and len(state.waiters) > self.user_max_queue:
+            self._reject(state, waiter, "admission_rejected_user_queue_full", "排队请求过多，请稍后重试")
+        if not patient and self._queued > self.max_queue:
+            self._reject(state, waiter, "admission_rejected_queue_full", "服务繁忙，请稍后重试")
+
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter), None if patient or batch else self.queue_timeout)
+        except asyncio.TimeoutError:
+            # 超时与名额分配可能同时发生：已拿到名额就照常放行
+            if not self._handed_over(waiter):
+                self._reject(state, waiter, "admission_rejected_timeout", "排队超时，请稍后重试")
+        except asyncio.CancelledError:
+            if self._handed_over(waiter):
+                self._release(state, None)
+            else:
+                self._abandon(state, waiter)
+            raise
+        # _dispatch 已经为当前请求计入在途数
+        return self._admit(state, start)
+
+    @asynccontextmanager
+    async def slot(self, patient: bool = False, user: Optional[str] = None, batch: bool = False):
+        ticket = await self.acquire(patient, user, batch)
+        try:
+            yield ticket
+        finally:
+            ticket.release()
+
+    def user_stats(self) -> dict:
+        """各用户的排队数、在途数、放行 / 拒绝次数与排队耗时，供 /stats 导出"""
+        return {
+            name or "<anonymous>": {
+                "weight": state.weight,
+                "queued": len(state.waiters),
+                "inflight": state.inflight,
+                "admitted": state.admitted,
+                "rejected": state.rejected,
+                "avg_wait_seconds": state.wait_sum / state.admitted if state.admitted else 0.0,
+                "max_wait_seconds": state.wait_max,
+            }
+            for name, state in self._users.items()
+        }
+
+    def _user(self, name: str) -> _UserState:
+        state = self._users.get(name)
+        if state is None:
+            self._prune()
+            state = self._users[name] = _UserState(
+                float(self.user_weights.get(name, 1)), self.user_rate, self.user_burst
+            )
+        self._users.move_to_end(name)
+        return state
+
+    def _prune(self):
+        """新增用户前，用户数达到 ADMISSION_TRACKED_USERS 时丢弃最久未活动的空闲用户"""
+        excess = len(self._users) + 1 - ADMISSION_TRACKED_USERS
+        for name in [name for name, state in self._users.items() if state.idle][:max(0, excess)]:
+            del self._users[name]
+
+    def _take_quota(self, state: _UserState):
+        if state.bucket is None:
+            return
+        wait = state.bucket.wait_time(1, time.monotonic())
+        if wait > 0:
+            state.rejected += 1
+            metrics.incr("admission_rejected_user_quota")
+            raise AdmissionRejected("请求过于频繁，请稍后重试", max(1, math.ceil(wait)))
+        state.bucket.take(1)
+
+    def _enqueue(self, state: _UserState, waiter: asyncio.Future):
+        if not state.waiters:
+            # 从空闲转为排队：不保留空闲期间的“欠账”，从当前虚拟时间起步
+            state.finish = max(state.finish, self._virtual_time)
+        state.waiters.append(waiter)
+        self._queued += 1
+
+    def _dispatch(self):
+        """把空闲名额按虚拟完成时间分给未达在途上限、且有排队请求的用户"""
+        while self._inflight < self.max_inflight:
+            eligible = [
+                s for s in self._users.values()
+                if s.waiters and s.inflight < self.user_max_inflight
+            ]
+            if not eligible:
+                break
+            state = min(eligible, key=lambda s: s.finish + 1 / s.weight)
+            waiter = state.waiters.popleft()
+            self._queued -= 1
+            # 虚拟时间取已分配请求的起始标签，新排队的用户与当前正在被服务的进度对齐
+            self._virtual_time = max(self._virtual_time, state.finish)
+            state.finish += 1 / state.weight
+            state.inflight += 1
+            self._inflight += 1
+            waiter.set_result(None)
+        self._update_gauges()
+
+    def _admit(self, state: _UserState, start: float) -> AdmissionTicket:
+        wait = time.monotonic() - start
+        state.admitted += 1
+        state.wait_sum += wait
+        state.wait_max = max(state.wait_max, wait)
+        metrics.observe("admission_wait_seconds", wait)
+        return AdmissionTicket(self, state)
+
+    @staticmethod
+    def _handed_over(waiter: asyncio.Future) -> bool:
+        return waiter.done() and not waiter.cancelled()
+
+    def _abandon(self, state: _UserState, waiter: asyncio.Future):
+        """放弃排队，移出等待队列"""
+        waiter.cancel()
+        try:
+            state.waiters.remove(waiter)
+            self._queued -= 1
+        except ValueError:
+            pass
+        self._update_gauges()
+        self._notify_release()
+
+    def _reject(self, state: _UserState, waiter: asyncio.Future, metric: str, message: str):
+        self._abandon(state, waiter)
+        state.rejected += 1
+        metrics.incr(metric)
+        raise AdmissionRejected(message, self.retry_after())
+
+    def _release(self, state: _UserState, service_time):
+        if service_time is not None:
+            self._avg_service_time = 0.8 * self._avg_service_time + 0.2 * service_time
+        state.inflight -= 1
+        self._inflight -= 1
+        # 空出的名额立即按公平顺序分给排队的请求
+        self._dispatch()
+        self._notify_release()
+
+    def _notify_release(self):
+        for callback in self._release_listeners:
+            callback()
+
+    def _update_gauges(self):
+        metrics.set_gauge("admission_inflight", self._inflight)
+        metrics.set_gauge("admission_queue_depth", self._queued)
+        metrics.set_gauge("admission_queued_users", sum(1 for s in self._users.values() if s.waiters))
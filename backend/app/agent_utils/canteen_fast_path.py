@@ -0,0 +1,174 @@
+"""
+食堂快速通道：视觉识别出的菜品都能在 CanteenDB 中高置信匹配到时，直接按克数缩放库中的营养宝塔向量，跳过分析子图
+
+- 菜名匹配复用标准菜谱参考表的模糊索引，只认高置信命中（FuzzyNameIndex.confident：完全一致或 bigram 打分，
+  不做编辑距离兜底），"红烧牛肉饭" 不会命中 "红烧牛肉"
+- 命中的菜还要与视觉食材大体一致：非调料食材中能对上库中主料（同名或同一食材子类）的克数
+  占比不低于 CANTEEN_INGREDIENT_AGREEMENT，否则缩放后视觉克数会落进错误的宝塔层
+- 客户端传了食堂 / 餐别时只在对应范围内匹配
+- 缩放比例 = 视觉报告中该菜的食材总克数 / 库中该菜 L1-L4 的克数之和
+- 任意一道菜匹配不上就整体回退到分析子图，不混用两种来源
+菜品表在内存中缓存，每 CANTEEN_REFRESH_SECONDS 秒从 SQLite 重新加载一次。
+"""
+import os
+import threading
+import time
+from collections import defaultdict
+from typing import Dict, List, Optional
+
+from app.agent_utils import pagoda
+from app.agent_utils.database_utils.canteen_db_sql import CanteenDB
+from app.agent_utils.recipe_index import FuzzyNameIndex
+from models.schemas import DishItem, L5Detail, NutritionReport, PagodaLayer, PagodaNutritionVector
+
+CANTEEN_FAST_PATH = os.getenv("CANTEEN_FAST_PATH", "1") == "1"
+CANTEEN_DB_PATH = os.getenv("CANTEEN_DB_PATH", "canteen_diet.db")
+CANTEEN_MATCH_THRESHOLD = float(os.getenv("CANTEEN_MATCH_THRESHOLD", "0.85"))
+CANTEEN_REFRESH_SECONDS = float(os.getenv("CANTEEN_REFRESH_SECONDS", "300"))
+# 视觉食材（按克数）与库中主料对得上的最低比例
+CANTEEN_INGREDIENT_AGREEMENT = float(os.getenv("CANTEEN_INGREDIENT_AGREEMENT", "0.7"))
+
+_LAYERS = ("L1", "L2", "L3", "L4")
+
+
+class CanteenMatcher:
+    def __init__(self, db_path: str = CANTEEN_DB_PATH, threshold: float = CANTEEN_MATCH_THRESHOLD,
+                 refresh_seconds: float = CANTEEN_REFRESH_SECONDS):
+        self.db_path = db_path
+        self.threshold = threshold
+        self.refresh_seconds = refresh_seconds
+
+        self._lock = threading.Lock()
+        self._index: Optional[FuzzyNameIndex] = None
+        self._loaded_at = 0.0
+
+    def _get_index(self) -> FuzzyNameIndex:
+        with self._lock:
+            if self._index is None or time.monotonic() - self._loaded_at > self.refresh_seconds:
+                with CanteenDB(self.db_path) as db:
+                    dishes = db.get_dishes_with_nutrition()
+                # 不同食堂、餐别可能有同名菜，同名的归为一组，匹配后再按范围筛选
+                groups: Dict[str, List[dict]] = defaultdict(list)
+                for dish in dishes:
+                    groups[dish["dish_name"]].append(dish)
+                self._index = FuzzyNameIndex(groups.items(), fallback_below=0)
+                self._loaded_at = time.monotonic()
+            return self._index
+
+    def _match_item(self, index: FuzzyNameIndex, item: DishItem,
+                    canteen_name: Optional[str], meal_type: Optional[str]) -> Optional[dict]:
+        for group, _, _ in index.confident(item.name, self.threshold, limit=5):
+            for dish in group:
+                if canteen_name and dish["canteen_name"] != canteen_name:
+                    continue
+                if meal_type and dish["meal_type"] != meal_type:
+                    continue
+                if not _ingredients_agree(item, dish):
+                    continue
+                return dish
+        return None
+
+    def match(self, items: List[DishItem], canteen_name: Optional[str] = None,
+              meal_type: Optional[str] = None) -> Optional[NutritionReport]:
+        """所有条目都高置信匹配时返回缩放、合并后的 NutritionReport，否则返回 None"""
+        if not items:
+            return None
+        index = self._get_index()
+        if not len(index):
+            return None
+
+        matched = []
+        for item in items:
+            dish = self._match_item(index, item, canteen_name, meal_type)
+            if dish is None:
+                return None
+            matched.append((item, dish))
+        return _merge(matched)
+
+
+def _ingredients_agree(item: DishItem, dish: dict) -> bool:
+    """视觉条目的非调料食材中，能对上库中主料的克数占比是否达到 CANTEEN_INGREDIENT_AGREEMENT"""
+    ingredients = [
+        ingredient for ingredient in item.ingredients
+        if ingredient.grams > 0 and pagoda.classify_ingredient(ingredient.name) != pagoda.SEASONING
+    ]
+    total = sum(ingredient.grams for ingredient in ingredients)
+    if total <= 0:
+        # 视觉报告没有克数时按库中克数返回，不存在放错层的问题
+        return True
+    main = [name.strip() for name in dish["main_ingredients"] if name.strip()]
+    main_categories = {pagoda.classify_ingredient(name) for name in main} - {None, pagoda.OTHER}
+    agreed = 0.0
+    for ingredient in ingredients:
+        name = ingredient.name.strip()
+        if any(name in other or other in name for other in main) \
+                or pagoda.classify_ingredient(name) in main_categories:
+            agreed += ingredient.grams
+    return agreed / total >= CANTEEN_INGREDIENT_AGREEMENT
+
+
+def _merge(matched) -> NutritionReport:
+    """按克数缩放每道菜的宝塔向量并求和"""
+    totals = {layer: 0.0 for layer in _LAYERS}
+    details: Dict[str, Dict[str, float]] = {layer: defaultdict(float) for layer in _LAYERS}
+    layer_ingredients: Dict[str, List[str]] = {layer: [] for layer in _LAYERS}
+    oil = salt = 0.0
+    names, main_ingredients, seasonings, tags = [], [], [], []
+
+    for item, dish in matched:
+        vector = dish["pagoda_nutrition_vector"]
+        stored_grams = sum(vector.get(layer, {}).get("total_value", 0.0) for layer in _LAYERS)
+        visual_grams = sum(ingredient.grams for ingredient in item.ingredients)
+        ratio = visual_grams / stored_grams if stored_grams > 0 and visual_grams > 0 else 1.0
+
+        for layer in _LAYERS:
+            layer_data = vector.get(layer, {})
+            totals[layer] += layer_data.get("total_value", 0.0) * ratio
+            for key, value in layer_data.get("details", {}).items():
+                if isinstance(value, (int, float)):
+                    details[layer][key] += value * ratio
+            for ingredient in layer_data.get("ingredients", []):
+                _append_unique(layer_ingredients[layer], ingredient)
+        oil += vector.get("L5", {}).get("oil", 0.0) * ratio
+        salt += vector.get("L5", {}).get("salt", 0.0) * ratio
+
+        names.append(dish["dish_name"])
+        for ingredient in dish["main_ingredients"]:
+            _append_unique(main_ingredients, ingredient)
+        for seasoning in dish["seasonings"]:
+            _append_unique(seasonings, seasoning)
+        for tag in dish["feature_tags"]:
+            _append_unique(tags, tag)
+
+    pagoda_vector = PagodaNutritionVector(
+        **{
+            layer: PagodaLayer(
+                total_value=round(totals[layer], 1),
+                ingredients=layer_ingredients[layer],
+                details={key: round(value, 1) for key, value in details[layer].items()},
+            )
+            for layer in _LAYERS
+        },
+        L5=L5Detail(oil=round(oil, 1), salt=round(salt, 1)),
+    )
+    description = matched[0][1]["description"] if len(matched) == 1 else ""
+    return NutritionReport(
+        dish_name=" + ".join(names),
+        main_ingredients=main_ingredients,
+        seasonings=seasonings,
+        pagoda_nutrition_vector=pagoda_vector,
+        feature_tags=tags,
+        description=description or pagoda.describe_meal(pagoda_vector),
+    )
+
+
+def _append_unique(items: list, value):
+    if value not in items:
+        items.append(value)
+
+
+def get_canteen_matcher() -> Optional[CanteenMatcher]:
+    """未开启或食堂库文件不存在时返回 None（CanteenDB 会在路径不存在时新建空库，这里先行判断）"""
+    if not CANTEEN_FAST_PATH or not os.path.exists(CANTEEN_DB_PATH):
+        return None
+    return CanteenMatcher()
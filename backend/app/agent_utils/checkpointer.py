@@ -0,0 +1,109 @@
+"""
+有界的内存 checkpointer
+
+MemorySaver 会把每个 thread 的全部 checkpoint（含图片字节、LLM 消息）永久留在进程内存里，
+而 /analyze 每次请求都是新的 thread_id，RSS 只增不减。这里在 MemorySaver 之上按 thread 记账：
+- LRU：thread 数超过 max_threads 时淘汰最久未访问的
+- TTL：超过 ttl 秒未访问的 thread 直接淘汰
+- 字节上限：所有 thread 序列化后的总字节数超过 max_bytes 时按 LRU 淘汰
+"""
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from langgraph.checkpoint.memory import MemorySaver
+
+CHECKPOINT_MAX_THREADS = int(os.getenv("CHECKPOINT_MAX_THREADS", "256"))
+CHECKPOINT_TTL = float(os.getenv("CHECKPOINT_TTL", "1800"))
+CHECKPOINT_MAX_BYTES = int(os.getenv("CHECKPOINT_MAX_BYTES", str(64 * 1024 * 1024)))
+
+
+class BoundedMemorySaver(MemorySaver):
+    def __init__(self, max_threads: int = CHECKPOINT_MAX_THREADS, ttl: float = CHECKPOINT_TTL,
+                 max_bytes: int = CHECKPOINT_MAX_BYTES, **kwargs):
+        super().__init__(**kwargs)
+        self.max_threads = max_threads
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+
+        self._lock = threading.RLock()
+        # thread_id -> [最近访问时间, 已占用字节数]
+        self._threads: "OrderedDict[str, list]" = OrderedDict()
+        self._total_bytes = 0
+
+    @property
+    def total_bytes(self) -> int:
+        return self._total_bytes
+
+    @property
+    def thread_count(self) -> int:
+        # 注意不能实现 __len__：checkpointer 为假值时 langgraph 会当作未配置 checkpointer
+        return len(self._threads)
+
+    def get_tuple(self, config):
+        with self._lock:
+            thread_id = config["configurable"]["thread_id"]
+            if thread_id in self._threads:
+                self._touch(thread_id, 0)
+            return super().get_tuple(config)
+
+    def put(self, config, checkpoint, metadata, new_versions):
+        with self._lock:
+            next_config = super().put(config, checkpoint, metadata, new_versions)
+
+            thread_id = next_config["configurable"]["thread_id"]
+            checkpoint_ns = next_config["configurable"]["checkpoint_ns"]
+            added = 0
+            for channel, version in new_versions.items():
+                added += len(self.blobs[(thread_id, checkpoint_ns, channel, version)][1])
+            saved, meta, _ = self.storage[thread_id][checkpoint_ns][checkpoint["id"]]
+            added += len(saved[1]) + len(meta[1])
+
+            self._touch(thread_id, added)
+            self._evict(protect=thread_id)
+            return next_config
+
+    def put_writes(self, config, writes, task_id, task_path=""):
+        with self._lock:
+            thread_id = config["configurable"]["thread_id"]
+            outer_key = (thread_id, config["configurable"].get("checkpoint_ns", ""),
+                         config["configurable"]["checkpoint_id"])
+            before = _writes_size(self.writes.get(outer_key))
+            super().put_writes(config, writes, task_id, task_path)
+            after = _writes_size(self.writes.get(outer_key))
+
+            self._touch(thread_id, after - before)
+            self._evict(protect=thread_id)
+
+    def delete_thread(self, thread_id: str) -> None:
+        with self._lock:
+            super().delete_thread(thread_id)
+            entry = self._threads.pop(thread_id, None)
+            if entry is not None:
+                self._total_bytes -= entry[1]
+
+    def _touch(self, thread_id: str, added: int):
+        entry = self._threads.get(thread_id)
+        if entry is None:
+            entry = self._threads[thread_id] = [0.0, 0]
+        entry[0] = time.monotonic()
+        entry[1] += added
+        self._total_bytes += added
+        self._threads.move_to_end(thread_id)
+
+    def _evict(self, protect: str):
+        """淘汰过期与超额的 thread；正在写入的 thread 不会被淘汰"""
+        deadline = time.monotonic() - self.ttl
+        while self._threads:
+            oldest, (last_access, _) = next(iter(self._threads.items()))
+            over_limit = len(self._threads) > self.max_threads or self._total_bytes > self.max_bytes
+            if oldest == protect or (last_access >= deadline and not over_limit):
+                break
+            self.delete_thread(oldest)
+
+
+def _writes_size(writes) -> int:
+    if not writes:
+        return 0
+    return sum(len(value[2][1]) for value in writes.values())
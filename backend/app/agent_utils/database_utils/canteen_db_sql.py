@@ -338,6 +338,82 @@ class CanteenDB:
             ''', (nutrition_level, min_value))
             return cursor.fetchall()
 
+    def get_dishes_with_nutrition(self, canteen_name: str = None, meal_type: str = None) -> list:
+        """
+        批量获取菜品及完整的营养宝塔向量，供视觉结果与食堂菜品的匹配使用
+
+        :param canteen_name: 食堂名称，为空时不限
+        :param meal_type: 用餐类型，为空时不限
+        :return: 菜品字典列表，字段与 save_canteen_data 的输入一致，另含 id、canteen_name、meal_type
+        """
+        cursor = self.conn.cursor()
+
+        conditions, params = [], []
+        if canteen_name:
+            conditions.append("c.canteen_name = ?")
+            params.append(canteen_name)
+        if meal_type:
+            conditions.append("d.meal_type = ?")
+            params.append(meal_type)
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+
+        cursor.execute(f'''
+            SELECT d.id, d.dish_name, c.canteen_name, d.meal_type, d.feature_tags, d.description
+            FROM dishes d
+            JOIN windows w ON d.window_id = w.id
+            JOIN canteens c ON w.canteen_id = c.id
+            {where}
+        ''', params)
+        dishes = {}
+        for row in cursor.fetchall():
+            dishes[row[0]] = {
+                "id": row[0],
+                "dish_name": row[1],
+                "canteen_name": row[2],
+                "meal_type": row[3],
+                "feature_tags": json.loads(row[4] or "[]"),
+                "description": row[5] or "",
+                "main_ingredients": [],
+                "seasonings": [],
+                "pagoda_nutrition_vector": {},
+            }
+        if not dishes:
+            return []
+
+        # 食材与营养等级各一次查询，避免逐个菜品调用 get_dish_nutrition
+        placeholders = ",".join("?" * len(dishes))
+        cursor.execute(f'''
+            SELECT dish_id, ingredient_name, ingredient_type
+            FROM dish_ingredients
+            WHERE dish_id IN ({placeholders})
+        ''', list(dishes))
+        for dish_id, ingredient_name, ingredient_type in cursor.fetchall():
+            key = "seasonings" if ingredient_type == "seasoning" else "main_ingredients"
+            dishes[dish_id][key].append(ingredient_name)
+
+        cursor.execute(f'''
+            SELECT dish_id, level_name, total_value, ingredients, details
+            FROM dish_nutrition_levels
+            WHERE dish_id IN ({placeholders})
+        ''', list(dishes))
+        for dish_id, level_name, total_value, ingredients, details in cursor.fetchall():
+            vector = dishes[dish_id]["pagoda_nutrition_vector"]
+            if level_name == "L5":
+                # L5 的 total_value 是 "oil,salt" 格式
+                try:
+                    oil, salt = (float(part) for part in str(total_value).split(","))
+                except ValueError:
+                    oil, salt = 0.0, 0.0
+                vector["L5"] = {"oil": oil, "salt": salt}
+            else:
+                vector[level_name] = {
+                    "total_value": float(total_value or 0),
+                    "ingredients": json.loads(ingredients or "[]"),
+                    "details": json.loads(details or "{}"),
+                }
+
+        return list(dishes.values())
+
 
 if __name__ == "__main__":
     # 使用示例
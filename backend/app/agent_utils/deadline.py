@@ -0,0 +1,97 @@
+"""
+请求级截止时间
+
+每次分析在进入流程时确定一个绝对截止时间（time.time() 时间戳，可随状态写入 checkpoint），
+VisionAgentState / AnalysisState / DishState 都携带它，各节点在调用模型或工具前按剩余时间设置单次调用的超时：
+- 剩余时间不足 DEADLINE_MIN_CALL_SECONDS 时不再发起调用，直接抛出 DeadlineExceeded
+- 异步调用用 asyncio.wait_for 限时；同步调用放在 sync_deadline 中，
+  经上游调用层发出的 DashScope / Tavily 请求按剩余时间设置 HTTP 超时，到期后不再重试
+检索阶段超时后由 AnalysisAgent 用视觉克数与本地油盐估算生成部分报告（is_partial），而不是整体失败。
+"""
+import asyncio
+import os
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Awaitable, Optional, TypeVar
+
+from app.agent_utils import metrics
+
+REQUEST_DEADLINE_SECONDS = float(os.getenv("REQUEST_DEADLINE_SECONDS", "50"))  # <= 0 时不设截止时间
+DEADLINE_MIN_CALL_SECONDS = float(os.getenv("DEADLINE_MIN_CALL_SECONDS", "2"))
+# 检索阶段为兜底汇总与响应序列化预留的时间
+DEADLINE_RESERVE_SECONDS = float(os.getenv("DEADLINE_RESERVE_SECONDS", "3"))
+
+T = TypeVar("T")
+
+# sync_deadline 内同步调用的截止时间戳（已扣除 reserve）
+_sync_deadline: ContextVar[Optional[float]] = ContextVar("sync_deadline", default=None)
+
+
+class DeadlineExceeded(TimeoutError):
+    """剩余时间不足以完成本次调用"""
+
+
+def new_deadline(seconds: float = REQUEST_DEADLINE_SECONDS) -> Optional[float]:
+    """从现在起 seconds 秒后的截止时间戳；seconds <= 0 时返回 None（不限时）"""
+    if seconds <= 0:
+        return None
+    return time.time() + seconds
+
+
+def remaining(deadline: Optional[float]) -> Optional[float]:
+    """距截止时间的剩余秒数，不限时返回 None"""
+    if deadline is None:
+        return None
+    return deadline - time.time()
+
+
+def call_timeout(deadline: Optional[float], reserve: float = 0.0) -> Optional[float]:
+    """
+    单次调用可用的超时秒数（扣除 reserve），不限时返回 None；不足 DEADLINE_MIN_CALL_SECONDS 时抛出 DeadlineExceeded
+    """
+    left = remaining(deadline)
+    if left is None:
+        return None
+    timeout = left - reserve
+    if timeout < DEADLINE_MIN_CALL_SECONDS:
+        metrics.incr("deadline_skipped_calls")
+        raise DeadlineExceeded(f"距截止时间仅剩 {max(left, 0):.1f}s")
+    return timeout
+
+
+async def with_deadline(awaitable: Awaitable[T], deadline: Optional[float], reserve: float = 0.0) -> T:
+    """按剩余时间限时等待一次调用，超时抛出 DeadlineExceeded"""
+    try:
+        timeout = call_timeout(deadline, reserve)
+    except DeadlineExceeded:
+        # 未发起的协程需要显式关闭，否则会产生 "never awaited" 警告
+        if asyncio.iscoroutine(awaitable):
+            awaitable.close()
+        raise
+    if timeout is None:
+        return await awaitable
+    try:
+        return await asyncio.wait_for(awaitable, timeout)
+    except asyncio.TimeoutError:
+        metrics.incr("deadline_timeouts")
+        raise DeadlineExceeded(f"调用超过 {timeout:.1f}s 未返回") from None
+
+
+@contextmanager
+def sync_deadline(deadline: Optional[float], reserve: float = 0.0):
+    """
+    同步调用的限时：进入时检查剩余时间（不足时抛出 DeadlineExceeded），
+    with 块内的上游请求通过 request_timeout() 取得 HTTP 超时
+    """
+    call_timeout(deadline, reserve)
+    token = _sync_deadline.set(None if deadline is None else deadline - reserve)
+    try:
+        yield
+    finally:
+        _sync_deadline.reset(token)
+
+
+def request_timeout() -> Optional[float]:
+    """当前同步请求（含重试）可用的超时秒数，不在 sync_deadline 内时返回 None；不足时抛出 DeadlineExceeded"""
+    return call_timeout(_sync_deadline.get())
@@ -1,24 +1,32 @@
 import os
 
-from langchain_community.chat_models.tongyi import ChatTongyi
 from dotenv import load_dotenv, find_dotenv
 
 load_dotenv(find_dotenv())
 
-if not os.getenv("DASHSCOPE_API_KEY"):
-    raise ValueError("环境变量 DASHSCOPE_API_KEY 未设置，请检查 .env 文件")
-
 _llm_instance = None
 _vision_llm_instance = None
 
 
+def _require_api_key():
+    # 在首次创建模型时校验，而不是在导入时抛错，避免 import 本模块就拖垮整个进程
+    if not os.getenv("DASHSCOPE_API_KEY"):
+        raise ValueError("环境变量 DASHSCOPE_API_KEY 未设置，请检查 .env 文件")
+
+
 def get_llm():
     """
     返回千问语言模型单例
     """
     global _llm_instance
     if _llm_instance is None:
-        _llm_instance = ChatTongyi(model="qwen-plus", temperature=0)
+        _require_api_key()
+        # langchain_community 导入较慢，推迟到第一次真正需要模型时
+        from app.agent_utils.tongyi_client import UpstreamChatTongyi
+        from app.agent_utils.llm_cache import get_llm_cache
+        # LLM_CACHE=1 时相同输入直接返回缓存的响应，bind_tools / with_structured_output 派生的调用同样生效；
+        # 调用经过上游调用层（按模型限流、429/5xx 抖动重试）
+        _llm_instance = UpstreamChatTongyi(model="qwen-plus", temperature=0, cache=get_llm_cache("qwen-plus", 0))
     return _llm_instance
 
 
@@ -28,5 +36,7 @@ def get_vision_llm():
     """
     global _vision_llm_instance
     if _vision_llm_instance is None:
-        _vision_llm_instance = ChatTongyi(model="qwen3-vl-plus", temperature=0.1)
-    return _vision_llm_instance
\ No newline at end of file
+        _require_api_key()
+        from app.agent_utils.tongyi_client import UpstreamChatTongyi
+        _vision_llm_instance = UpstreamChatTongyi(model="qwen3-vl-plus", temperature=0.1)
+    return _vision_llm_instance
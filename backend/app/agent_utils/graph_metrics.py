@@ -0,0 +1,72 @@
+"""
+LangGraph 图的耗时埋点
+
+GraphMetricsHandler 是一个 LangChain 回调，由 VisionAnalysisAgent 在每次运行时放进 config["callbacks"]，
+子图（AnalysisAgent、单道菜检索）与节点内的模型 / 工具调用通过 LangChain 的上下文传播自动继承，节点代码中不需要计时：
+- 节点：run 名称等于 metadata["langgraph_node"] 的链即节点本身，记入 graph_node_seconds{node}
+- 模型调用：记入 llm_call_seconds{model}（包含限流等待与重试）
+- 工具调用：记入 tool_call_seconds{tool}
+出错时另计 *_errors{..., error_class}。
+"""
+import time
+from typing import Any, Dict, Optional
+from uuid import UUID
+
+from langchain_core.callbacks import BaseCallbackHandler
+
+from app.agent_utils import metrics
+
+
+class GraphMetricsHandler(BaseCallbackHandler):
+    # 只做字典操作与计数，直接在调用线程中执行，不需要切到线程池
+    run_inline = True
+
+    def __init__(self):
+        self._runs: Dict[UUID, tuple] = {}
+
+    def _start(self, run_id: UUID, metric: str, labels: dict):
+        self._runs[run_id] = (metric, labels, time.perf_counter())
+
+    def _finish(self, run_id: UUID, error: Optional[BaseException] = None):
+        run = self._runs.pop(run_id, None)
+        if run is None:
+            return
+        metric, labels, start = run
+        metrics.histogram(f"{metric}_seconds", time.perf_counter() - start, labels)
+        if error is not None:
+            metrics.incr(f"{metric}_errors", labels={**labels, "error_class": type(error).__name__})
+
+    def on_chain_start(self, serialized: Optional[dict], inputs: Any, *, run_id: UUID,
+                       metadata: Optional[dict] = None, **kwargs: Any):
+        node = (metadata or {}).get("langgraph_node")
+        if node and kwargs.get("name") == node:
+            self._start(run_id, "graph_node", {"node": node})
+
+    def on_chain_end(self, outputs: Any, *, run_id: UUID, **kwargs: Any):
+        self._finish(run_id)
+
+    def on_chain_error(self, error: BaseException, *, run_id: UUID, **kwargs: Any):
+        self._finish(run_id, error)
+
+    def on_chat_model_start(self, serialized: Optional[dict], messages: Any, *, run_id: UUID,
+                            metadata: Optional[dict] = None, **kwargs: Any):
+        self._start(run_id, "llm_call", {"model": (metadata or {}).get("ls_model_name") or "unknown"})
+
+    def on_llm_end(self, response: Any, *, run_id: UUID, **kwargs: Any):
+        self._finish(run_id)
+
+    def on_llm_error(self, error: BaseException, *, run_id: UUID, **kwargs: Any):
+        self._finish(run_id, error)
+
+    def on_tool_start(self, serialized: Optional[dict], input_str: str, *, run_id: UUID, **kwargs: Any):
+        name = kwargs.get("name") or (serialized or {}).get("name") or "unknown"
+        self._start(run_id, "tool_call", {"tool": name})
+
+    def on_tool_end(self, output: Any, *, run_id: UUID, **kwargs: Any):
+        self._finish(run_id)
+
+    def on_tool_error(self, error: BaseException, *, run_id: UUID, **kwargs: Any):
+        self._finish(run_id, error)
+
+
+graph_metrics = GraphMetricsHandler()
@@ -0,0 +1,163 @@
+"""
+LangGraph 图的链路追踪
+
+GraphTracingHandler 与 GraphMetricsHandler 一样由 VisionAnalysisAgent 放进 config["callbacks"]，按回调创建 span：
+- 节点：node {节点名}，带 langgraph.node / langgraph.step
+- 模型调用：chat {模型}，结束时记录 gen_ai.usage.* token 数（来自模型响应，缓存命中时也会有）
+- 工具调用：execute_tool {工具名}
+span 的父子关系按 LangChain 的 run 树（parent_run_id）确定，而不是当前上下文：
+LangChain 的 on_*_end 回调在 asyncio.shield 的副本上下文中执行，回调里无法成对地设置 / 恢复当前 span。
+节点与工具内部代码创建的 span（图片处理、上游调用等）通过 parent_context() 找到所在的节点 / 工具 span，
+模型调用内部由 UpstreamChatTongyi 用 run_context() 显式切换到对应的 chat span。
+"""
+from contextlib import contextmanager
+from typing import Any, Dict, Optional
+from uuid import UUID
+
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.runnables.config import var_child_runnable_config
+from opentelemetry import context, trace
+from opentelemetry.trace import Status, StatusCode
+
+from app.agent_utils import tracing
+from app.agent_utils.tracing import INPUT_TOKENS_ATTR, MODEL_ATTR, OUTPUT_TOKENS_ATTR
+
+
+def _token_usage(response: Any) -> Dict[str, int]:
+    """从 LLMResult 中取出 token 用量：优先 generation_info["token_usage"]（DashScope 原始 usage），其次 usage_metadata"""
+    try:
+        generation = response.generations[0][0]
+    except (AttributeError, IndexError):
+        return {}
+    usage = (generation.generation_info or {}).get("token_usage")
+    if not usage:
+        usage = getattr(getattr(generation, "message", None), "usage_metadata", None)
+    if not usage:
+        return {}
+    return {"input": usage.get("input_tokens", 0), "output": usage.get("output_tokens", 0)}
+
+
+class GraphTracingHandler(BaseCallbackHandler):
+    # 只做字典操作与创建 span，直接在调用线程中执行
+    run_inline = True
+
+    def __init__(self):
+        # 进行中的 run -> 父 run（所有 run 都记录，用于向上查找最近的带 span 的祖先）
+        self._parents: Dict[UUID, Optional[UUID]] = {}
+        # 进行中且创建了 span 的 run -> span
+        self._spans: Dict[UUID, trace.Span] = {}
+
+    def span_of(self, run_id: Optional[UUID]) -> Optional[trace.Span]:
+        """run 自身或最近的祖先 run 的 span"""
+        while run_id is not None:
+            span = self._spans.get(run_id)
+            if span is not None:
+                return span
+            run_id = self._parents.get(run_id)
+        return None
+
+    def parent_context(self) -> Optional[context.Context]:
+        """
+        当前所在的 LangChain run（节点 / 工具）的 span 上下文，供 tracing.span / upstream_span 作为父 span
+
+        当前 span 比该 run 的 span 开始得晚时（例如 run_context() 切换到的 chat span、节点内自己创建的 span），
+        它才是更内层的那个，返回 None 沿用当前上下文
+        """
+        config = var_child_runnable_config.get()
+        manager = config.get("callbacks") if config else None
+        span = self.span_of(getattr(manager, "parent_run_id", None))
+        if span is None:
+            return None
+        current = trace.get_current_span()
+        if (getattr(current, "start_time", None) or 0) >= span.start_time:
+            return None
+        return trace.set_span_in_context(span)
+
+    @contextmanager
+    def run_context(self, run_manager: Any):
+        """在 with 块内把 run_manager 对应 run 的 span 设为当前 span（必须在同一个上下文中进入与退出）"""
+        span = self.span_of(getattr(run_manager, "run_id", None))
+        if span is None:
+            yield
+            return
+        token = context.attach(trace.set_span_in_context(span))
+        try:
+            yield
+        finally:
+            context.detach(token)
+
+    def _track(self, run_id: UUID, parent_run_id: Optional[UUID]):
+        self._parents[run_id] = parent_run_id
+
+    def _start(self, run_id: UUID, parent_run_id: Optional[UUID], name: str, attributes: dict):
+        self._parents[run_id] = parent_run_id
+        parent = self.span_of(parent_run_id)
+        # 图的最外层 run 没有带 span 的祖先，挂在当前上下文（analysis span）下
+        parent_ctx = trace.set_span_in_context(parent) if parent is not None else None
+        self._spans[run_id] = tracing.tracer.start_span(name, context=parent_ctx, attributes=attributes)
+
+    def _finish(self, run_id: UUID, error: Optional[BaseException] = None, attributes: Optional[dict] = None):
+        self._parents.pop(run_id, None)
+        span = self._spans.pop(run_id, None)
+        if span is None:
+            return
+        if attributes:
+            span.set_attributes(attributes)
+        if error is not None:
+            span.record_exception(error)
+            span.set_status(Status(StatusCode.ERROR, type(error).__name__))
+        span.end()
+
+    def on_chain_start(self, serialized: Optional[dict], inputs: Any, *, run_id: UUID,
+                       parent_run_id: Optional[UUID] = None, metadata: Optional[dict] = None, **kwargs: Any):
+        metadata = metadata or {}
+        node = metadata.get("langgraph_node")
+        if node and kwargs.get("name") == node:
+            self._start(run_id, parent_run_id, f"node {node}", {
+                "langgraph.node": node,
+                "langgraph.step": metadata.get("langgraph_step", -1),
+            })
+        else:
+            self._track(run_id, parent_run_id)
+
+    def on_chain_end(self, outputs: Any, *, run_id: UUID, **kwargs: Any):
+        self._finish(run_id)
+
+    def on_chain_error(self, error: BaseException, *, run_id: UUID, **kwargs: Any):
+        self._finish(run_id, error)
+
+    def on_chat_model_start(self, serialized: Optional[dict], messages: Any, *, run_id: UUID,
+                            parent_run_id: Optional[UUID] = None, metadata: Optional[dict] = None, **kwargs: Any):
+        model = (metadata or {}).get("ls_model_name") or "unknown"
+        self._start(run_id, parent_run_id, f"chat {model}", {
+            "gen_ai.operation.name": "chat",
+            "gen_ai.system": "dashscope",
+            MODEL_ATTR: model,
+        })
+
+    def on_llm_end(self, response: Any, *, run_id: UUID, **kwargs: Any):
+        usage = _token_usage(response)
+        self._finish(run_id, attributes={
+            INPUT_TOKENS_ATTR: usage["input"], OUTPUT_TOKENS_ATTR: usage["output"],
+        } if usage else None)
+
+    def on_llm_error(self, error: BaseException, *, run_id: UUID, **kwargs: Any):
+        self._finish(run_id, error)
+
+    def on_tool_start(self, serialized: Optional[dict], input_str: str, *, run_id: UUID,
+                      parent_run_id: Optional[UUID] = None, **kwargs: Any):
+        name = kwargs.get("name") or (serialized or {}).get("name") or "unknown"
+        self._start(run_id, parent_run_id, f"execute_tool {name}", {
+            "gen_ai.operation.name": "execute_tool",
+            "gen_ai.tool.name": name,
+        })
+
+    def on_tool_end(self, output: Any, *, run_id: UUID, **kwargs: Any):
+        self._finish(run_id)
+
+    def on_tool_error(self, error: BaseException, *, run_id: UUID, **kwargs: Any):
+        self._finish(run_id, error)
+
+
+graph_tracing = GraphTracingHandler()
+tracing.set_parent_resolver(graph_tracing.parent_context)
@@ -0,0 +1,138 @@
+"""
+视觉模型调用前的图片归一化：按 EXIF 方向摆正、限制最长边、去除元数据并重新压缩编码
+
+手机原图动辄 4-10 MB，base64 之后还要再大 33%，直接发给 qwen3-vl-plus 既慢又费 token。
+解码/缩放属于 CPU 密集操作，异步入口放到进程池中执行，不占用事件循环。
+"""
+import asyncio
+import io
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Optional, Tuple
+
+from PIL import Image, ImageOps
+
+from app.agent_utils import metrics
+from app.agent_utils.process_pic import ImageInput
+
+# 归一化参数，均可通过环境变量调整
+IMAGE_PREPROCESS = os.getenv("IMAGE_PREPROCESS", "1") == "1"
+IMAGE_MAX_EDGE = int(os.getenv("IMAGE_MAX_EDGE", "1280"))
+IMAGE_OUTPUT_FORMAT = os.getenv("IMAGE_OUTPUT_FORMAT", "JPEG").upper()  # JPEG / WEBP
+IMAGE_QUALITY = int(os.getenv("IMAGE_QUALITY", "85"))
+IMAGE_PREPROCESS_WORKERS = int(os.getenv("IMAGE_PREPROCESS_WORKERS", str(min(4, os.cpu_count() or 1))))
+
+_OUTPUT_MIME = {"JPEG": "image/jpeg", "WEBP": "image/webp"}
+
+_pool: Optional[ProcessPoolExecutor] = None
+
+
+def get_image_pool() -> ProcessPoolExecutor:
+    """
+    返回图片处理进程池单例
+    """
+    global _pool
+    if _pool is None:
+        _pool = ProcessPoolExecutor(max_workers=IMAGE_PREPROCESS_WORKERS)
+    return _pool
+
+
+def _noop():
+    return None
+
+
+async def warm_up_image_pool():
+    """提前拉起进程池中的 worker 进程，避免首个请求承担进程创建开销"""
+    loop = asyncio.get_running_loop()
+    pool = get_image_pool()
+    await asyncio.gather(*(loop.run_in_executor(pool, _noop) for _ in range(IMAGE_PREPROCESS_WORKERS)))
+
+
+def shutdown_image_pool():
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(wait=False, cancel_futures=True)
+        _pool = None
+
+
+def normalize_image(data: bytes, max_edge: int = IMAGE_MAX_EDGE,
+                    output_format: str = IMAGE_OUTPUT_FORMAT, quality: int = IMAGE_QUALITY) -> Tuple[bytes, str]:
+    """
+    归一化单张图片，返回 (新图片字节, MIME 类型)
+
+    重新编码时不写入 EXIF/ICC 等元数据；动图只保留第一帧。
+    """
+    with Image.open(io.BytesIO(data)) as img:
+        img = ImageOps.exif_transpose(img)
+
+        if img.mode in ("RGBA", "LA") or (img.mode == "P" and "transparency" in img.info):
+            # 透明背景铺白，避免转 RGB 时变黑
+            rgba = img.convert("RGBA")
+            img = Image.new("RGB", rgba.size, (255, 255, 255))
+            img.paste(rgba, mask=rgba.getchannel("A"))
+        elif img.mode not in ("RGB", "L"):
+            img = img.convert("RGB")
+
+        img.thumbnail((max_edge, max_edge), Image.Resampling.LANCZOS)
+
+        out = io.BytesIO()
+        img.save(out, format=output_format, quality=quality, optimize=True)
+        return out.getvalue(), _OUTPUT_MIME.get(output_format, "image/jpeg")
+
+
+def read_image(image: ImageInput) -> bytes:
+    """读取图片字节：路径从磁盘读，bytes-like 对象转为 bytes"""
+    if isinstance(image, str):
+        with open(image, "rb") as f:
+            return f.read()
+    return bytes(image)
+
+
+def _record(bytes_in: int, bytes_sent: int, elapsed: float):
+    metrics.incr("image_preprocess_images")
+    metrics.incr("image_preprocess_bytes_in", bytes_in)
+    metrics.incr("image_preprocess_bytes_sent", bytes_sent)
+    metrics.observe("image_preprocess_seconds", elapsed)
+
+
+def preprocess_image(image: ImageInput, mime_type: Optional[str] = None) -> Tuple[ImageInput, Optional[str]]:
+    """
+    同步归一化入口；未开启或解码失败时原样返回，交由视觉模型判定图片是否可用
+    """
+    if not IMAGE_PREPROCESS:
+        return image, mime_type
+
+    data = read_image(image)
+    start = time.perf_counter()
+    try:
+        out, out_mime = normalize_image(data)
+    except Exception as e:
+        print(f"[图片预处理失败] 使用原图: {e}")
+        metrics.incr("image_preprocess_failures")
+        return data, mime_type
+
+    _record(len(data), len(out), time.perf_counter() - start)
+    return out, out_mime
+
+
+async def apreprocess_image(image: ImageInput, mime_type: Optional[str] = None) -> Tuple[ImageInput, Optional[str]]:
+    """
+    异步归一化入口，在进程池中执行解码与重新编码
+    """
+    if not IMAGE_PREPROCESS:
+        return image, mime_type
+
+    # 进程间只能传递可 pickle 的 bytes，memoryview 需要先转成 bytes
+    data = await asyncio.to_thread(read_image, image) if isinstance(image, str) else bytes(image)
+    start = time.perf_counter()
+    try:
+        loop = asyncio.get_running_loop()
+        out, out_mime = await loop.run_in_executor(get_image_pool(), normalize_image, data)
+    except Exception as e:
+        print(f"[图片预处理失败] 使用原图: {e}")
+        metrics.incr("image_preprocess_failures")
+        return data, mime_type
+
+    _record(len(data), len(out), time.perf_counter() - start)
+    return out, out_mime
@@ -0,0 +1,102 @@
+"""
+视觉模型调用前的本地图片质量预检：解码校验、最小分辨率、模糊度（拉普拉斯方差）、曝光（亮度直方图）
+
+VISION_NODE_PROMPT 会让 qwen3-vl-plus 拒绝模糊、曝光不足或无法识别的图片，但那需要一次完整的多模态调用（数秒）。
+这里用 NumPy 做几项向量化的廉价检测，只在把握很大时直接判为无效图片，拿不准的仍交给视觉模型判定。
+"""
+import asyncio
+import io
+import os
+import time
+from typing import Optional
+
+import numpy as np
+from PIL import Image
+
+from app.agent_utils import metrics
+from app.agent_utils.process_pic import ImageInput
+from app.agent_utils.image_preprocess import get_image_pool, read_image
+
+# 阈值均可通过环境变量调整；默认值偏保守，宁可放过也不误杀
+IMAGE_QUALITY_CHECK = os.getenv("IMAGE_QUALITY_CHECK", "1") == "1"
+IMAGE_QUALITY_MIN_EDGE = int(os.getenv("IMAGE_QUALITY_MIN_EDGE", "128"))           # 短边像素下限
+IMAGE_QUALITY_BLUR_THRESHOLD = float(os.getenv("IMAGE_QUALITY_BLUR_THRESHOLD", "10"))  # 拉普拉斯方差下限
+IMAGE_QUALITY_DARK_LEVEL = int(os.getenv("IMAGE_QUALITY_DARK_LEVEL", "30"))         # 低于该亮度视为欠曝像素
+IMAGE_QUALITY_BRIGHT_LEVEL = int(os.getenv("IMAGE_QUALITY_BRIGHT_LEVEL", "240"))    # 高于该亮度视为过曝像素
+IMAGE_QUALITY_EXPOSURE_RATIO = float(os.getenv("IMAGE_QUALITY_EXPOSURE_RATIO", "0.95"))  # 欠/过曝像素占比上限
+IMAGE_QUALITY_MIN_CONTRAST = float(os.getenv("IMAGE_QUALITY_MIN_CONTRAST", "6"))    # 亮度标准差下限（纯色图）
+
+# 检测统一在该尺寸下进行，使模糊度阈值与原图分辨率无关，同时限制计算量
+_ANALYSIS_EDGE = 512
+
+
+def assess_image(data: bytes) -> Optional[str]:
+    """
+    检测单张图片，返回不合格原因；通过检测（或无法确定）时返回 None
+
+    返回的原因字符串与视觉模型的 reason 同一口径，直接作为 error_reason 返回给用户。
+    """
+    try:
+        with Image.open(io.BytesIO(data)) as img:
+            width, height = img.size
+            if min(width, height) < IMAGE_QUALITY_MIN_EDGE:
+                return f"图片分辨率过低（{width}x{height}），无法看清食物，请上传更清晰的照片"
+
+            # JPEG 可以直接按缩小后的尺寸解码，省去大部分解码开销
+            img.draft("L", (_ANALYSIS_EDGE, _ANALYSIS_EDGE))
+            gray = img.convert("L")
+            gray.thumbnail((_ANALYSIS_EDGE, _ANALYSIS_EDGE), Image.Resampling.BILINEAR)
+            luma = np.asarray(gray, dtype=np.float32)
+    except Exception:
+        # 截断、格式不支持、像素数超过解压上限等
+        return "上传的文件不是图片或无法识别"
+
+    hist = np.bincount(luma.astype(np.uint8).ravel(), minlength=256)
+    total = luma.size
+    if hist[:IMAGE_QUALITY_DARK_LEVEL].sum() / total > IMAGE_QUALITY_EXPOSURE_RATIO:
+        return "图片曝光不足，画面过暗，无法看清食物"
+    if hist[IMAGE_QUALITY_BRIGHT_LEVEL:].sum() / total > IMAGE_QUALITY_EXPOSURE_RATIO:
+        return "图片曝光过度，画面过亮，无法看清食物"
+
+    if luma.std() < IMAGE_QUALITY_MIN_CONTRAST:
+        return "图片内容为纯色或几乎没有细节，未检测到食物"
+
+    # 4 邻域拉普拉斯算子，方差越小说明边缘越少、画面越模糊
+    laplacian = (luma[:-2, 1:-1] + luma[2:, 1:-1] + luma[1:-1, :-2] + luma[1:-1, 2:]
+                 - 4 * luma[1:-1, 1:-1])
+    if laplacian.var() < IMAGE_QUALITY_BLUR_THRESHOLD:
+        return "图片过度模糊，无法看清食物"
+
+    return None
+
+
+def _record(reason: Optional[str], elapsed: float):
+    metrics.observe("image_quality_seconds", elapsed)
+    if reason is not None:
+        # 每次拒绝都省掉了一次视觉模型调用（后续的分析子图也不会执行）
+        metrics.incr("image_quality_rejected")
+        metrics.incr("vision_calls_saved")
+
+
+def check_image_quality(image: ImageInput) -> Optional[str]:
+    """同步预检入口；未开启时直接返回 None"""
+    if not IMAGE_QUALITY_CHECK:
+        return None
+
+    start = time.perf_counter()
+    reason = assess_image(read_image(image))
+    _record(reason, time.perf_counter() - start)
+    return reason
+
+
+async def acheck_image_quality(image: ImageInput) -> Optional[str]:
+    """异步预检入口，解码与计算放到图片进程池中执行"""
+    if not IMAGE_QUALITY_CHECK:
+        return None
+
+    data = await asyncio.to_thread(read_image, image) if isinstance(image, str) else bytes(image)
+    start = time.perf_counter()
+    loop = asyncio.get_running_loop()
+    reason = await loop.run_in_executor(get_image_pool(), assess_image, data)
+    _record(reason, time.perf_counter() - start)
+    return reason
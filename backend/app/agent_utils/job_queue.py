@@ -0,0 +1,301 @@
+"""
+异步分析任务队列：POST /jobs 入队后立即返回 job_id，固定数量的 worker 以有限并发执行分析
+
+任务（含待分析图片）保存在可替换的存储中：
+- InMemoryJobStore：进程内字典，进程退出即丢失
+- SqliteJobStore：SQLite 文件，进程重启后未完成的任务会重新入队
+
+worker 按提交顺序挑选任务，但跳过暂时不能执行的用户（同一用户正在执行的任务已达 user_max_running，
+或 can_run 判断该用户已达准入的在途上限），避免 worker 停在准入排队上、被一个用户的任务全部占住。
+用户的名额空出后通过 wake() 通知 worker 重新挑选。
+"""
+import asyncio
+import json
+import sqlite3
+import threading
+import time
+import uuid
+from collections import Counter, deque
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+from app.agent_utils import metrics
+from models.schemas import ApiResponse, JobInfo
+
+# 任务执行函数：(username, 图片字节, MIME 类型) -> ApiResponse
+JobRunner = Callable[[str, bytes, str], Awaitable[ApiResponse]]
+
+
+class QueueFullError(Exception):
+    """排队任务数达到上限"""
+
+
+class InMemoryJobStore:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._jobs: Dict[str, JobInfo] = {}
+        self._images: Dict[str, tuple] = {}
+
+    def create(self, job: JobInfo, image: bytes, mime_type: str):
+        with self._lock:
+            self._jobs[job.job_id] = job
+            self._images[job.job_id] = (image, mime_type)
+
+    def get(self, job_id: str) -> Optional[JobInfo]:
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return job.model_copy() if job else None
+
+    def load_image(self, job_id: str) -> Optional[tuple]:
+        with self._lock:
+            return self._images.get(job_id)
+
+    def update(self, job_id: str, **fields):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return
+            self._jobs[job_id] = job.model_copy(update={**fields, "updated_at": time.time()})
+            # 任务结束后图片不再需要
+            if fields.get("status") in ("done", "failed"):
+                self._images.pop(job_id, None)
+
+    def unfinished(self) -> List[JobInfo]:
+        with self._lock:
+            return [job for job in self._jobs.values() if job.status in ("queued", "running")]
+
+    def purge(self, older_than: float):
+        """删除在 older_than 之前结束的任务"""
+        with self._lock:
+            expired = [
+                job_id for job_id, job in self._jobs.items()
+                if job.status in ("done", "failed") and job.updated_at < older_than
+            ]
+            for job_id in expired:
+                self._jobs.pop(job_id, None)
+                self._images.pop(job_id, None)
+
+    def close(self):
+        pass
+
+
+class SqliteJobStore:
+    def __init__(self, db_path="jobs.db"):
+        self._lock = threading.Lock()
+        # 1. 建立数据库连接（worker 通过线程池访问）
+        self.conn = sqlite3.connect(db_path, check_same_thread=False)
+        # 2. 初始化表结构
+        self._create_tables()
+
+    def _create_tables(self):
+        self.conn.executescript("""
+        CREATE TABLE IF NOT EXISTS analysis_jobs (
+            job_id TEXT PRIMARY KEY,
+            username TEXT NOT NULL,
+            status TEXT NOT NULL,
+            result TEXT,
+            image BLOB,
+            mime_type TEXT,
+            created_at REAL NOT NULL,
+            updated_at REAL NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS idx_analysis_jobs_status ON analysis_jobs(status);
+        """)
+        self.conn.commit()
+
+    def close(self):
+        with self._lock:
+            if self.conn:
+                self.conn.close()
+                self.conn = None
+
+    def create(self, job: JobInfo, image: bytes, mime_type: str):
+        with self._lock:
+            self.conn.execute(
+                "INSERT INTO analysis_jobs (job_id, username, status, result, image, mime_type, created_at, updated_at) "
+                "VALUES (?, ?, ?, NULL, ?, ?, ?, ?)",
+                (job.job_id, job.username, job.status, sqlite3.Binary(image), mime_type,
+                 job.created_at, job.updated_at)
+            )
+            self.conn.commit()
+
+    def get(self, job_id: str) -> Optional[JobInfo]:
+        with self._lock:
+            row = self.conn.execute(
+                "SELECT job_id, username, status, result, created_at, updated_at FROM analysis_jobs WHERE job_id = ?",
+                (job_id,)
+            ).fetchone()
+        return self._row_to_job(row) if row else None
+
+    def load_image(self, job_id: str) -> Optional[tuple]:
+        with self._lock:
+            row = self.conn.execute(
+                "SELECT image, mime_type FROM analysis_jobs WHERE job_id = ? AND image IS NOT NULL",
+                (job_id,)
+            ).fetchone()
+        return (bytes(row[0]), row[1]) if row else None
+
+    def update(self, job_id: str, **fields):
+        status = fields.get("status")
+        result = fields.get("result")
+        with self._lock:
+            if status in ("done", "failed"):
+                # 任务结束后清掉图片，只保留结果
+                self.conn.execute(
+                    "UPDATE analysis_jobs SET status = ?, result = ?, image = NULL, updated_at = ? WHERE job_id = ?",
+                    (status, json.dumps(result, ensure_ascii=False), time.time(), job_id)
+                )
+            else:
+                self.conn.execute(
+                    "UPDATE analysis_jobs SET status = ?, updated_at = ? WHERE job_id = ?",
+                    (status, time.time(), job_id)
+                )
+            self.conn.commit()
+
+    def unfinished(self) -> List[JobInfo]:
+        with self._lock:
+            rows = self.conn.execute(
+                "SELECT job_id, username, status, result, created_at, updated_at FROM analysis_jobs "
+                "WHERE status IN ('queued', 'running') ORDER BY created_at"
+            ).fetchall()
+        return [self._row_to_job(row) for row in rows]
+
+    def purge(self, older_than: float):
+        with self._lock:
+            self.conn.execute(
+                "DELETE FROM analysis_jobs WHERE status IN ('done', 'failed') AND updated_at < ?",
+                (older_than,)
+            )
+            self.conn.commit()
+
+    @staticmethod
+    def _row_to_job(row) -> JobInfo:
+        job_id, username, status, result, created_at, updated_at = row
+        return JobInfo(
+            job_id=job_id,
+            username=username,
+            status=status,
+            result=json.loads(result) if result else None,
+            created_at=created_at,
+            updated_at=updated_at,
+        )
+
+
+class JobQueue:
+    def __init__(self, store, runner: JobRunner, workers: int = 4,
+                 max_pending: int = 1000, result_ttl: float = 3600, user_max_running: int = 0,
+                 can_run: Optional[Callable[[str], bool]] = None):
+        """
+        :param store: 任务存储（InMemoryJobStore / SqliteJobStore）
+        :param runner: 执行单个分析任务的协程函数
+        :param workers: worker 数量，即同时执行的分析任务上限
+        :param max_pending: 排队任务数上限，超出时拒绝新任务
+        :param result_ttl: 已结束任务的保留秒数
+        :param user_max_running: 单个用户同时执行的任务数上限，<= 0 时不限
+        :param can_run: 判断用户当前能否开始新任务（例如准入控制的 has_room），为 None 时总是可以
+        """
+        self.store = store
+        self.runner = runner
+        self.workers = workers
+        self.max_pending = max_pending
+        self.result_ttl = result_ttl
+        self.user_max_running = user_max_running
+        self.can_run = can_run
+
+        # 等待执行的 (job_id, username)，按提交顺序排列
+        self._pending: "deque[Tuple[str, str]]" = deque()
+        self._running: Counter = Counter()
+        self._changed: Optional[asyncio.Event] = None
+        self._tasks: List[asyncio.Task] = []
+        self._completed = 0
+
+    async def start(self):
+        self._changed = asyncio.Event()
+        # 上次进程退出时没跑完的任务重新入队（running 的任务从头再跑一次）
+        for job in await asyncio.to_thread(self.store.unfinished):
+            await asyncio.to_thread(self.store.update, job.job_id, status="queued")
+            self._pending.append((job.job_id, job.username))
+        await asyncio.to_thread(self.store.purge, time.time() - self.result_ttl)
+
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        self.store.close()
+
+    async def submit(self, username: str, image: bytes, mime_type: str) -> JobInfo:
+        if len(self._pending) >= self.max_pending:
+            raise QueueFullError(f"排队任务已达上限 {self.max_pending}")
+
+        now = time.time()
+        job = JobInfo(job_id=uuid.uuid4().hex, username=username, status="queued",
+                      created_at=now, updated_at=now)
+        await asyncio.to_thread(self.store.create, job, image, mime_type)
+        self._pending.append((job.job_id, username))
+        self.wake()
+        metrics.incr("jobs_submitted")
+        return job
+
+    async def get(self, job_id: str) -> Optional[JobInfo]:
+        return await asyncio.to_thread(self.store.get, job_id)
+
+    def depth(self) -> int:
+        return len(self._pending)
+
+    def wake(self):
+        """有新任务或有用户空出名额时调用，让空闲的 worker 重新挑选任务"""
+        if self._changed is not None:
+            self._changed.set()
+
+    def _runnable(self, username: str) -> bool:
+        if 0 < self.user_max_running <= self._running[username]:
+            return False
+        return self.can_run is None or self.can_run(username)
+
+    async def _next_job(self) -> Tuple[str, str]:
+        """按提交顺序取出第一个可以执行的任务，没有时等待 wake()"""
+        while True:
+            # 先清除再挑选：挑选过程中没有 await，之后的 wake() 不会丢失
+            self._changed.clear()
+            for index, (job_id, username) in enumerate(self._pending):
+                if self._runnable(username):
+                    del self._pending[index]
+                    self._running[username] += 1
+                    return job_id, username
+            await self._changed.wait()
+
+    async def _worker(self):
+        while True:
+            job_id, username = await self._next_job()
+            try:
+                await self._run_job(job_id)
+            finally:
+                self._running[username] -= 1
+                if not self._running[username]:
+                    del self._running[username]
+                self.wake()
+
+    async def _run_job(self, job_id: str):
+        job = await asyncio.to_thread(self.store.get, job_id)
+        image = await asyncio.to_thread(self.store.load_image, job_id)
+        if job is None or image is None:
+            return
+
+        await asyncio.to_thread(self.store.update, job_id, status="running")
+        try:
+            response = await self.runner(job.username, image[0], image[1])
+            status = "failed" if response.status == "error" else "done"
+        except Exception as e:
+            response = ApiResponse(status="error", message=str(e))
+            status = "failed"
+
+        await asyncio.to_thread(self.store.update, job_id, status=status, result=response.model_dump())
+        metrics.incr(f"jobs_{status}")
+        metrics.observe("job_latency_seconds", time.time() - job.created_at)
+
+        # 定期清理过期的已结束任务
+        self._completed += 1
+        if self._completed % 100 == 0:
+            await asyncio.to_thread(self.store.purge, time.time() - self.result_ttl)
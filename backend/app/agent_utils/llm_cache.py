@@ -0,0 +1,111 @@
+"""
+文本模型响应缓存（默认关闭，LLM_CACHE=1 开启）
+
+食堂套餐的视觉报告高度重复，temperature=0 时 searching_llm / summarize_llm 的输入完全相同，结果也相同。
+LLMResponseCache 实现 LangChain 的 BaseCache，通过 ChatTongyi(cache=...) 挂在 get_llm() 返回的模型上，
+因此 bind_tools 与 with_structured_output(NutritionReport) 的调用都会经过它（缓存的是模型原始输出，结构化解析在其后）。
+
+缓存键 = 模型名 + temperature + 归一化的消息列表 + LangChain 给出的 llm_string（包含绑定的工具 / 输出 schema）：
+- 消息只保留类型、内容、名称与工具调用，去掉 id、response_metadata、token 用量等每次都不同的字段
+- 工具调用 id 由模型随机生成，按出现顺序替换为序号，不影响命中
+存储复用 TieredCache（内存 LRU + SQLite，带 TTL 与条目上限），单条超过 LLM_CACHE_MAX_VALUE_BYTES 的响应不入缓存。
+"""
+import hashlib
+import json
+import os
+from typing import Any, Optional, Sequence
+
+from langchain_core.caches import BaseCache
+from langchain_core.load import dumps, loads
+from langchain_core.messages import AIMessage, ToolMessage
+
+from app.agent_utils import metrics
+from app.agent_utils.tiered_cache import TieredCache
+
+LLM_CACHE = os.getenv("LLM_CACHE", "0") == "1"
+LLM_CACHE_MAX_ENTRIES = int(os.getenv("LLM_CACHE_MAX_ENTRIES", "1024"))
+LLM_CACHE_MAX_DISK_ENTRIES = int(os.getenv("LLM_CACHE_MAX_DISK_ENTRIES", "20000"))
+LLM_CACHE_TTL = float(os.getenv("LLM_CACHE_TTL", str(24 * 3600)))
+LLM_CACHE_DB = os.getenv("LLM_CACHE_DB", "llm_cache.db")  # 为空时只使用内存层
+LLM_CACHE_MAX_VALUE_BYTES = int(os.getenv("LLM_CACHE_MAX_VALUE_BYTES", str(64 * 1024)))
+
+_store: Optional[TieredCache] = None
+
+
+def _get_store() -> TieredCache:
+    """各模型共用一个存储，键中已包含模型名"""
+    global _store
+    if _store is None:
+        _store = TieredCache(
+            name="llm_cache",
+            max_entries=LLM_CACHE_MAX_ENTRIES,
+            ttl=LLM_CACHE_TTL,
+            sqlite_path=LLM_CACHE_DB or None,
+            max_disk_entries=LLM_CACHE_MAX_DISK_ENTRIES,
+        )
+    return _store
+
+
+def normalize_messages(prompt: str) -> list:
+    """把 LangChain 序列化后的消息列表归一化为只含语义字段的结构"""
+    call_ids = {}
+
+    def call_id(raw: str) -> int:
+        return call_ids.setdefault(raw, len(call_ids))
+
+    normalized = []
+    for message in loads(prompt, allowed_objects="messages"):
+        content = message.content.strip() if isinstance(message.content, str) else message.content
+        item = {"type": message.type, "content": content}
+        if message.name:
+            item["name"] = message.name
+        if isinstance(message, AIMessage) and message.tool_calls:
+            item["tool_calls"] = [
+                {"name": call["name"], "args": call["args"], "id": call_id(call["id"])}
+                for call in message.tool_calls
+            ]
+        if isinstance(message, ToolMessage):
+            item["tool_call_id"] = call_id(message.tool_call_id)
+        normalized.append(item)
+    return normalized
+
+
+class LLMResponseCache(BaseCache):
+    def __init__(self, model: str, temperature: float, store: Optional[TieredCache] = None):
+        self.model = model
+        self.temperature = temperature
+        self.store = store or _get_store()
+
+    def _key(self, prompt: str, llm_string: str) -> str:
+        payload = json.dumps(
+            [self.model, self.temperature, normalize_messages(prompt), llm_string],
+            ensure_ascii=False, sort_keys=True, default=str,
+        )
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def lookup(self, prompt: str, llm_string: str) -> Optional[Sequence[Any]]:
+        value = self.store.get(self._key(prompt, llm_string))
+        if value is None:
+            metrics.incr("llm_cache_misses")
+            return None
+        metrics.incr("llm_cache_hits")
+        # 缓存值是 ChatGeneration 列表，只允许反序列化 langchain_core 内置类型
+        return loads(value, allowed_objects="core")
+
+    def update(self, prompt: str, llm_string: str, return_val: Sequence[Any]) -> None:
+        value = dumps(list(return_val))
+        if len(value.encode("utf-8")) > LLM_CACHE_MAX_VALUE_BYTES:
+            metrics.incr("llm_cache_oversized")
+            return
+        self.store.set(self._key(prompt, llm_string), value)
+
+    def clear(self, **kwargs: Any) -> None:
+        # 各模型共用存储，清空即全部清空
+        self.store.clear()
+
+
+def get_llm_cache(model: str, temperature: float) -> Optional[LLMResponseCache]:
+    """LLM_CACHE=1 时返回该模型的缓存，否则返回 None（ChatTongyi 的 cache=None 表示不缓存）"""
+    if not LLM_CACHE:
+        return None
+    return LLMResponseCache(model, temperature)
@@ -0,0 +1,169 @@
+"""
+进程内的轻量指标注册表：计数器、瞬时值、耗时/大小观测值与带标签的直方图，
+供 /stats 接口导出，render_prometheus() 以 Prometheus 文本格式导出给 /metrics
+"""
+import math
+import re
+import threading
+from collections import defaultdict
+from typing import Dict, Optional, Sequence, Tuple
+
+_lock = threading.Lock()
+_counters = defaultdict(float)
+_gauges = {}
+_observations = defaultdict(lambda: {"count": 0, "sum": 0.0, "max": 0.0})
+# (名称, 排序后的标签) -> 累计值 / 直方图
+_labeled_counters: Dict[Tuple[str, tuple], float] = defaultdict(float)
+_histograms: Dict[Tuple[str, tuple], dict] = {}
+
+# 常用的直方图分桶
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2, 5, 10, 20, 30, 60)
+SIZE_BUCKETS = (16 * 1024, 64 * 1024, 256 * 1024, 1024 ** 2, 2 * 1024 ** 2, 5 * 1024 ** 2, 10 * 1024 ** 2)
+COUNT_BUCKETS = (0, 1, 2, 3, 4, 5, 6, 8, 10, 15)
+
+
+def incr(name: str, value: float = 1, labels: Optional[Dict[str, str]] = None):
+    """计数器累加；带 labels 时按标签分别计数（只出现在 /metrics 中）"""
+    with _lock:
+        if labels:
+            _labeled_counters[(name, _label_key(labels))] += value
+        else:
+            _counters[name] += value
+
+
+def set_gauge(name: str, value: float):
+    """瞬时值（队列深度、在途数等），只保留最新一次"""
+    with _lock:
+        _gauges[name] = value
+
+
+def observe(name: str, value: float, buckets: Optional[Sequence[float]] = None):
+    """记录一次观测值（耗时、字节数等），保留次数、总和与最大值；给出 buckets 时同时记入同名直方图"""
+    with _lock:
+        obs = _observations[name]
+        obs["count"] += 1
+        obs["sum"] += value
+        obs["max"] = max(obs["max"], value)
+    if buckets is not None:
+        histogram(name, value, buckets=buckets)
+
+
+def histogram(name: str, value: float, labels: Optional[Dict[str, str]] = None,
+              buckets: Sequence[float] = LATENCY_BUCKETS):
+    """记录一次直方图观测；同一名称应始终使用同一组分桶"""
+    key = (name, _label_key(labels or {}))
+    with _lock:
+        hist = _histograms.get(key)
+        if hist is None:
+            hist = _histograms[key] = {"buckets": tuple(buckets), "counts": [0] * len(buckets), "count": 0, "sum": 0.0}
+        hist["count"] += 1
+        hist["sum"] += value
+        for i, bound in enumerate(hist["buckets"]):
+            if value <= bound:
+                hist["counts"][i] += 1
+
+
+def average(name: str, default: float = 0.0) -> float:
+    """观测值的平均数，尚无观测时返回 default"""
+    with _lock:
+        obs = _observations.get(name)
+        return obs["sum"] / obs["count"] if obs and obs["count"] else default
+
+
+def snapshot() -> dict:
+    """返回当前全部指标的快照"""
+    with _lock:
+        return {
+            "counters": dict(_counters),
+            "gauges": dict(_gauges),
+            "observations": {
+                name: {**obs, "avg": obs["sum"] / obs["count"] if obs["count"] else 0.0}
+                for name, obs in _observations.items()
+            },
+        }
+
+
+_NAME_RE = re.compile(r"[^a-zA-Z0-9_:]")
+
+
+def _label_key(labels: Dict[str, str]) -> tuple:
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def _metric_name(name: str) -> str:
+    name = _NAME_RE.sub("_", name)
+    return f"_{name}" if name[:1].isdigit() else name
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(labels: tuple, extra: tuple = ()) -> str:
+    items = labels + extra
+    if not items:
+        return ""
+    return "{" + ",".join(f'{_metric_name(k)}="{_escape(v)}"' for k, v in items) + "}"
+
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(float(value))
+
+
+def render_prometheus() -> str:
+    """
+    以 Prometheus 文本格式（0.0.4）导出全部指标
+
+    - 计数器 -> counter（名称加 _total），瞬时值 -> gauge
+    - 观测值 -> summary（_count / _sum）外加 _max gauge；同名直方图存在时只导出直方图与 _max
+    - 直方图 -> histogram（_bucket / _count / _sum）
+    """
+    with _lock:
+        counters = dict(_counters)
+        labeled = dict(_labeled_counters)
+        gauges = dict(_gauges)
+        observations = {name: dict(obs) for name, obs in _observations.items()}
+        histograms = {key: {**hist, "counts": list(hist["counts"])} for key, hist in _histograms.items()}
+
+    lines = []
+    by_counter = defaultdict(list)
+    for name, value in counters.items():
+        by_counter[name].append(((), value))
+    for (name, labels), value in labeled.items():
+        by_counter[name].append((labels, value))
+    for name in sorted(by_counter):
+        metric = _metric_name(name) + "_total"
+        lines.append(f"# TYPE {metric} counter")
+        lines.extend(f"{metric}{_format_labels(labels)} {_format_value(v)}" for labels, v in by_counter[name])
+
+    for name in sorted(gauges):
+        metric = _metric_name(name)
+        lines.append(f"# TYPE {metric} gauge")
+        lines.append(f"{metric} {_format_value(gauges[name])}")
+
+    histogram_names = {name for name, _ in histograms}
+    for name in sorted(observations):
+        obs, metric = observations[name], _metric_name(name)
+        if name not in histogram_names:
+            lines.append(f"# TYPE {metric} summary")
+            lines.append(f"{metric}_count {obs['count']}")
+            lines.append(f"{metric}_sum {_format_value(obs['sum'])}")
+        lines.append(f"# TYPE {metric}_max gauge")
+        lines.append(f"{metric}_max {_format_value(obs['max'])}")
+
+    by_histogram = defaultdict(list)
+    for (name, labels), hist in histograms.items():
+        by_histogram[name].append((labels, hist))
+    for name in sorted(by_histogram):
+        metric = _metric_name(name)
+        lines.append(f"# TYPE {metric} histogram")
+        for labels, hist in sorted(by_histogram[name], key=lambda item: item[0]):
+            # 记录时观测值已计入所有上界不小于它的桶，counts 本身就是累计值
+            for bound, count in zip(hist["buckets"], hist["counts"]):
+                lines.append(f"{metric}_bucket{_format_labels(labels, (('le', _format_value(bound)),))} {count}")
+            lines.append(f"{metric}_bucket{_format_labels(labels, (('le', '+Inf'),))} {hist['count']}")
+            lines.append(f"{metric}_count{_format_labels(labels)} {hist['count']}")
+            lines.append(f"{metric}_sum{_format_labels(labels)} {_format_value(hist['sum'])}")
+    return "\n".join(lines) + "\n"
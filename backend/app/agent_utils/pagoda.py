@@ -0,0 +1,280 @@
+"""
+确定性的膳食宝塔聚合引擎：按食材词典把食材归入 L1-L4，克数求和；各菜油盐累加进 L5
+
+原先 summarize 节点用一次 qwen-plus 结构化输出完成这些加法，慢且偶尔算错。这里本地完成映射与求和，
+只有词典不认识的食材才交给 LLM 分类（见 AnalysisAgent），分类结果会记住，同一食材不再重复询问。
+"""
+import os
+import re
+import threading
+from collections import OrderedDict
+from typing import Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+from app.agent_utils.report_parser import parse_ingredients
+from models.schemas import DishFinding, IngredientAmount, NutritionReport, PagodaLayer, PagodaNutritionVector, L5Detail
+
+# 设为 0 时 summarize 节点始终调用 LLM（用于对比基准）
+PAGODA_ENGINE = os.getenv("PAGODA_ENGINE", "1") == "1"
+
+# 子类 -> 宝塔层
+SUBCATEGORY_LAYER = {
+    "grains": "L1", "tubers": "L1",
+    "vegetables": "L2", "fruits": "L2",
+    "animal_meat": "L3", "seafood": "L3", "eggs": "L3",
+    "dairy": "L4", "soy_nuts": "L4",
+}
+LAYER_SUBCATEGORIES = {
+    "L1": ("grains", "tubers"),
+    "L2": ("vegetables", "fruits"),
+    "L3": ("animal_meat", "seafood", "eggs"),
+    "L4": ("dairy", "soy_nuts"),
+}
+# 调味料不计入 L1-L4（油盐由检索结论单独计入 L5）；other 表示无法归入宝塔的食材
+SEASONING = "seasoning"
+OTHER = "other"
+CATEGORIES = tuple(SUBCATEGORY_LAYER) + (SEASONING, OTHER)
+
+# 食材关键词词典：按最长关键词优先做子串匹配，"紫薯块" 命中 "紫薯"，"猪五花肉" 命中 "五花肉"
+INGREDIENT_LEXICON: Dict[str, Tuple[str, ...]] = {
+    "grains": (
+        "米饭", "大米", "白米", "糙米", "小米", "黑米", "糯米", "米粥", "粥", "米粉", "米线", "河粉", "年糕",
+        "面条", "面粉", "挂面", "拉面", "刀削面", "乌冬", "意面", "意大利面", "方便面", "面", "馒头", "花卷",
+        "包子皮", "饺子皮", "馄饨皮", "面皮", "烧饼", "油条", "面包", "吐司", "饼", "玉米", "燕麦", "荞麦",
+        "藜麦", "高粱", "薏米", "小麦", "红豆", "绿豆", "芸豆", "杂豆", "鹰嘴豆",
+    ),
+    "tubers": (
+        "土豆", "马铃薯", "红薯", "紫薯", "地瓜", "番薯", "山药", "芋头", "芋艿", "木薯", "魔芋",
+    ),
+    "vegetables": (
+        "西兰花", "花菜", "菜花", "白菜", "大白菜", "小白菜", "娃娃菜", "青菜", "油菜", "上海青", "菠菜", "生菜",
+        "油麦菜", "芹菜", "韭菜", "韭黄", "空心菜", "卷心菜", "包菜", "甘蓝", "紫甘蓝", "芥蓝", "菜心", "茼蒿",
+        "苋菜", "西红柿", "番茄", "黄瓜", "丝瓜", "冬瓜", "南瓜", "苦瓜", "西葫芦", "茄子", "青椒", "彩椒",
+        "甜椒", "尖椒", "辣椒", "胡萝卜", "萝卜", "白萝卜", "洋葱", "莲藕", "藕", "竹笋", "笋", "莴笋", "芦笋",
+        "豆角", "四季豆", "豇豆", "荷兰豆", "毛豆", "豌豆", "蒜苔", "蒜薹", "蒜苗", "香菇", "蘑菇", "金针菇",
+        "杏鲍菇", "平菇", "木耳", "银耳", "海带", "紫菜", "裙带菜", "豆芽", "绿豆芽", "黄豆芽", "秋葵", "玉米笋",
+        "蔬菜", "酸菜", "雪菜", "梅干菜", "榨菜", "泡菜",
+    ),
+    "fruits": (
+        "苹果", "香蕉", "橙子", "橘子", "柑橘", "梨", "桃", "葡萄", "西瓜", "哈密瓜", "草莓", "蓝莓", "芒果",
+        "菠萝", "猕猴桃", "火龙果", "柚子", "荔枝", "龙眼", "樱桃", "木瓜", "水果",
+    ),
+    "animal_meat": (
+        "猪肉", "五花肉", "里脊", "排骨", "猪蹄", "肉末", "肉丝", "肉片", "肉馅", "肉丸", "叉烧", "腊肉", "培根",
+        "火腿", "香肠", "午餐肉", "牛肉", "牛腩", "牛排", "羊肉", "羊排", "鸡肉", "鸡胸", "鸡腿", "鸡翅", "鸡块",
+        "鸡丁", "鸭肉", "鸭腿", "鹅肉", "肝", "腰花", "肚", "肥肠", "鸡", "鸭", "肉",
+    ),
+    "seafood": (
+        "鱼", "鱼片", "鱼块", "鲈鱼", "草鱼", "鲫鱼", "带鱼", "三文鱼", "鳕鱼", "金枪鱼", "虾", "虾仁", "大虾",
+        "基围虾", "蟹", "螃蟹", "贝", "扇贝", "蛤蜊", "花甲", "生蚝", "牡蛎", "鱿鱼", "墨鱼", "章鱼", "海参",
+        "海鲜",
+    ),
+    "eggs": (
+        "鸡蛋", "鸭蛋", "鹌鹑蛋", "咸蛋", "皮蛋", "松花蛋", "蛋黄", "蛋清", "蛋白", "蛋",
+    ),
+    "dairy": (
+        "牛奶", "纯牛奶", "酸奶", "奶酪", "芝士", "奶粉", "黄油", "奶油", "乳酪",
+    ),
+    "soy_nuts": (
+        "豆腐", "豆干", "豆皮", "腐竹", "千张", "百叶", "油豆腐", "豆浆", "黄豆", "黑豆", "豆制品", "素鸡",
+        "花生", "核桃", "杏仁", "腰果", "开心果", "松子", "瓜子", "芝麻", "榛子", "坚果",
+    ),
+    SEASONING: (
+        "葱", "葱花", "香葱", "姜", "姜丝", "蒜", "大蒜", "蒜末", "蒜泥", "香菜", "花椒", "八角", "桂皮", "香叶",
+        "干辣椒", "辣椒面", "辣椒油", "酱油", "生抽", "老抽", "醋", "料酒", "蚝油", "豆瓣酱", "甜面酱", "番茄酱",
+        "糖", "白糖", "冰糖", "盐", "鸡精", "味精", "淀粉", "水淀粉", "食用油", "植物油", "花生油", "菜籽油",
+        "香油", "麻油", "油", "调料", "酱汁", "芡汁", "高汤",
+    ),
+}
+
+# 烹饪方式标签，从菜名中提取
+_COOKING_TAGS = (
+    "红烧", "清蒸", "清炒", "爆炒", "小炒", "干煸", "糖醋", "鱼香", "宫保", "麻辣", "香辣", "酸辣", "凉拌",
+    "水煮", "白灼", "油焖", "黄焖", "卤", "炖", "蒸", "煮", "炸", "煎", "烤", "炒",
+)
+
+# 油(8 g) / 油：8g / 油约12 g / 油 3-5 g；区间取最小值。酱油、蚝油、香油、麻油、辣椒油是调料，不算烹调用油
+_AMOUNT = r"\s*(?:约|大约|左右)?\s*[（(:：]?\s*(?:约|大约)?\s*(\d+(?:\.\d+)?)\s*(?:[-~～至]\s*\d+(?:\.\d+)?)?\s*(?:g|克)"
+_OIL_RE = re.compile(r"(?<![酱蚝香麻辣])油" + _AMOUNT)
+_SALT_RE = re.compile(r"盐" + _AMOUNT)
+_NAME_LINE_RE = re.compile(r"菜品名称\s*[:：]\s*(.+)")
+_INGREDIENT_LINE_RE = re.compile(r"食材组成\s*[:：]\s*(.+)")
+
+_KEYWORDS: List[Tuple[str, str]] = sorted(
+    ((keyword, category) for category, keywords in INGREDIENT_LEXICON.items() for keyword in keywords),
+    key=lambda pair: len(pair[0]), reverse=True,
+)
+_LEARNED_MAX = 4096
+_learned: "OrderedDict[str, str]" = OrderedDict()
+_learned_lock = threading.Lock()
+
+
+class DishFacts(NamedTuple):
+    """聚合所需的单道菜事实：名称、食材克数与油盐克数（未能解析时为 None）"""
+    name: str
+    ingredients: List[IngredientAmount]
+    oil: Optional[float]
+    salt: Optional[float]
+
+
+def classify_ingredient(name: str) -> Optional[str]:
+    """返回食材的子类（见 CATEGORIES）；词典与已学习的分类都不认识时返回 None"""
+    name = name.strip()
+    with _learned_lock:
+        learned = _learned.get(name)
+    if learned is not None:
+        return learned
+    for keyword, category in _KEYWORDS:
+        if keyword in name:
+            return category
+    return None
+
+
+def learn_categories(categories: Dict[str, str]):
+    """记住 LLM 给出的分类；非法的子类一律按 other 处理"""
+    with _learned_lock:
+        for name, category in categories.items():
+            _learned[name.strip()] = category if category in CATEGORIES else OTHER
+            _learned.move_to_end(name.strip())
+        while len(_learned) > _LEARNED_MAX:
+            _learned.popitem(last=False)
+
+
+def parse_oil_salt(text: str) -> Tuple[Optional[float], Optional[float]]:
+    """
+    从检索结论中提取油、盐克数；同一结论中出现多次时取 "油盐含量" 行的值
+
+    没有完整的 "油盐含量" 行时在其余文本中查找，但跳过 "食材组成" 行（其中的食用油、盐克数是食材用量，不是结论）
+    """
+    lines = text.splitlines()
+    for line in lines:
+        if "油盐" in line:
+            oil, salt = _OIL_RE.search(line), _SALT_RE.search(line)
+            if oil and salt:
+                return float(oil.group(1)), float(salt.group(1))
+    body = "\n".join(line for line in lines if not _INGREDIENT_LINE_RE.search(line))
+    oil, salt = _OIL_RE.search(body), _SALT_RE.search(body)
+    return (float(oil.group(1)) if oil else None), (float(salt.group(1)) if salt else None)
+
+
+def facts_from_findings(findings: Iterable[DishFinding]) -> List[DishFacts]:
+    """逐菜流程：食材取视觉条目里的克数，油盐取该菜的检索结论"""
+    facts = []
+    for finding in sorted(findings, key=lambda f: f.item.index):
+        oil, salt = parse_oil_salt(finding.extracted_info)
+        facts.append(DishFacts(finding.item.name, finding.item.ingredients, oil, salt))
+    return facts
+
+
+def facts_from_text(text: str) -> List[DishFacts]:
+    """整份报告流程：从 SEARCHING_NODE_PROMPT 约定的汇总格式中提取"""
+    name = _NAME_LINE_RE.search(text)
+    ingredients = _INGREDIENT_LINE_RE.search(text)
+    if not name or not ingredients:
+        return []
+    oil, salt = parse_oil_salt(text)
+    return [DishFacts(name.group(1).strip(), parse_ingredients(ingredients.group(1)), oil, salt)]
+
+
+def unknown_ingredients(dishes: Iterable[DishFacts]) -> List[str]:
+    """词典无法归类的食材名（去重、保持顺序）"""
+    seen = OrderedDict()
+    for dish in dishes:
+        for ingredient in dish.ingredients:
+            if classify_ingredient(ingredient.name) is None:
+                seen[ingredient.name.strip()] = None
+    return list(seen)
+
+
+def aggregate(dishes: List[DishFacts]) -> NutritionReport:
+    """
+    把各道菜的事实聚合为一份 NutritionReport
+
+    调用前应保证所有食材都可归类（unknown_ingredients 为空）、所有菜都有油盐值；
+    仍无法归类的食材按 other 处理，只进入 main_ingredients。
+    """
+    totals = {sub: 0.0 for sub in SUBCATEGORY_LAYER}
+    layer_ingredients: Dict[str, List[str]] = {layer: [] for layer in LAYER_SUBCATEGORIES}
+    main_ingredients: List[str] = []
+    seasonings: List[str] = []
+
+    for dish in dishes:
+        for ingredient in dish.ingredients:
+            name = ingredient.name.strip()
+            category = classify_ingredient(name) or OTHER
+            if category == SEASONING:
+                _append_unique(seasonings, name)
+                continue
+            _append_unique(main_ingredients, name)
+            if category == OTHER:
+                continue
+            totals[category] += ingredient.grams
+            _append_unique(layer_ingredients[SUBCATEGORY_LAYER[category]], name)
+
+    vector = PagodaNutritionVector(
+        **{
+            layer: PagodaLayer(
+                total_value=_round(sum(totals[sub] for sub in subs)),
+                ingredients=layer_ingredients[layer],
+                details={sub: _round(totals[sub]) for sub in subs},
+            )
+            for layer, subs in LAYER_SUBCATEGORIES.items()
+        },
+        L5=L5Detail(
+            oil=_round(sum(dish.oil or 0.0 for dish in dishes)),
+            salt=_round(sum(dish.salt or 0.0 for dish in dishes)),
+        ),
+    )
+
+    return NutritionReport(
+        dish_name=" + ".join(dish.name for dish in dishes),
+        main_ingredients=main_ingredients,
+        seasonings=seasonings,
+        pagoda_nutrition_vector=vector,
+        feature_tags=_feature_tags(dishes, vector),
+        description=describe_meal(vector),
+    )
+
+
+def _feature_tags(dishes: List[DishFacts], vector: PagodaNutritionVector) -> List[str]:
+    tags: List[str] = []
+    for dish in dishes:
+        for tag in _COOKING_TAGS:
+            if tag in dish.name:
+                _append_unique(tags, tag)
+                break
+    if vector.L3.total_value > 0 and vector.L2.total_value > 0:
+        tags.append("荤素搭配")
+    elif vector.L3.total_value == 0 and vector.L1.total_value + vector.L2.total_value + vector.L4.total_value > 0:
+        tags.append("素食")
+    return tags
+
+
+def describe_meal(vector: PagodaNutritionVector) -> str:
+    """与 SUMMARIZE_NODE_PROMPT 一致，15 字以内概括整餐"""
+    has_staple = vector.L1.total_value > 0
+    has_veg = vector.L2.total_value > 0
+    has_animal = vector.L3.total_value + vector.L4.total_value > 0
+    if has_staple and has_veg and has_animal:
+        return "主食荤素齐全的均衡一餐"
+    if has_veg and has_animal:
+        return "荤素搭配、缺少主食的一餐"
+    if has_staple and has_animal:
+        return "有主食有肉、缺少蔬菜的一餐"
+    if has_staple and has_veg:
+        return "主食加蔬菜的清淡素餐"
+    if has_staple:
+        return "以主食为主的简餐"
+    if has_veg:
+        return "以蔬菜为主的清淡餐"
+    if has_animal:
+        return "以肉蛋奶豆为主的一餐"
+    return "未识别出主要食材的一餐"
+
+
+def _append_unique(items: List[str], value: str):
+    if value not in items:
+        items.append(value)
+
+
+def _round(value: float) -> float:
+    return round(value, 1)
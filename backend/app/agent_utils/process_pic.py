@@ -1,20 +1,35 @@
 import base64
 import mimetypes
+from typing import Optional, Union
+
+ImageInput = Union[str, bytes, bytearray, memoryview]
+
 
 # 将图片转换为Base64编码的Data URI
-def process_pic(image_path: str) -> str:
+def process_pic(image: ImageInput, mime_type: Optional[str] = None) -> str:
+    """
+    :param image: 图片路径，或已在内存中的图片字节（bytes / memoryview，直接编码，不落盘）
+    :param mime_type: 图片 MIME 类型；内存图片应传入上传时已校验的类型
+    """
     try:
-        # 自动识别图片的 MIME 类型 (如 image/jpeg, image/png)
-        mime_type, _ = mimetypes.guess_type(image_path)
+        if isinstance(image, str):
+            # 自动识别图片的 MIME 类型 (如 image/jpeg, image/png)
+            if not mime_type:
+                mime_type, _ = mimetypes.guess_type(image)
+            with open(image, "rb") as image_file:
+                data = image_file.read()
+        else:
+            data = image
+
         if not mime_type:
             mime_type = "image/jpeg"  # 默认值
-            
-        with open(image_path, "rb") as image_file:
-            encoded_string = base64.b64encode(image_file.read()).decode('utf-8')
-            
+
+        # b64encode 支持任意 bytes-like 对象，memoryview 不会被额外复制
+        encoded_string = base64.b64encode(data).decode('utf-8')
+
         # 关键：必须拼接 Data URI 前缀。否则大模型无法识别协议
         return f"data:{mime_type};base64,{encoded_string}"
-        
+
     except Exception as e:
         print(f"Error processing image: {e}")
-        raise e
\ No newline at end of file
+        raise e
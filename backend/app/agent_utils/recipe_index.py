@@ -0,0 +1,279 @@
+"""
+标准菜谱参考表与菜名模糊索引
+
+data/standard_recipes.json 收录常见中式菜品的每份标准成品克数与用油、用盐量。检索分两步：
+1. 字符 bigram 倒排索引召回候选，按 Dice 系数打分（菜名与别名都参与索引）
+2. 召回不到足够相似的候选时，对长度相近的菜名做编辑距离兜底（"西红柿炒鸡旦" 之类的错别字）
+全部在内存中完成，单次查询在微秒级，只有长尾菜品才需要走 Tavily 网络搜索。
+
+逐菜流程跳过模型直接采用参考表（local_finding）只认高置信命中（见 FuzzyNameIndex.confident）：
+编辑距离只差一个字的往往是另一道菜（"番茄炒鸭蛋" 与 "番茄炒鸡蛋"），这类候选只通过 standard_recipe_lookup 工具交给模型判断。
+"""
+import json
+import os
+from collections import defaultdict
+from typing import Dict, Generic, Iterable, List, NamedTuple, Optional, Set, Tuple, TypeVar
+
+from langchain_core.tools import tool
+
+from app.agent_utils import metrics
+from app.agent_utils.search_cache import normalize_query
+from models.schemas import DishItem
+
+RECIPE_DATA_PATH = os.getenv(
+    "RECIPE_DATA_PATH", os.path.join(os.path.dirname(__file__), "data", "standard_recipes.json")
+)
+# 高于该分数时逐菜流程直接采用参考表数据，不再调用模型
+RECIPE_MATCH_THRESHOLD = float(os.getenv("RECIPE_MATCH_THRESHOLD", "0.8"))
+# 工具返回候选的最低分数
+RECIPE_CANDIDATE_THRESHOLD = float(os.getenv("RECIPE_CANDIDATE_THRESHOLD", "0.5"))
+# 参考表也匹配不上时的默认油盐（每 100 g 成品），只用于超时后的估算报告
+DEFAULT_OIL_PER_100G = float(os.getenv("DEFAULT_OIL_PER_100G", "5"))
+DEFAULT_SALT_PER_100G = float(os.getenv("DEFAULT_SALT_PER_100G", "1"))
+
+
+T = TypeVar("T")
+
+
+class StandardRecipe(NamedTuple):
+    name: str
+    aliases: List[str]
+    category: str
+    serving_grams: float
+    oil: float
+    salt: float
+
+
+class RecipeMatch(NamedTuple):
+    recipe: StandardRecipe
+    matched_name: str
+    score: float
+
+
+def _bigrams(text: str) -> Set[str]:
+    # 单字菜名（如 "粥"）没有 bigram，退化为单字
+    if len(text) < 2:
+        return {text} if text else set()
+    return {text[i:i + 2] for i in range(len(text) - 1)}
+
+
+def _edit_distance(a: str, b: str, limit: int) -> int:
+    """Levenshtein 距离，超过 limit 时提前返回 limit + 1"""
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+    previous = list(range(len(b) + 1))
+    for i, ca in enumerate(a, 1):
+        current = [i]
+        for j, cb in enumerate(b, 1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (ca != cb)))
+        if min(current) > limit:
+            return limit + 1
+        previous = current
+    return previous[-1]
+
+
+class FuzzyNameIndex(Generic[T]):
+    """
+    名称模糊索引：bigram 倒排召回 + Dice 打分，分数不足时编辑距离兜底
+
+    每个条目是 (名称, 载荷)，同一载荷可以挂多个名称（别名），检索结果按载荷去重。
+    """
+
+    def __init__(self, entries: Iterable[Tuple[str, T]], fallback_below: float = RECIPE_MATCH_THRESHOLD):
+        self.fallback_below = fallback_below
+        # 归一化后的名称 -> 载荷
+        self._names: Dict[str, T] = {}
+        # bigram -> 包含它的归一化名称
+        self._postings: Dict[str, Set[str]] = defaultdict(set)
+        self._by_length: Dict[int, List[str]] = defaultdict(list)
+
+        for name, payload in entries:
+            key = normalize_query(name)
+            if not key or key in self._names:
+                continue
+            self._names[key] = payload
+            self._by_length[len(key)].append(key)
+            for gram in _bigrams(key):
+                self._postings[gram].add(key)
+        self._grams = {key: _bigrams(key) for key in self._names}
+
+    def __len__(self) -> int:
+        return len(self._names)
+
+    def search(self, name: str, limit: int = 3, fallback: bool = True) -> List[Tuple[T, str, float]]:
+        """
+        返回按相似度降序的 (载荷, 命中的名称, 分数)，分数在 [0, 1]，1 表示名称完全一致
+
+        :param fallback: 为 False 时不做编辑距离兜底，只返回完全一致与 Dice 打分的结果
+        """
+        query = normalize_query(name)
+        if not query:
+            return []
+        exact = self._names.get(query)
+        if exact is not None:
+            return [(exact, query, 1.0)]
+
+        query_grams = _bigrams(query)
+        overlap: Dict[str, int] = defaultdict(int)
+        for gram in query_grams:
+            for key in self._postings.get(gram, ()):
+                overlap[key] += 1
+
+        scored: Dict[str, float] = {}
+        for key, shared in overlap.items():
+            scored[key] = 2 * shared / (len(query_grams) + len(self._grams[key]))
+
+        if fallback and (not scored or max(scored.values()) < self.fallback_below):
+            # 编辑距离兜底：只比较长度相差不超过 2 的名称
+            for length in range(max(1, len(query) - 2), len(query) + 3):
+                for key in self._by_length.get(length, ()):
+                    distance = _edit_distance(query, key, 2)
+                    if distance <= 2 and distance < max(len(query), len(key)):
+                        score = 1 - distance / max(len(query), len(key))
+                        scored[key] = max(scored.get(key, 0.0), score)
+
+        # 同一载荷的多个名称只保留分数最高的一个
+        results: List[Tuple[T, str, float]] = []
+        seen = set()
+        for key, score in sorted(scored.items(), key=lambda kv: kv[1], reverse=True):
+            payload = self._names[key]
+            if id(payload) in seen:
+                continue
+            seen.add(id(payload))
+            results.append((payload, key, round(score, 3)))
+            if len(results) >= limit:
+                break
+        return results
+
+    def confident(self, name: str, threshold: float, limit: int = 1) -> List[Tuple[T, str, float]]:
+        """
+        高置信命中：名称完全一致，或 Dice 分数不低于 threshold 且查询中的每个字都出现在命中的名称里
+
+        查询比命中的名称多出来的字往往意味着另一道菜（"红烧牛肉饭" 与 "红烧牛肉"、"清炒土豆丝" 与 "炒土豆丝"）；
+        不使用编辑距离兜底
+        """
+        query = set(normalize_query(name))
+        return [
+            (payload, key, score) for payload, key, score in self.search(name, limit, fallback=False)
+            if score >= threshold and query <= set(key)
+        ]
+
+
+class RecipeIndex:
+    def __init__(self, recipes: List[StandardRecipe]):
+        self.recipes = recipes
+        self._index = FuzzyNameIndex(
+            (name, recipe) for recipe in recipes for name in [recipe.name, *recipe.aliases]
+        )
+
+    @classmethod
+    def load(cls, path: str = RECIPE_DATA_PATH) -> "RecipeIndex":
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        return cls([
+            StandardRecipe(
+                name=row["name"],
+                aliases=row.get("aliases", []),
+                category=row.get("category", ""),
+                serving_grams=float(row["serving_grams"]),
+                oil=float(row["oil"]),
+                salt=float(row["salt"]),
+            )
+            for row in data["recipes"]
+        ])
+
+    def search(self, dish_name: str, limit: int = 3) -> List[RecipeMatch]:
+        """返回按相似度降序的候选，分数在 [0, 1]，1 表示菜名或别名完全一致"""
+        return [RecipeMatch(recipe, key, score) for recipe, key, score in self._index.search(dish_name, limit)]
+
+    def best_match(self, dish_name: str) -> Optional[RecipeMatch]:
+        matches = self.search(dish_name, limit=1)
+        return matches[0] if matches else None
+
+    def confident_match(self, dish_name: str, threshold: float = RECIPE_MATCH_THRESHOLD) -> Optional[RecipeMatch]:
+        """可以跳过模型直接采用的命中，见 FuzzyNameIndex.confident"""
+        matches = self._index.confident(dish_name, threshold)
+        return RecipeMatch(*matches[0]) if matches else None
+
+
+_index: Optional[RecipeIndex] = None
+
+
+def get_recipe_index() -> RecipeIndex:
+    """返回参考表索引单例，首次调用时从 JSON 构建"""
+    global _index
+    if _index is None:
+        _index = RecipeIndex.load()
+    return _index
+
+
+def scaled_oil_salt(recipe: StandardRecipe, grams: float):
+    """按视觉分量等比例换算每份标准油盐：实际值 = (视觉总重 / 标准份量) * 标准油盐值"""
+    ratio = grams / recipe.serving_grams if grams > 0 and recipe.serving_grams > 0 else 1.0
+    return round(recipe.oil * ratio, 1), round(recipe.salt * ratio, 1)
+
+
+def estimate_oil_salt(item: DishItem):
+    """
+    不经检索的油盐估算：参考表有候选时按候选换算，否则主食记 0、菜品按默认每 100 g 用量换算
+    """
+    grams = sum(ingredient.grams for ingredient in item.ingredients)
+    match = get_recipe_index().best_match(item.name)
+    if match is not None and match.score >= RECIPE_CANDIDATE_THRESHOLD:
+        return scaled_oil_salt(match.recipe, grams)
+    if item.category == "主食":
+        return 0.0, 0.0
+    return round(DEFAULT_OIL_PER_100G * grams / 100, 1), round(DEFAULT_SALT_PER_100G * grams / 100, 1)
+
+
+def local_finding(item: DishItem) -> Optional[str]:
+    """
+    参考表高置信命中时，直接生成与 DISH_SEARCHING_NODE_PROMPT 同格式的单菜结论；否则返回 None
+    """
+    match = get_recipe_index().confident_match(item.name, RECIPE_MATCH_THRESHOLD)
+    if match is None:
+        metrics.incr("recipe_index_misses")
+        return None
+    metrics.incr("recipe_index_hits")
+
+    grams = sum(ingredient.grams for ingredient in item.ingredients)
+    oil, salt = scaled_oil_salt(match.recipe, grams)
+    ingredients = ", ".join(f"{ingredient.name}({ingredient.grams:g} g)" for ingredient in item.ingredients)
+    return (
+        f"- 菜品名称：{item.name}\n"
+        f"- 食材组成：{ingredients}\n"
+        f"- 油盐含量：油({oil:g} g), 盐({salt:g} g)\n"
+        f"- 描述：参考标准菜谱「{match.recipe.name}」（每份 {match.recipe.serving_grams:g} g，"
+        f"油 {match.recipe.oil:g} g，盐 {match.recipe.salt:g} g）按视觉分量换算"
+    )
+
+
+@tool
+def standard_recipe_lookup(dish_names: List[str]) -> list:
+    """
+    在本地标准菜谱参考表中查询菜品的每份标准份量（serving_grams）、用油量（oil）和用盐量（salt），单位均为克。
+    一次可以查询多道菜；请在使用网络搜索之前先调用本工具，只有返回 found=false 的菜品才需要再搜索。
+    """
+    results = []
+    index = get_recipe_index()
+    for dish_name in dish_names:
+        matches = [m for m in index.search(dish_name) if m.score >= RECIPE_CANDIDATE_THRESHOLD]
+        metrics.incr("recipe_index_hits" if matches else "recipe_index_misses")
+        if not matches:
+            results.append({"query": dish_name, "found": False})
+            continue
+        results.append({
+            "query": dish_name,
+            "found": True,
+            "candidates": [
+                {
+                    "name": m.recipe.name,
+                    "score": m.score,
+                    "serving_grams": m.recipe.serving_grams,
+                    "oil": m.recipe.oil,
+                    "salt": m.recipe.salt,
+                }
+                for m in matches
+            ],
+        })
+    return results
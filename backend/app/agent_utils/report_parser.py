@@ -0,0 +1,78 @@
+"""
+解析视觉报告：把 VISION_NODE_PROMPT 约定的文本格式拆成结构化的 DishItem 列表
+
+    ---
+    - 类别: 菜品
+    - 名称: 西红柿炒鸡蛋
+    - 食材组成: 西红柿 (100g), 鸡蛋 (60g)
+    - 视觉特征: ...
+    ---
+
+模型偶尔会用全角冒号、中文逗号、"克"、区间值（50-80g）或漏掉分隔线，这里都做了兼容；
+区间值与汇总提示词的取值原则一致，取最小值。无法解析出任何条目时返回空列表，由调用方回退到整份报告分析。
+"""
+import re
+from typing import List, Optional
+
+from models.schemas import DishItem, IngredientAmount
+
+_FIELD_RE = re.compile(r"^\s*[-*•]?\s*\**\s*(类别|名称|食材组成|视觉特征)\s*\**\s*[:：]\s*(.*)$")
+# 食材 (80g) / 食材（80 克）/ 食材 80g / 食材(50-80g)
+_INGREDIENT_RE = re.compile(
+    r"^(?P<name>.+?)\s*[（(]?\s*(?P<low>\d+(?:\.\d+)?)\s*(?:[-~～至]\s*\d+(?:\.\d+)?)?\s*(?:g|克|G)\s*[)）]?$"
+)
+_SPLIT_RE = re.compile(r"[,，、;；]")
+
+_FIELD_KEYS = {"类别": "category", "名称": "name", "食材组成": "ingredients", "视觉特征": "visual_features"}
+
+
+def parse_ingredients(text: str) -> List[IngredientAmount]:
+    """解析 "西红柿 (100g), 鸡蛋 (60g)"；没有克数的食材记为 0g"""
+    ingredients = []
+    for part in _SPLIT_RE.split(text.strip().strip("[]【】")):
+        part = part.strip()
+        if not part:
+            continue
+        match = _INGREDIENT_RE.match(part)
+        if match:
+            ingredients.append(IngredientAmount(name=match.group("name").strip(), grams=float(match.group("low"))))
+        else:
+            ingredients.append(IngredientAmount(name=part, grams=0.0))
+    return ingredients
+
+
+def parse_vision_report(report: Optional[str]) -> List[DishItem]:
+    """按条目拆分视觉报告；以 "类别" 或重复出现的字段作为新条目的开始"""
+    items: List[dict] = []
+    current: dict = {}
+
+    def flush():
+        if current.get("name"):
+            items.append(dict(current))
+        current.clear()
+
+    for line in (report or "").splitlines():
+        if line.strip().startswith("---"):
+            flush()
+            continue
+        match = _FIELD_RE.match(line)
+        if not match:
+            continue
+        key = _FIELD_KEYS[match.group(1)]
+        value = match.group(2).strip().strip("[]【】").strip()
+        # 没有分隔线时，遇到新的 "类别" 或已出现过的字段说明进入了下一条
+        if key in current or (key == "category" and current):
+            flush()
+        current[key] = parse_ingredients(value) if key == "ingredients" else value
+    flush()
+
+    return [DishItem(index=i, **item) for i, item in enumerate(items)]
+
+
+def format_dish_item(item: DishItem) -> str:
+    """把单个条目还原为视觉报告中的文本格式，作为逐菜检索的输入"""
+    ingredients = ", ".join(f"{ing.name} ({ing.grams:g}g)" for ing in item.ingredients)
+    lines = [f"- 类别: {item.category}", f"- 名称: {item.name}", f"- 食材组成: {ingredients}"]
+    if item.visual_features:
+        lines.append(f"- 视觉特征: {item.visual_features}")
+    return "\n".join(lines)
@@ -0,0 +1,60 @@
+"""
+HTTP 请求的端到端耗时埋点与链路追踪根 span（ASGI 中间件）
+
+按路由模板（如 /analyze、/jobs/{job_id}）与状态码记录 http_request_seconds 直方图，
+同时为每个请求创建一个 SERVER span 作为 trace 的根，接口内的图片处理、分析等 span 都挂在其下。
+计时到响应体最后一块发出为止，/analyze/stream 的 SSE 与批量接口的 NDJSON 也按整条流的时长统计；
+/metrics 与探针接口不计入。
+"""
+import time
+
+from opentelemetry.trace import SpanKind, Status, StatusCode
+
+from app.agent_utils import metrics
+from app.agent_utils.tracing import span
+
+SKIPPED_PATHS = ("/metrics", "/healthz", "/readyz")
+
+
+class RequestMetricsMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] in SKIPPED_PATHS:
+            await self.app(scope, receive, send)
+            return
+
+        start = time.perf_counter()
+        status = {"code": 500}
+        recorded = False
+        method = scope["method"]
+
+        def record():
+            nonlocal recorded
+            if recorded:
+                return
+            recorded = True
+            # FastAPI 路由匹配后会把 route 写回 scope，用模板而不是实际路径，避免 job_id 之类的高基数标签
+            route = getattr(scope.get("route"), "path", "unmatched")
+            labels = {"route": route, "method": method, "status": str(status["code"])}
+            metrics.histogram("http_request_seconds", time.perf_counter() - start, labels)
+            server_span.update_name(f"{method} {route}")
+            server_span.set_attributes({"http.route": route, "http.response.status_code": status["code"]})
+            if status["code"] >= 500:
+                server_span.set_status(Status(StatusCode.ERROR))
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+            await send(message)
+            if message["type"] == "http.response.body" and not message.get("more_body", False):
+                record()
+
+        with span(f"{method} {scope['path']}", {"http.request.method": method},
+                  kind=SpanKind.SERVER) as server_span:
+            try:
+                await self.app(scope, receive, send_wrapper)
+            finally:
+                # 客户端中途断开等情况下响应体没有发完，同样记录
+                record()
@@ -0,0 +1,204 @@
+"""
+按图片内容寻址的分析结果缓存
+
+同一张照片被重复上传（超时重试、群里转发同一份餐盘照）时直接返回之前的 NutritionReport：
+- 精确命中：图片字节的 SHA-256
+- 近似命中：64 位差值感知哈希（dHash），汉明距离不超过阈值即视为同一张图
+- 食堂 / 餐次（canteen_name / meal_type）作为范围编进键里：同一张图在不同食堂下按各自的菜单匹配，结果互不复用
+缓存版本由各段提示词的哈希与条目格式决定，提示词改动后旧结果自动失效。
+条目同时保存报告是否来自食堂快速通道（fast_path），命中时原样带回。
+"""
+import asyncio
+import hashlib
+import io
+import json
+import os
+import threading
+from collections import OrderedDict
+from typing import NamedTuple, Optional
+
+from PIL import Image, ImageOps
+
+from app.agent_utils import metrics
+from app.agent_utils.agent_prompt import (
+    VISION_NODE_PROMPT, SEARCHING_NODE_PROMPT, DISH_SEARCHING_NODE_PROMPT, SUMMARIZE_NODE_PROMPT,
+    INGREDIENT_CLASSIFY_PROMPT,
+)
+from app.agent_utils.image_preprocess import get_image_pool
+from app.agent_utils.tiered_cache import TieredCache
+from models.schemas import NutritionReport
+
+RESULT_CACHE = os.getenv("RESULT_CACHE", "1") == "1"
+RESULT_CACHE_MAX_ENTRIES = int(os.getenv("RESULT_CACHE_MAX_ENTRIES", "1024"))
+RESULT_CACHE_TTL = float(os.getenv("RESULT_CACHE_TTL", str(24 * 3600)))
+RESULT_CACHE_DB = os.getenv("RESULT_CACHE_DB", "")  # 为空时只使用内存层
+RESULT_CACHE_PHASH_DISTANCE = int(os.getenv("RESULT_CACHE_PHASH_DISTANCE", "4"))  # 小于 0 时关闭近似匹配
+
+
+# 条目格式版本，存储内容的结构变化时递增，旧条目随之失效
+_ENTRY_FORMAT = "2"
+
+
+def prompt_version() -> str:
+    """各段提示词与条目格式共同决定缓存版本"""
+    digest = hashlib.sha256(_ENTRY_FORMAT.encode("utf-8"))
+    for prompt in (VISION_NODE_PROMPT, SEARCHING_NODE_PROMPT, DISH_SEARCHING_NODE_PROMPT, SUMMARIZE_NODE_PROMPT,
+                   INGREDIENT_CLASSIFY_PROMPT):
+        digest.update(prompt.encode("utf-8"))
+    return digest.hexdigest()[:16]
+
+
+class CachedResult(NamedTuple):
+    report: NutritionReport
+    fast_path: bool
+
+
+class ImageFingerprint(NamedTuple):
+    sha256: str
+    phash: Optional[int]
+    # 请求范围（食堂 / 餐次）的摘要，未限定时为空
+    scope: str = ""
+
+
+def request_scope(canteen_name: Optional[str] = None, meal_type: Optional[str] = None) -> str:
+    """食堂 / 餐次的摘要，二者都未给出时为空"""
+    if not canteen_name and not meal_type:
+        return ""
+    return hashlib.sha256(f"{canteen_name or ''}\0{meal_type or ''}".encode("utf-8")).hexdigest()[:16]
+
+
+def dhash(data: bytes, hash_size: int = 8) -> int:
+    """差值哈希：缩放为 (hash_size+1) x hash_size 灰度图后比较相邻像素明暗"""
+    with Image.open(io.BytesIO(data)) as img:
+        img = ImageOps.exif_transpose(img).convert("L").resize(
+            (hash_size + 1, hash_size), Image.Resampling.LANCZOS
+        )
+        pixels = list(img.getdata())
+
+    value = 0
+    for row in range(hash_size):
+        for col in range(hash_size):
+            left = pixels[row * (hash_size + 1) + col]
+            right = pixels[row * (hash_size + 1) + col + 1]
+            value = (value << 1) | (left > right)
+    return value
+
+
+def fingerprint_image(data: bytes) -> ImageFingerprint:
+    """计算内容哈希与感知哈希；无法解码的图片只有内容哈希"""
+    sha = hashlib.sha256(data).hexdigest()
+    try:
+        phash = dhash(data)
+    except Exception:
+        phash = None
+    return ImageFingerprint(sha, phash)
+
+
+class ResultCache:
+    def __init__(self, max_entries: int = RESULT_CACHE_MAX_ENTRIES, ttl: float = RESULT_CACHE_TTL,
+                 sqlite_path: Optional[str] = RESULT_CACHE_DB or None,
+                 max_distance: int = RESULT_CACHE_PHASH_DISTANCE):
+        self.max_distance = max_distance
+        self.store = TieredCache(
+            "nutrition_results",
+            max_entries=max_entries,
+            ttl=ttl,
+            sqlite_path=sqlite_path,
+            version=prompt_version(),
+        )
+
+        # 缓存键 -> phash，用于近似匹配的线性扫描；容量与内存层一致
+        self._lock = threading.Lock()
+        self._phash_index: "OrderedDict[str, int]" = OrderedDict()
+        for key, _ in self.store.scan():
+            phash = _phash_of(key)
+            if phash is not None:
+                self._phash_index[key] = phash
+
+    def fingerprint(self, data: bytes, scope: str = "") -> ImageFingerprint:
+        return fingerprint_image(data)._replace(scope=scope)
+
+    async def afingerprint(self, data: bytes, scope: str = "") -> ImageFingerprint:
+        """在图片进程池中计算指纹，避免解码占用事件循环"""
+        loop = asyncio.get_running_loop()
+        fp = await loop.run_in_executor(get_image_pool(), fingerprint_image, bytes(data))
+        return fp._replace(scope=scope)
+
+    def get(self, fp: ImageFingerprint) -> Optional[CachedResult]:
+        value = self.store.get(_store_key(fp))
+        if value is not None:
+            metrics.incr("result_cache_hits_exact")
+            return _load(value)
+
+        near = self._nearest(fp.phash, fp.scope)
+        if near is not None:
+            value = self.store.get(near)
+            if value is not None:
+                metrics.incr("result_cache_hits_near")
+                return _load(value)
+
+        metrics.incr("result_cache_misses")
+        return None
+
+    def put(self, fp: ImageFingerprint, report: NutritionReport, fast_path: bool = False):
+        key = _store_key(fp)
+        self.store.set(key, json.dumps({"report": report.model_dump(mode="json"), "fast_path": fast_path},
+                                       ensure_ascii=False))
+        if fp.phash is not None:
+            with self._lock:
+                self._phash_index[key] = fp.phash
+                self._phash_index.move_to_end(key)
+                while len(self._phash_index) > self.store.max_entries:
+                    self._phash_index.popitem(last=False)
+
+    def _nearest(self, phash: Optional[int], scope: str) -> Optional[str]:
+        """同一范围内感知哈希最接近且不超过阈值的键"""
+        if phash is None or self.max_distance < 0:
+            return None
+        best_key, best_distance = None, self.max_distance + 1
+        with self._lock:
+            for key, other in self._phash_index.items():
+                if _scope_of(key) != scope:
+                    continue
+                distance = (phash ^ other).bit_count()
+                if distance < best_distance:
+                    best_key, best_distance = key, distance
+        return best_key
+
+
+def _load(value: str) -> CachedResult:
+    entry = json.loads(value)
+    return CachedResult(NutritionReport.model_validate(entry["report"]), bool(entry.get("fast_path")))
+
+
+def _scope_prefix(scope: str) -> str:
+    return f"{scope}/" if scope else ""
+
+
+def _store_key(fp: ImageFingerprint) -> str:
+    # 把范围与 phash 编进键里（[范围/]sha256[:phash]），重启后可以从持久层恢复近似匹配索引
+    key = _scope_prefix(fp.scope) + fp.sha256
+    return key if fp.phash is None else f"{key}:{fp.phash:016x}"
+
+
+def _scope_of(key: str) -> str:
+    scope, sep, _ = key.partition("/")
+    return scope if sep else ""
+
+
+def _phash_of(key: str) -> Optional[int]:
+    _, _, phash = key.partition(":")
+    return int(phash, 16) if phash else None
+
+
+_result_cache: Optional[ResultCache] = None
+
+
+def get_result_cache() -> Optional[ResultCache]:
+    """
+    返回结果缓存单例；RESULT_CACHE=0 时返回 None
+    """
+    global _result_cache
+    if _result_cache is None and RESULT_CACHE:
+        _result_cache = ResultCache()
+    return _result_cache
@@ -0,0 +1,180 @@
+"""
+Tavily 搜索结果缓存
+
+食堂场景下每天反复出现的就是那几百道菜（米饭、西兰花、红烧肉……），每道菜的标准油盐用量却每次都重新搜一遍。
+CachedTavilySearch 在 TavilySearch 外包一层两级缓存（内存 LRU + SQLite，带 TTL），按归一化后的查询词寻址：
+- 去除首尾空白、合并连续空白、全角转半角（NFKC）、英文小写
+- 繁体字折叠为简体（内置食材/烹饪常用字对照表），"紅燒肉" 与 "红烧肉" 命中同一条
+命中时不产生任何网络请求。只缓存成功返回的结果，报错与空结果不入缓存。
+未命中时的请求经过上游调用层（PooledTavilyAPIWrapper）：共享 keep-alive 连接池、RPM 限流、429/5xx 抖动重试。
+"""
+import json
+import os
+import re
+import unicodedata
+from typing import Any, Dict, Optional
+
+from langchain_tavily import TavilySearch
+from langchain_tavily._utilities import TAVILY_API_URL, TavilySearchAPIWrapper
+from pydantic import Field
+
+from app.agent_utils import metrics
+from app.agent_utils.deadline import request_timeout
+from app.agent_utils.tiered_cache import TieredCache
+from app.agent_utils.upstream import (
+    UPSTREAM_TIMEOUT,
+    UpstreamError,
+    acall_with_retry,
+    call_with_retry,
+    get_aio_session,
+    get_http_session,
+    retry_after_of,
+)
+
+SEARCH_CACHE = os.getenv("SEARCH_CACHE", "1") == "1"
+SEARCH_CACHE_MAX_ENTRIES = int(os.getenv("SEARCH_CACHE_MAX_ENTRIES", "2048"))
+SEARCH_CACHE_TTL = float(os.getenv("SEARCH_CACHE_TTL", str(7 * 24 * 3600)))
+SEARCH_CACHE_DB = os.getenv("SEARCH_CACHE_DB", "search_cache.db")  # 为空时只使用内存层
+
+# 繁体 -> 简体，每两个字符为一组；覆盖菜名、食材、烹饪方式与检索常用词
+_TRADITIONAL_PAIRS = (
+    "飯饭麵面麪面雞鸡魚鱼蝦虾豬猪鴨鸭鵝鹅蔥葱薑姜鹽盐醬酱湯汤燒烧燉炖滷卤鹵卤餃饺饅馒頭头餅饼麥麦穀谷"
+    "類类蘿萝蔔卜黃黄紅红綠绿藍蓝乾干絲丝條条塊块鍋锅盤盘鹹咸臘腊腸肠蘭兰筍笋蠔蚝貝贝魷鱿鱸鲈鯽鲫鱈鳕"
+    "鮭鲑蠣蛎燜焖涼凉燴烩醃腌鮮鲜籠笼餛馄飩饨糰团團团雜杂糧粮蕎荞薺荠莧苋萵莴捲卷釀酿燻熏煙烟飲饮饞馋"
+    "蘋苹們们這这個个與与為为發发標标準准熱热營营養养點点兩两來来對对麼么後后過过還还應应樣样種种寶宝"
+    "層层體体經经從从將将當当無无總总計计檢检測测價价錢钱幾几說说讀读問问題题買买賣卖農农場场廣广雙双"
+    "彎弯蠶蚕鰻鳗鯉鲤鱔鳝鰱鲢鯧鲳鱘鲟鮑鲍螄蛳瑤瑶蓮莲蘆芦葉叶糝糁羅罗漢汉齋斋"
+)
+_TRADITIONAL_TO_SIMPLIFIED = str.maketrans({
+    _TRADITIONAL_PAIRS[i]: _TRADITIONAL_PAIRS[i + 1] for i in range(0, len(_TRADITIONAL_PAIRS), 2)
+})
+_SPACE_RE = re.compile(r"\s+")
+
+_cache: Optional[TieredCache] = None
+
+
+def normalize_query(query: str) -> str:
+    """归一化查询词，作为缓存键的主体"""
+    query = unicodedata.normalize("NFKC", query).translate(_TRADITIONAL_TO_SIMPLIFIED).lower()
+    return _SPACE_RE.sub(" ", query).strip(" ?？。.!！")
+
+
+def get_search_cache() -> Optional[TieredCache]:
+    """返回搜索缓存单例；SEARCH_CACHE=0 时为 None"""
+    global _cache
+    if _cache is None and SEARCH_CACHE:
+        _cache = TieredCache(
+            name="search_cache",
+            max_entries=SEARCH_CACHE_MAX_ENTRIES,
+            ttl=SEARCH_CACHE_TTL,
+            sqlite_path=SEARCH_CACHE_DB or None,
+        )
+    return _cache
+
+
+class PooledTavilyAPIWrapper(TavilySearchAPIWrapper):
+    """
+    请求参数与返回格式同 TavilySearchAPIWrapper，连接取自上游调用层的共享会话，
+    调用前经过 "tavily" 限流器，429/5xx 按退避策略重试，最终失败仍抛出异常（由 TavilySearch 转成 {"error": ...}）
+    """
+
+    def _request(self, query: str, kwargs: dict):
+        params = {k: v for k, v in {"query": query, **kwargs}.items() if v is not None}
+        headers = {
+            "Authorization": f"Bearer {self.tavily_api_key.get_secret_value()}",
+            "Content-Type": "application/json",
+            "X-Client-Source": "langchain-tavily",
+        }
+        return f"{self.api_base_url or TAVILY_API_URL}/search", params, headers
+
+    def raw_results(self, query: str, **kwargs: Any) -> Dict[str, Any]:
+        url, params, headers = self._request(query, kwargs)
+
+        def call():
+            timeout = request_timeout()
+            response = get_http_session().post(
+                url, json=params, headers=headers,
+                timeout=UPSTREAM_TIMEOUT if timeout is None else min(timeout, UPSTREAM_TIMEOUT),
+            )
+            if response.status_code != 200:
+                raise UpstreamError(
+                    f"Error {response.status_code}: {response.text[:200]}",
+                    response.status_code, retry_after_of(response.headers),
+                )
+            return response.json()
+
+        return call_with_retry("tavily", call)
+
+    async def raw_results_async(self, query: str, **kwargs: Any) -> Dict[str, Any]:
+        url, params, headers = self._request(query, kwargs)
+
+        async def call():
+            async with get_aio_session().post(url, json=params, headers=headers) as response:
+                if response.status != 200:
+                    raise UpstreamError(
+                        f"Error {response.status}: {response.reason}",
+                        response.status, retry_after_of(response.headers),
+                    )
+                return json.loads(await response.text())
+
+        return await acall_with_retry("tavily", call)
+
+
+class CachedTavilySearch(TavilySearch):
+    """带缓存的 TavilySearch，对模型暴露的工具名、参数与返回格式与原工具完全一致"""
+
+    api_wrapper: TavilySearchAPIWrapper = Field(default_factory=PooledTavilyAPIWrapper)
+
+    def __init__(self, **kwargs: Any) -> None:
+        # 父类在传入 tavily_api_key / api_base_url 时会自行创建普通的 wrapper，这里换成走连接池的版本
+        wrapper_kwargs = {k: kwargs.pop(k) for k in ("tavily_api_key", "api_base_url") if k in kwargs}
+        if wrapper_kwargs:
+            kwargs["api_wrapper"] = PooledTavilyAPIWrapper(**wrapper_kwargs)
+        super().__init__(**kwargs)
+
+    def _cache_key(self, query: str, kwargs: dict) -> str:
+        # 模型偶尔会附带 search_depth / topic 等参数，参数不同的结果分开缓存
+        params = {k: v for k, v in kwargs.items() if v is not None}
+        params["max_results"] = self.max_results
+        return f"{normalize_query(query)}|{json.dumps(params, sort_keys=True, ensure_ascii=False)}"
+
+    @staticmethod
+    def _lookup(cache: TieredCache, key: str):
+        value = cache.get(key)
+        if value is None:
+            metrics.incr("search_cache_misses")
+            return None
+        metrics.incr("search_cache_hits")
+        return json.loads(value)
+
+    @staticmethod
+    def _store(cache: TieredCache, key: str, result):
+        # TavilySearch 出错时返回 {"error": ...}，不能缓存
+        if isinstance(result, dict) and result.get("results") and "error" not in result:
+            cache.set(key, json.dumps(result, ensure_ascii=False, default=str))
+
+    def _run(self, query: str, run_manager=None, **kwargs):
+        cache = get_search_cache()
+        if cache is None:
+            return super()._run(query, run_manager=run_manager, **kwargs)
+
+        key = self._cache_key(query, kwargs)
+        cached = self._lookup(cache, key)
+        if cached is not None:
+            return cached
+        result = super()._run(query, run_manager=run_manager, **kwargs)
+        self._store(cache, key, result)
+        return result
+
+    async def _arun(self, query: str, run_manager=None, **kwargs):
+        cache = get_search_cache()
+        if cache is None:
+            return await super()._arun(query, run_manager=run_manager, **kwargs)
+
+        key = self._cache_key(query, kwargs)
+        cached = self._lookup(cache, key)
+        if cached is not None:
+            return cached
+        result = await super()._arun(query, run_manager=run_manager, **kwargs)
+        self._store(cache, key, result)
+        return result
@@ -0,0 +1,110 @@
+"""
+相同分析请求的合并（single-flight）
+
+小程序在 60 秒超时后会重发同一张图片，而原请求仍在执行，两条完全相同的链路同时消耗模型调用。
+SingleFlight 按键合并并发的相同请求：
+- 同一个键已有在途分析时，后来者等待同一个 Future，不再发起新的分析
+- 分析以独立任务运行（asyncio.shield），发起者断开或被取消不影响其他等待者
+- 成功完成的结果在 SINGLE_FLIGHT_RESULT_TTL 秒内保留，迟到的重试直接拿到结果；异常不保留
+键由 analysis_key 生成：用户名 + 图片内容哈希 + 食堂 / 餐次，客户端提供 Idempotency-Key 时改用用户名 + 该键。
+即时请求、批量接口的单项与只排队不拒绝的请求（任务队列）的键互不相同：
+即时请求可能被准入拒绝或因截止时间得到部分报告，这些结果不能交给准入条件更宽松的请求。
+"""
+import asyncio
+import hashlib
+import os
+import time
+from collections import OrderedDict
+from typing import Awaitable, Callable, Dict, Optional, Tuple, TypeVar
+
+from app.agent_utils import metrics
+
+SINGLE_FLIGHT = os.getenv("SINGLE_FLIGHT", "1") == "1"
+SINGLE_FLIGHT_RESULT_TTL = float(os.getenv("SINGLE_FLIGHT_RESULT_TTL", "120"))
+SINGLE_FLIGHT_MAX_RESULTS = int(os.getenv("SINGLE_FLIGHT_MAX_RESULTS", "1024"))
+
+T = TypeVar("T")
+
+
+def analysis_key(username: str, image: bytes, canteen_name: Optional[str] = None,
+                 meal_type: Optional[str] = None, idempotency_key: Optional[str] = None,
+                 mode: str = "now") -> str:
+    """
+    合并请求用的键；Idempotency-Key 只在同一用户内生效，避免不同用户的键互相串用
+
+    :param mode: 准入方式，now（即时）/ batch（批量单项）/ patient（任务队列）
+    """
+    if idempotency_key:
+        return f"idem:{mode}:{username}:{idempotency_key}"
+    digest = hashlib.sha256(image).hexdigest()
+    return f"image:{mode}:{username}:{digest}:{canteen_name or ''}:{meal_type or ''}"
+
+
+class SingleFlight:
+    def __init__(self, result_ttl: float = SINGLE_FLIGHT_RESULT_TTL, max_results: int = SINGLE_FLIGHT_MAX_RESULTS):
+        """
+        :param result_ttl: 完成结果的保留秒数，<= 0 时不保留（只合并在途请求）
+        :param max_results: 保留的完成结果条数上限，超出时淘汰最早的
+        """
+        self.result_ttl = result_ttl
+        self.max_results = max_results
+        self._inflight: Dict[str, asyncio.Future] = {}
+        self._results: "OrderedDict[str, Tuple[float, object]]" = OrderedDict()
+
+    def _cached(self, key: str):
+        entry = self._results.get(key)
+        if entry is None:
+            return None
+        expires, value = entry
+        if expires < time.monotonic():
+            del self._results[key]
+            return None
+        return value
+
+    def remember(self, key: str, value):
+        """把在 do 之外得到的结果放进完成结果窗口（例如流式接口的最终响应）"""
+        if self.result_ttl <= 0:
+            return
+        self._results[key] = (time.monotonic() + self.result_ttl, value)
+        self._results.move_to_end(key)
+        while len(self._results) > self.max_results:
+            self._results.popitem(last=False)
+
+    def lookup(self, key: str) -> Optional[Awaitable]:
+        """已有完成结果或在途分析时返回可等待对象，否则返回 None（不发起新的分析）"""
+        cached = self._cached(key)
+        if cached is not None:
+            metrics.incr("single_flight_result_hits")
+            future = asyncio.get_running_loop().create_future()
+            future.set_result(cached)
+            return future
+        task = self._inflight.get(key)
+        if task is not None:
+            metrics.incr("single_flight_coalesced")
+            return asyncio.shield(task)
+        return None
+
+    async def do(self, key: str, fn: Callable[[], Awaitable[T]],
+                 cacheable: Callable[[T], bool] = lambda value: True) -> T:
+        """
+        执行 fn 并返回结果；相同键的并发调用共享同一次执行
+
+        :param cacheable: 判断结果是否进入完成结果窗口（例如只保留成功的响应）
+        """
+        waiting = self.lookup(key)
+        if waiting is not None:
+            return await waiting
+
+        metrics.incr("single_flight_leaders")
+        task = asyncio.ensure_future(fn())
+        self._inflight[key] = task
+        metrics.set_gauge("single_flight_inflight", len(self._inflight))
+
+        def finished(done: asyncio.Future):
+            self._inflight.pop(key, None)
+            metrics.set_gauge("single_flight_inflight", len(self._inflight))
+            if not done.cancelled() and done.exception() is None and cacheable(done.result()):
+                self.remember(key, done.result())
+
+        task.add_done_callback(finished)
+        return await asyncio.shield(task)
@@ -0,0 +1,161 @@
+"""
+两级键值缓存：进程内 LRU（带 TTL）+ 可选的 SQLite 持久层
+
+值统一为字符串（调用方自行 JSON 序列化），便于在结果缓存、搜索缓存等场景复用。
+"""
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Iterator, Optional, Tuple
+
+
+class TieredCache:
+    def __init__(self, name: str, max_entries: int = 1024, ttl: float = 3600,
+                 sqlite_path: Optional[str] = None, max_disk_entries: int = 100_000, version: str = ""):
+        """
+        :param name: 缓存名，同时作为 SQLite 表名
+        :param max_entries: 内存层最多保留的条目数（LRU 淘汰）
+        :param ttl: 条目存活秒数
+        :param sqlite_path: SQLite 文件路径，为空时只使用内存层
+        :param max_disk_entries: SQLite 层最多保留的条目数，超出后按最近访问时间淘汰
+        :param version: 缓存版本号，版本变化时持久层中的旧条目全部失效
+        """
+        self.name = name
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.max_disk_entries = max_disk_entries
+        self.version = version
+
+        self._lock = threading.Lock()
+        self._memory: "OrderedDict[str, Tuple[float, str]]" = OrderedDict()
+        self._disk_writes = 0
+
+        self.conn = None
+        if sqlite_path:
+            self.conn = sqlite3.connect(sqlite_path, check_same_thread=False)
+            self._create_table()
+
+    def _create_table(self):
+        self.conn.execute(f"""
+        CREATE TABLE IF NOT EXISTS {self.name} (
+            key TEXT PRIMARY KEY,
+            value TEXT NOT NULL,
+            version TEXT NOT NULL,
+            expires_at REAL NOT NULL,
+            accessed_at REAL NOT NULL
+        )
+        """)
+        # 版本不一致（例如提示词改动）或已过期的条目直接清除
+        self.conn.execute(
+            f"DELETE FROM {self.name} WHERE version != ? OR expires_at < ?",
+            (self.version, time.time())
+        )
+        self.conn.commit()
+
+    def close(self):
+        with self._lock:
+            if self.conn:
+                self.conn.close()
+                self.conn = None
+
+    def get(self, key: str) -> Optional[str]:
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                expires_at, value = entry
+                if expires_at >= now:
+                    self._memory.move_to_end(key)
+                    return value
+                del self._memory[key]
+
+            if self.conn is None:
+                return None
+
+            row = self.conn.execute(
+                f"SELECT value, expires_at FROM {self.name} WHERE key = ? AND version = ?",
+                (key, self.version)
+            ).fetchone()
+            if row is None:
+                return None
+            value, expires_at = row
+            if expires_at < now:
+                self.conn.execute(f"DELETE FROM {self.name} WHERE key = ?", (key,))
+                self.conn.commit()
+                return None
+
+            self.conn.execute(f"UPDATE {self.name} SET accessed_at = ? WHERE key = ?", (now, key))
+            self.conn.commit()
+            # 回填内存层
+            self._set_memory(key, value, expires_at)
+            return value
+
+    def set(self, key: str, value: str, ttl: Optional[float] = None):
+        now = time.time()
+        expires_at = now + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._set_memory(key, value, expires_at)
+            if self.conn is None:
+                return
+
+            self.conn.execute(
+                f"INSERT OR REPLACE INTO {self.name} (key, value, version, expires_at, accessed_at) "
+                f"VALUES (?, ?, ?, ?, ?)",
+                (key, value, self.version, expires_at, now)
+            )
+            self._evict_disk()
+            self.conn.commit()
+
+    def delete(self, key: str):
+        with self._lock:
+            self._memory.pop(key, None)
+            if self.conn is not None:
+                self.conn.execute(f"DELETE FROM {self.name} WHERE key = ?", (key,))
+                self.conn.commit()
+
+    def clear(self):
+        """清空内存层与持久层"""
+        with self._lock:
+            self._memory.clear()
+            if self.conn is not None:
+                self.conn.execute(f"DELETE FROM {self.name}")
+                self.conn.commit()
+
+    def scan(self) -> Iterator[Tuple[str, str]]:
+        """遍历全部未过期条目（优先读持久层），用于启动时重建辅助索引"""
+        now = time.time()
+        with self._lock:
+            if self.conn is not None:
+                rows = self.conn.execute(
+                    f"SELECT key, value FROM {self.name} WHERE version = ? AND expires_at >= ? "
+                    f"ORDER BY accessed_at DESC LIMIT ?",
+                    (self.version, now, self.max_entries)
+                ).fetchall()
+            else:
+                rows = [(k, v) for k, (exp, v) in self._memory.items() if exp >= now]
+        yield from rows
+
+    def __len__(self) -> int:
+        return len(self._memory)
+
+    def _set_memory(self, key: str, value: str, expires_at: float):
+        self._memory[key] = (expires_at, value)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+
+    def _evict_disk(self):
+        # 每写入若干次才检查一次容量，避免每次 set 都做 COUNT
+        self._disk_writes += 1
+        if self._disk_writes % 64:
+            return
+        self.conn.execute(f"DELETE FROM {self.name} WHERE expires_at < ?", (time.time(),))
+        count = self.conn.execute(f"SELECT COUNT(*) FROM {self.name}").fetchone()[0]
+        if count <= self.max_disk_entries:
+            return
+        self.conn.execute(
+            f"DELETE FROM {self.name} WHERE key IN "
+            f"(SELECT key FROM {self.name} ORDER BY accessed_at ASC LIMIT ?)",
+            (count - self.max_disk_entries,)
+        )
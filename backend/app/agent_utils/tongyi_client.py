@@ -0,0 +1,148 @@
+"""
+接入上游调用层的 ChatTongyi
+
+ChatTongyi 自带的 tenacity 重试对任何 HTTPError 按 1~4 秒间隔重试最多 10 次、没有抖动，也不区分 429 与其他错误；
+异步调用则是把同步 SDK 丢进线程池。UpstreamChatTongyi 只替换非流式调用的这两处：
+- 调用前向该模型的 RateLimiter 申请 1 个请求与估算的输入 token，返回后按 usage 修正
+- 429 / 5xx / 连接错误交给 upstream.call_with_retry（指数退避 + 全抖动），400/401 等直接抛出
+- 异步路径使用 dashscope 的 AioGeneration / AioMultiModalConversation，不占用线程池
+- 上游调用的 span 挂在对应的 chat span 下，响应中的 token 用量记到该 span 上，按用户统计费用
+流式调用（streaming=True）仍走父类实现。
+
+另外，langchain_community 的 check_response 在 429 / 5xx 时构造 requests.HTTPError(response=DashScope 响应)，
+HTTPError 会探测 response.request，而 DashScope 响应对缺失属性抛 KeyError，结果父类实际抛出 KeyError、从不重试；
+这里改用 _check_response，非 200 时抛出带状态码的 UpstreamError。
+"""
+import asyncio
+import functools
+from typing import Any, Dict, List, Optional
+
+import dashscope
+from langchain_community.chat_models.tongyi import ChatTongyi
+from langchain_core.messages import BaseMessage
+from langchain_core.outputs import ChatGeneration, ChatResult
+
+from app.agent_utils.deadline import request_timeout
+from app.agent_utils.graph_tracing import graph_tracing
+from app.agent_utils.tracing import record_usage
+from app.agent_utils.upstream import (
+    UpstreamError,
+    acall_with_retry,
+    call_with_retry,
+    estimate_request_tokens,
+    get_limiter,
+)
+
+# 同步客户端 -> 对应的 aiohttp 客户端
+_AIO_CLIENTS = {
+    dashscope.Generation: dashscope.AioGeneration,
+    dashscope.MultiModalConversation: dashscope.AioMultiModalConversation,
+}
+
+
+def _check_response(resp: Any) -> Any:
+    """与 check_response 相同的判定：200 返回响应，400/401 抛 ValueError（不重试），其余抛 UpstreamError"""
+    status = resp["status_code"]
+    if status == 200:
+        return resp
+    message = (
+        f"request_id: {resp['request_id']} \n status_code: {status} \n "
+        f"code: {resp['code']} \n message: {resp['message']}"
+    )
+    if status in (400, 401):
+        raise ValueError(message)
+    raise UpstreamError(message, status)
+
+
+def _record_usage(model: str, resp: Any) -> Any:
+    """把响应中的输入 / 输出 token 数记到当前的 upstream span 上"""
+    try:
+        usage = resp["usage"] or {}
+    except (KeyError, TypeError):
+        usage = {}
+    record_usage(model, usage.get("input_tokens"), usage.get("output_tokens"))
+    return resp
+
+
+def _usage_tokens(resp: Any) -> Optional[int]:
+    """响应中的实际 token 用量，没有 usage 时返回 None"""
+    try:
+        usage = resp["usage"] or {}
+    except (KeyError, TypeError):
+        return None
+    total = usage.get("total_tokens")
+    if total is None and "input_tokens" in usage:
+        total = usage.get("input_tokens", 0) + usage.get("output_tokens", 0)
+    return total
+
+
+class UpstreamChatTongyi(ChatTongyi):
+    """经过上游调用层（限流 + 抖动重试 + 异步客户端）的 ChatTongyi"""
+
+    def completion_with_retry(self, **kwargs: Any) -> Any:
+        limiter = get_limiter(self.model_name)
+        estimated = estimate_request_tokens(kwargs.get("messages") or [])
+
+        def call():
+            # 在 sync_deadline 内时按剩余时间设置 HTTP 超时，剩余时间不足时不再发起（也不再重试）
+            timeout = request_timeout()
+            call_kwargs = kwargs if timeout is None else {**kwargs, "request_timeout": timeout}
+            return _record_usage(self.model_name, _check_response(self.client.call(**call_kwargs)))
+
+        resp = call_with_retry(self.model_name, call, estimated)
+        limiter.settle(estimated, _usage_tokens(resp))
+        return resp
+
+    async def acompletion_with_retry(self, **kwargs: Any) -> Any:
+        limiter = get_limiter(self.model_name)
+        estimated = estimate_request_tokens(kwargs.get("messages") or [])
+        aio_client = _AIO_CLIENTS.get(self.client)
+
+        async def call():
+            if aio_client is None:
+                resp = await asyncio.get_running_loop().run_in_executor(
+                    None, functools.partial(self.client.call, **kwargs)
+                )
+            else:
+                resp = await aio_client.call(**kwargs)
+            return _record_usage(self.model_name, _check_response(resp))
+
+        resp = await acall_with_retry(self.model_name, call, estimated)
+        limiter.settle(estimated, _usage_tokens(resp))
+        return resp
+
+    async def _agenerate(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager=None,
+        **kwargs: Any,
+    ) -> ChatResult:
+        if self.streaming:
+            return await super()._agenerate(messages, stop=stop, run_manager=run_manager, **kwargs)
+
+        params: Dict[str, Any] = self._invocation_params(messages=messages, stop=stop, **kwargs)
+        with graph_tracing.run_context(run_manager):
+            resp = await self.acompletion_with_retry(**params)
+        return self._chat_result(resp)
+
+    def _generate(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager=None,
+        **kwargs: Any,
+    ) -> ChatResult:
+        if self.streaming:
+            return super()._generate(messages, stop=stop, run_manager=run_manager, **kwargs)
+
+        params: Dict[str, Any] = self._invocation_params(messages=messages, stop=stop, **kwargs)
+        with graph_tracing.run_context(run_manager):
+            resp = self.completion_with_retry(**params)
+        return self._chat_result(resp)
+
+    def _chat_result(self, resp: Any) -> ChatResult:
+        return ChatResult(
+            generations=[ChatGeneration(**self._chat_generation_from_qwen_resp(resp))],
+            llm_output={"model_name": self.model_name},
+        )
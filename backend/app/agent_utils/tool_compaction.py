@@ -0,0 +1,122 @@
+"""
+工具结果压缩：ToolNode 与 searching 节点之间的一道工序
+
+Tavily 每次返回 3 条结果、每条是整段网页正文，原样追加进 messages 后会在之后的每一轮检索中被重复发送。
+这里只保留与油、盐、份量相关的句子（包含菜名用字的句子优先），每条结果按 UTF-8 字节数截断到 TOOL_RESULT_MAX_BYTES，
+标题与链接保留，便于模型判断来源。本地参考表等其他工具的结果本身很短，不做处理。
+"""
+import json
+import os
+import re
+from typing import List, Tuple
+
+from langchain_core.messages import ToolMessage
+
+from app.agent_utils import metrics
+
+TOOL_COMPACTION = os.getenv("TOOL_COMPACTION", "1") == "1"
+TOOL_RESULT_MAX_BYTES = int(os.getenv("TOOL_RESULT_MAX_BYTES", "600"))
+COMPACTED_TOOLS = ("tavily_search",)
+
+# 与油盐用量、份量有关的句子
+_RELEVANT_RE = re.compile(
+    r"油|盐|克|份量|每份|用量|毫升|勺|\d\s*(?:g|ml|kg)\b|\boil\b|\bsalt\b|sodium|serving|gram",
+    re.IGNORECASE,
+)
+# 带具体数量的句子最有用
+_QUANTITY_RE = re.compile(r"\d+(?:\.\d+)?\s*(?:g|克|ml|毫升|kg|千克|勺|汤匙|茶匙)", re.IGNORECASE)
+_SENTENCE_RE = re.compile(r"[^。！？；;!?\n]+[。！？；;!?]?")
+_CJK_RE = re.compile(r"[一-鿿]")
+
+
+def estimate_tokens(text: str) -> int:
+    """粗略估算 token 数：汉字约一字一个 token，其余字符约四个一个 token"""
+    cjk = len(_CJK_RE.findall(text))
+    return cjk + (len(text) - cjk + 3) // 4
+
+
+def _truncate_bytes(text: str, max_bytes: int) -> str:
+    encoded = text.encode("utf-8")
+    if len(encoded) <= max_bytes:
+        return text
+    return encoded[:max_bytes].decode("utf-8", errors="ignore") + "…"
+
+
+def extract_relevant(text: str, query: str, max_bytes: int = TOOL_RESULT_MAX_BYTES) -> str:
+    """
+    从网页正文中挑出油盐、份量相关的句子（去重），按原文顺序拼接，总长不超过 max_bytes
+
+    优先级：带具体数量 > 命中的相关词多 > 包含查询词用字多（更可能在讲这道菜）
+    """
+    query_chars = set(_CJK_RE.findall(query))
+    candidates, seen = [], set()
+    for i, sentence in enumerate(s.strip() for s in _SENTENCE_RE.findall(text or "")):
+        if not sentence or sentence in seen or not _RELEVANT_RE.search(sentence):
+            continue
+        seen.add(sentence)
+        score = (
+            2 * bool(_QUANTITY_RE.search(sentence))
+            + len({m.lower() for m in _RELEVANT_RE.findall(sentence)})
+            + 0.1 * len(query_chars & set(sentence))
+        )
+        candidates.append((score, i, sentence))
+    ranked = [(i, sentence) for _, i, sentence in sorted(candidates, key=lambda c: -c[0])]
+
+    picked, used = [], 0
+    for index, sentence in ranked:
+        size = len(sentence.encode("utf-8"))
+        if used + size > max_bytes:
+            if not picked:
+                picked.append((index, _truncate_bytes(sentence, max_bytes)))
+            break
+        picked.append((index, sentence))
+        used += size
+    return " ".join(sentence for _, sentence in sorted(picked))
+
+
+def compact_search_result(content: str, max_bytes: int = TOOL_RESULT_MAX_BYTES) -> str:
+    """压缩一条 Tavily 返回（JSON 字符串）；无法解析时整体按字节截断"""
+    try:
+        data = json.loads(content)
+    except (TypeError, ValueError):
+        return _truncate_bytes(content, max_bytes)
+    if not isinstance(data, dict) or "results" not in data:
+        return content
+
+    query = data.get("query") or ""
+    compacted = {"query": query, "results": []}
+    if data.get("answer"):
+        compacted["answer"] = _truncate_bytes(data["answer"], max_bytes)
+    for result in data["results"]:
+        excerpt = extract_relevant(result.get("content") or result.get("raw_content") or "", query, max_bytes)
+        if excerpt:
+            compacted["results"].append({
+                "title": result.get("title", ""),
+                "url": result.get("url", ""),
+                "excerpt": excerpt,
+            })
+    return json.dumps(compacted, ensure_ascii=False)
+
+
+def compact_tool_messages(messages: List) -> Tuple[List, int]:
+    """
+    压缩 ToolNode 输出中的搜索结果，返回 (新的消息列表, 省下的估算 token 数)
+    """
+    if not TOOL_COMPACTION:
+        return messages, 0
+
+    compacted, saved = [], 0
+    for message in messages:
+        if not isinstance(message, ToolMessage) or message.name not in COMPACTED_TOOLS \
+                or not isinstance(message.content, str):
+            compacted.append(message)
+            continue
+        content = compact_search_result(message.content)
+        before, after = estimate_tokens(message.content), estimate_tokens(content)
+        if after >= before:
+            content, after = message.content, before
+        metrics.observe("tool_result_tokens_before", before)
+        metrics.observe("tool_result_tokens_after", after)
+        saved += max(0, before - after)
+        compacted.append(message.model_copy(update={"content": content}))
+    return compacted, saved
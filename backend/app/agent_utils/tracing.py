@@ -0,0 +1,310 @@
+"""
+OpenTelemetry 链路追踪与按用户的 token / 费用统计
+
+每个 HTTP 请求一条 trace（RequestMetricsMiddleware 创建根 span），其下的子 span：
+- image.upload / image.preprocess / image.quality / image.encode：图片校验与处理
+- analysis：一次分析（批量接口每张图片一个），带 enduser.id，其下所有 span 都会继承该用户
+- node {节点名} / chat {模型} / execute_tool {工具名}：由 GraphTracingHandler（graph_tracing.py）按 LangChain 回调创建，
+  节点 / 工具内部创建的 span 通过 set_parent_resolver 注册的查找函数挂到对应的节点 / 工具 span 下
+- upstream {上游}：一次实际发往 DashScope / Tavily 的调用（含重试），DashScope 的 span 带 gen_ai.usage.* token 数，
+  成功的调用按 UPSTREAM_PRICES 计算费用写入 app.cost；缓存命中不产生这一层 span，也不计费
+UsageAggregator 作为 SpanProcessor 从结束的 span 中按用户累加请求数、token 数与费用，/stats 的 usage_users 导出。
+
+导出方式由 TRACE_EXPORTER 决定：
+- none（默认）：只在进程内统计
+- file：每个 span 一行 JSON 追加写入 TRACE_FILE，可用 `python -m app.agent_utils.tracing traces.jsonl` 列出最慢 / 最贵的请求
+- otlp：OTLP gRPC 导出，地址等按 OpenTelemetry 标准环境变量（OTEL_EXPORTER_OTLP_ENDPOINT 等）配置
+TRACING=0 时使用 NoOpTracer，不创建任何 span。
+"""
+import json
+import os
+import sys
+import threading
+from collections import OrderedDict, defaultdict
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Callable, Dict, Optional, Sequence
+
+from opentelemetry import context, trace
+from opentelemetry.sdk.resources import Resource
+from opentelemetry.sdk.trace import ReadableSpan, SpanProcessor, TracerProvider
+from opentelemetry.sdk.trace.export import BatchSpanProcessor, SpanExporter, SpanExportResult
+from opentelemetry.trace import SpanKind
+
+from app.agent_utils import metrics
+
+TRACING = os.getenv("TRACING", "1") == "1"
+TRACE_EXPORTER = os.getenv("TRACE_EXPORTER", "none").lower()  # none / file / otlp
+TRACE_FILE = os.getenv("TRACE_FILE", "traces.jsonl")
+TRACE_SERVICE_NAME = os.getenv("TRACE_SERVICE_NAME", "vision-analysis-agent")
+# 保留用量统计的用户数上限，超出时淘汰最久未活动的用户
+TRACE_TRACKED_USERS = int(os.getenv("TRACE_TRACKED_USERS", "1000"))
+
+# 单价（元）：input / output 为每千 token，request 为每次调用；可用 UPSTREAM_PRICES（JSON）覆盖
+_DEFAULT_PRICES = {
+    "qwen-plus": {"input": 0.0008, "output": 0.002},
+    "qwen3-vl-plus": {"input": 0.001, "output": 0.01},
+    "tavily": {"request": 0.06},
+}
+UPSTREAM_PRICES: Dict[str, Dict[str, float]] = {
+    **_DEFAULT_PRICES,
+    **json.loads(os.getenv("UPSTREAM_PRICES", "{}")),
+}
+
+# span 属性名，gen_ai.* / enduser.id 沿用 OpenTelemetry 语义约定
+USER_ATTR = "enduser.id"
+UPSTREAM_ATTR = "upstream.name"
+MODEL_ATTR = "gen_ai.request.model"
+INPUT_TOKENS_ATTR = "gen_ai.usage.input_tokens"
+OUTPUT_TOKENS_ATTR = "gen_ai.usage.output_tokens"
+COST_ATTR = "app.cost"
+ANALYSIS_SPAN = "analysis"
+
+_USER_KEY = context.create_key("vaa-user")
+# 由 graph_tracing 注册：返回当前所在 LangChain 节点 / 工具对应 span 的上下文
+_parent_resolver: Optional[Callable[[], Optional[context.Context]]] = None
+
+
+class JsonLinesSpanExporter(SpanExporter):
+    """把 span 逐行以 JSON 追加写入本地文件，供离线分析"""
+
+    def __init__(self, path: str = TRACE_FILE):
+        self.path = path
+        self._file = None
+        self._lock = threading.Lock()
+
+    def export(self, spans: Sequence[ReadableSpan]) -> SpanExportResult:
+        lines = "".join(span.to_json(indent=None) + "\n" for span in spans)
+        try:
+            with self._lock:
+                if self._file is None:
+                    self._file = open(self.path, "a", encoding="utf-8")
+                self._file.write(lines)
+                self._file.flush()
+        except OSError as e:
+            print(f"[链路追踪] 写入 {self.path} 失败: {e}")
+            return SpanExportResult.FAILURE
+        return SpanExportResult.SUCCESS
+
+    def force_flush(self, timeout_millis: int = 30000) -> bool:
+        return True
+
+    def shutdown(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+
+class _UserUsage:
+    def __init__(self):
+        self.requests = 0
+        self.analysis_seconds = 0.0
+        self.input_tokens = 0
+        self.output_tokens = 0
+        self.cost = 0.0
+        self.upstream_calls: Dict[str, int] = defaultdict(int)
+
+    def to_dict(self) -> dict:
+        return {
+            "requests": self.requests,
+            "analysis_seconds": self.analysis_seconds,
+            "input_tokens": self.input_tokens,
+            "output_tokens": self.output_tokens,
+            "cost": round(self.cost, 6),
+            "upstream_calls": dict(self.upstream_calls),
+        }
+
+
+class UsageAggregator(SpanProcessor):
+    """
+    从 span 中按用户累加用量
+
+    span 开始时从上下文中取出 analysis 设置的用户写入 enduser.id（分析被取消后仍在运行的子任务同样能归属到用户），
+    结束时：analysis span 计一次请求，带 app.cost 的 upstream span 计一次计费调用
+    """
+
+    def __init__(self, max_users: int = TRACE_TRACKED_USERS):
+        self.max_users = max_users
+        self._users: "OrderedDict[str, _UserUsage]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def on_start(self, span, parent_context: Optional[context.Context] = None):
+        if span.attributes.get(USER_ATTR) is None:
+            user = context.get_value(_USER_KEY, parent_context)
+            if user is not None:
+                span.set_attribute(USER_ATTR, user)
+
+    def on_end(self, span: ReadableSpan):
+        attributes = span.attributes or {}
+        upstream = attributes.get(UPSTREAM_ATTR)
+        cost = attributes.get(COST_ATTR)
+        if upstream is not None and cost is not None:
+            input_tokens = attributes.get(INPUT_TOKENS_ATTR, 0)
+            output_tokens = attributes.get(OUTPUT_TOKENS_ATTR, 0)
+            metrics.incr("upstream_cost", cost, labels={"upstream": upstream})
+            if input_tokens or output_tokens:
+                metrics.incr("upstream_tokens", input_tokens, labels={"upstream": upstream, "kind": "input"})
+                metrics.incr("upstream_tokens", output_tokens, labels={"upstream": upstream, "kind": "output"})
+
+        user = attributes.get(USER_ATTR)
+        if user is None:
+            return
+        with self._lock:
+            usage = self._usage(user)
+            if span.name == ANALYSIS_SPAN:
+                usage.requests += 1
+                usage.analysis_seconds += (span.end_time - span.start_time) / 1e9
+            elif upstream is not None and cost is not None:
+                usage.upstream_calls[upstream] += 1
+                usage.input_tokens += attributes.get(INPUT_TOKENS_ATTR, 0)
+                usage.output_tokens += attributes.get(OUTPUT_TOKENS_ATTR, 0)
+                usage.cost += cost
+
+    def _usage(self, user: str) -> _UserUsage:
+        usage = self._users.get(user)
+        if usage is None:
+            if len(self._users) >= self.max_users:
+                self._users.popitem(last=False)
+            usage = self._users[user] = _UserUsage()
+        self._users.move_to_end(user)
+        return usage
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {user: usage.to_dict() for user, usage in self._users.items()}
+
+    def shutdown(self):
+        pass
+
+    def force_flush(self, timeout_millis: int = 30000) -> bool:
+        return True
+
+
+def _build_exporter() -> Optional[SpanExporter]:
+    if TRACE_EXPORTER == "file":
+        return JsonLinesSpanExporter(TRACE_FILE)
+    if TRACE_EXPORTER == "otlp":
+        # gRPC 导出器导入较慢，只在启用时导入
+        from opentelemetry.exporter.otlp.proto.grpc.trace_exporter import OTLPSpanExporter
+        return OTLPSpanExporter()
+    if TRACE_EXPORTER != "none":
+        print(f"[链路追踪] 未知的 TRACE_EXPORTER: {TRACE_EXPORTER}，只在进程内统计")
+    return None
+
+
+usage_aggregator = UsageAggregator()
+_provider: Optional[TracerProvider] = None
+
+if TRACING:
+    _provider = TracerProvider(resource=Resource.create({"service.name": TRACE_SERVICE_NAME}))
+    _provider.add_span_processor(usage_aggregator)
+    _exporter = _build_exporter()
+    if _exporter is not None:
+        _provider.add_span_processor(BatchSpanProcessor(_exporter))
+    tracer = _provider.get_tracer(__name__)
+else:
+    tracer = trace.NoOpTracer()
+
+
+def set_parent_resolver(resolver: Callable[[], Optional[context.Context]]):
+    """注册父 span 的查找函数，span / upstream_span 在 LangChain 节点或工具内部调用时挂到对应的 span 下"""
+    global _parent_resolver
+    _parent_resolver = resolver
+
+
+def _parent_context() -> Optional[context.Context]:
+    return _parent_resolver() if _parent_resolver is not None else None
+
+
+@contextmanager
+def span(name: str, attributes: Optional[dict] = None, user: Optional[str] = None,
+         kind: SpanKind = SpanKind.INTERNAL):
+    """
+    以当前 span 为父创建子 span 并设为当前 span
+
+    给出 user 时同时写入上下文，其下创建的所有 span（包括其中启动的子任务）都带上 enduser.id
+    """
+    token = context.attach(context.set_value(_USER_KEY, user)) if user is not None else None
+    try:
+        with tracer.start_as_current_span(name, context=_parent_context(), kind=kind,
+                                          attributes=attributes) as current:
+            yield current
+    finally:
+        if token is not None:
+            context.detach(token)
+
+
+@contextmanager
+def upstream_span(name: str):
+    """一次上游调用（含重试）的 span；成功结束时按 UPSTREAM_PRICES 与记录的 token 数计算费用"""
+    with tracer.start_as_current_span(f"upstream {name}", context=_parent_context(), kind=SpanKind.CLIENT,
+                                      attributes={UPSTREAM_ATTR: name}) as current:
+        yield current
+        attributes = getattr(current, "attributes", None) or {}
+        current.set_attribute(COST_ATTR, cost_of(
+            name, attributes.get(INPUT_TOKENS_ATTR, 0), attributes.get(OUTPUT_TOKENS_ATTR, 0)
+        ))
+
+
+def record_usage(model: str, input_tokens: Optional[int], output_tokens: Optional[int]):
+    """在当前 span（上游调用中即 upstream span）上记录模型名与 token 用量"""
+    current = trace.get_current_span()
+    current.set_attribute(MODEL_ATTR, model)
+    if input_tokens is not None:
+        current.set_attribute(INPUT_TOKENS_ATTR, input_tokens)
+    if output_tokens is not None:
+        current.set_attribute(OUTPUT_TOKENS_ATTR, output_tokens)
+
+
+def cost_of(name: str, input_tokens: int = 0, output_tokens: int = 0) -> float:
+    """按单价计算一次调用的费用（元），没有配置单价的上游记为 0"""
+    price = UPSTREAM_PRICES.get(name, {})
+    return (
+        price.get("request", 0.0)
+        + input_tokens / 1000 * price.get("input", 0.0)
+        + output_tokens / 1000 * price.get("output", 0.0)
+    )
+
+
+def usage_stats() -> dict:
+    """各用户的请求数、分析耗时、token 数、费用与上游调用次数，供 /stats 导出"""
+    return usage_aggregator.snapshot()
+
+
+def shutdown_tracing():
+    """导出缓冲中剩余的 span 并关闭导出器，在服务关闭时调用"""
+    if _provider is not None:
+        _provider.shutdown()
+
+
+def summarize_trace_file(path: str, top: int = 10):
+    """读取 file 导出器写出的 JSON Lines，按耗时与费用列出最突出的 trace"""
+    traces = defaultdict(lambda: {"root": None, "seconds": 0.0, "cost": 0.0, "tokens": 0, "user": None})
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            record = json.loads(line)
+            item = traces[record["context"]["trace_id"]]
+            attributes = record.get("attributes") or {}
+            item["cost"] += attributes.get(COST_ATTR, 0.0) if UPSTREAM_ATTR in attributes else 0.0
+            if UPSTREAM_ATTR in attributes:
+                item["tokens"] += attributes.get(INPUT_TOKENS_ATTR, 0) + attributes.get(OUTPUT_TOKENS_ATTR, 0)
+            item["user"] = item["user"] or attributes.get(USER_ATTR)
+            if record.get("parent_id") is None:
+                item["root"] = record["name"]
+                item["seconds"] = _seconds(record["start_time"], record["end_time"])
+
+    for key, title in (("seconds", "最慢"), ("cost", "最贵")):
+        print(f"== {title}的 {top} 个请求")
+        ranked = sorted(traces.items(), key=lambda item: item[1][key], reverse=True)[:top]
+        for trace_id, item in ranked:
+            print(f"{trace_id}  {item['root'] or '?':<24} 用户 {item['user'] or '-':<16} "
+                  f"耗时 {item['seconds']:7.2f}s  token {item['tokens']:7d}  费用 {item['cost']:.4f} 元")
+
+
+def _seconds(start: str, end: str) -> float:
+    return (datetime.fromisoformat(end.rstrip("Z")) - datetime.fromisoformat(start.rstrip("Z"))).total_seconds()
+
+
+if __name__ == "__main__":
+    summarize_trace_file(sys.argv[1] if len(sys.argv) > 1 else TRACE_FILE)
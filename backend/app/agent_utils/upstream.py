@@ -0,0 +1,317 @@
+"""
+上游调用层：DashScope（千问）与 Tavily 共用的限流、重试与连接池
+
+- 限流：每个上游（按模型名，Tavily 记为 "tavily"）一个令牌桶限流器，同时约束每分钟请求数（RPM）与 token 数（TPM）；
+  调用前按估算的 token 数扣减，拿到实际用量后再多退少补。默认配额见 _DEFAULT_LIMITS，可用 UPSTREAM_LIMITS（JSON）覆盖
+- 重试：429 / 5xx / 连接错误按指数退避 + 全抖动（full jitter）重试，服务端给出 Retry-After 时不早于它；其他错误立即抛出
+- 连接池：Tavily 通过共享的 requests.Session / aiohttp.ClientSession 复用 keep-alive 连接。
+  DashScope SDK 每次调用都新建会话（requests.Session / aiohttp.ClientSession 均在 SDK 内部创建），无法注入连接池，
+  这一侧只做限流与重试，异步调用改走 SDK 的 aiohttp 客户端，不再占用线程池
+- 追踪：每次调用（含重试）记为一个 upstream span，成功时按单价计入费用（见 tracing.py）
+模型通过 get_llm() / get_vision_llm()（UpstreamChatTongyi），搜索工具通过 CachedTavilySearch 使用这一层。
+"""
+import asyncio
+import json
+import os
+import random
+import threading
+import time
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple, TypeVar
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from app.agent_utils import metrics
+from app.agent_utils.tool_compaction import estimate_tokens
+from app.agent_utils.tracing import upstream_span
+
+# (每分钟请求数, 每分钟 token 数)，token 配额为 None 表示不限
+_DEFAULT_LIMITS = {
+    "qwen-plus": (1200, 1_000_000),
+    "qwen3-vl-plus": (600, 500_000),
+    "tavily": (100, None),
+}
+UPSTREAM_LIMITS: Dict[str, Tuple[Optional[float], Optional[float]]] = {
+    **_DEFAULT_LIMITS,
+    **{name: tuple(limits) for name, limits in json.loads(os.getenv("UPSTREAM_LIMITS", "{}")).items()},
+}
+# 令牌桶容量 = 配额 × 该秒数 / 60，决定允许的瞬时突发量
+UPSTREAM_BURST_SECONDS = float(os.getenv("UPSTREAM_BURST_SECONDS", "5"))
+UPSTREAM_MAX_RETRIES = int(os.getenv("UPSTREAM_MAX_RETRIES", "4"))
+UPSTREAM_BACKOFF_BASE = float(os.getenv("UPSTREAM_BACKOFF_BASE", "0.5"))
+UPSTREAM_BACKOFF_MAX = float(os.getenv("UPSTREAM_BACKOFF_MAX", "8"))
+UPSTREAM_POOL_SIZE = int(os.getenv("UPSTREAM_POOL_SIZE", "32"))
+UPSTREAM_TIMEOUT = float(os.getenv("UPSTREAM_TIMEOUT", "30"))
+# 每张图片计入 TPM 的 token 数（base64 字符串长度与实际计费无关）
+IMAGE_TOKENS = int(os.getenv("UPSTREAM_IMAGE_TOKENS", "1200"))
+
+T = TypeVar("T")
+
+
+class UpstreamError(Exception):
+    """上游返回了非 200 状态码"""
+
+    def __init__(self, message: str, status: int, retry_after: Optional[float] = None):
+        super().__init__(message)
+        self.status = status
+        self.retry_after = retry_after
+
+
+class TokenBucket:
+    def __init__(self, per_minute: float, burst_seconds: float = UPSTREAM_BURST_SECONDS):
+        self.rate = per_minute / 60
+        self.capacity = max(1.0, self.rate * burst_seconds)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount: float, now: float) -> float:
+        """还需等待的秒数；超过桶容量的请求在桶满时放行（余额记为负数，之后的请求补足）"""
+        self._refill(now)
+        needed = min(amount, self.capacity)
+        if self.tokens >= needed:
+            return 0.0
+        return (needed - self.tokens) / self.rate
+
+    def take(self, amount: float):
+        self.tokens -= amount
+
+
+class RateLimiter:
+    """单个上游的 RPM + TPM 限流器，线程与协程都可以使用"""
+
+    def __init__(self, name: str, rpm: Optional[float], tpm: Optional[float]):
+        self.name = name
+        self.requests = TokenBucket(rpm) if rpm else None
+        self.tokens = TokenBucket(tpm) if tpm else None
+        self._lock = threading.Lock()
+
+    def _try_acquire(self, tokens: int) -> float:
+        """两只桶都够时一起扣减并返回 0，否则返回需要等待的秒数"""
+        with self._lock:
+            now = time.monotonic()
+            wait = 0.0
+            if self.requests is not None:
+                wait = max(wait, self.requests.wait_time(1, now))
+            if self.tokens is not None and tokens:
+                wait = max(wait, self.tokens.wait_time(tokens, now))
+            if wait == 0:
+                if self.requests is not None:
+                    self.requests.take(1)
+                if self.tokens is not None:
+                    self.tokens.take(tokens)
+            return wait
+
+    def acquire(self, tokens: int = 0):
+        waited = 0.0
+        while (wait := self._try_acquire(tokens)) > 0:
+            time.sleep(wait)
+            waited += wait
+        self._record(waited)
+
+    async def aacquire(self, tokens: int = 0):
+        waited = 0.0
+        while (wait := self._try_acquire(tokens)) > 0:
+            await asyncio.sleep(wait)
+            waited += wait
+        self._record(waited)
+
+    def settle(self, estimated: int, actual: Optional[int]):
+        """按实际用量修正 TPM 桶（多退少补）"""
+        if self.tokens is None or actual is None:
+            return
+        with self._lock:
+            self.tokens.take(actual - estimated)
+
+    def _record(self, waited: float):
+        metrics.incr(f"upstream_{_metric_name(self.name)}_requests")
+        if waited:
+            metrics.observe(f"upstream_{_metric_name(self.name)}_limiter_wait_seconds", waited)
+
+
+_limiters: Dict[str, RateLimiter] = {}
+_limiters_lock = threading.Lock()
+
+
+def get_limiter(name: str) -> RateLimiter:
+    """返回上游的限流器单例；未配置配额的上游不限流"""
+    with _limiters_lock:
+        limiter = _limiters.get(name)
+        if limiter is None:
+            rpm, tpm = UPSTREAM_LIMITS.get(name, (None, None))
+            limiter = _limiters[name] = RateLimiter(name, rpm, tpm)
+        return limiter
+
+
+def estimate_request_tokens(messages: list) -> int:
+    """估算一次请求的输入 token 数（DashScope 消息格式：content 为字符串或 [{"text"}, {"image"}] 列表）"""
+    total = 0
+    for message in messages:
+        content = message.get("content") if isinstance(message, dict) else getattr(message, "content", "")
+        if isinstance(content, str):
+            total += estimate_tokens(content)
+            continue
+        for part in content or []:
+            if isinstance(part, dict) and "image" in part:
+                total += IMAGE_TOKENS
+            elif isinstance(part, dict):
+                total += estimate_tokens(str(part.get("text", "")))
+    return total
+
+
+def _metric_name(name: str) -> str:
+    return name.replace("-", "_").replace(".", "_")
+
+
+def _status_of(exc: Exception) -> Optional[int]:
+    if isinstance(exc, UpstreamError):
+        return exc.status
+    # requests 的 HTTPError 带 Response；ChatTongyi 的 HTTPError 带 DashScope 响应，两者都有 status_code 属性
+    return getattr(getattr(exc, "response", None), "status_code", None)
+
+
+def is_retryable(exc: Exception) -> bool:
+    status = _status_of(exc)
+    if status is not None:
+        return status == 429 or status >= 500
+    if isinstance(exc, (requests.ConnectionError, requests.Timeout)):
+        return True
+    import aiohttp
+    return isinstance(exc, (aiohttp.ClientConnectionError, aiohttp.ServerTimeoutError))
+
+
+def backoff_delay(attempt: int, retry_after: Optional[float] = None) -> float:
+    """第 attempt 次重试（从 0 开始）前的等待秒数：[0, min(上限, 基数 × 2^attempt)] 内均匀随机"""
+    delay = random.uniform(0, min(UPSTREAM_BACKOFF_MAX, UPSTREAM_BACKOFF_BASE * 2 ** attempt))
+    if retry_after:
+        delay = max(delay, retry_after)
+    return delay
+
+
+def _should_retry(name: str, attempt: int, exc: Exception) -> Optional[float]:
+    """需要重试时返回等待秒数，否则记录失败并返回 None"""
+    if attempt >= UPSTREAM_MAX_RETRIES or not is_retryable(exc):
+        metrics.incr(f"upstream_{_metric_name(name)}_failures")
+        return None
+    status = _status_of(exc)
+    metrics.incr(f"upstream_{_metric_name(name)}_retries")
+    if status == 429:
+        metrics.incr(f"upstream_{_metric_name(name)}_throttled")
+    return backoff_delay(attempt, getattr(exc, "retry_after", None))
+
+
+def _record_attempt(name: str, start: float, exc: Optional[Exception] = None):
+    """单次请求的耗时（不含限流等待），按上游与结果（ok / HTTP 状态码 / 异常类名）分开统计"""
+    if exc is None:
+        status = "ok"
+    else:
+        status = str(_status_of(exc) or type(exc).__name__)
+    metrics.histogram("upstream_request_seconds", time.perf_counter() - start, {"upstream": name, "status": status})
+
+
+def call_with_retry(name: str, fn: Callable[[], T], tokens: int = 0) -> T:
+    """
+    每次尝试前向 name 的限流器申请 1 个请求与 tokens 个 token，再同步调用 fn；可重试的错误按退避策略重试
+
+    整个调用（含限流等待与重试）记为一个 upstream span，fn 中可通过 tracing.record_usage 记录 token 用量
+    """
+    limiter = get_limiter(name)
+    attempt = 0
+    with upstream_span(name) as span:
+        while True:
+            limiter.acquire(tokens)
+            start = time.perf_counter()
+            span.set_attribute("upstream.attempts", attempt + 1)
+            try:
+                result = fn()
+            except Exception as e:
+                _record_attempt(name, start, e)
+                delay = _should_retry(name, attempt, e)
+                if delay is None:
+                    raise
+            else:
+                _record_attempt(name, start)
+                return result
+            time.sleep(delay)
+            attempt += 1
+
+
+async def acall_with_retry(name: str, fn: Callable[[], Awaitable[T]], tokens: int = 0) -> T:
+    """call_with_retry 的异步版本，fn 每次调用返回一个新的协程"""
+    limiter = get_limiter(name)
+    attempt = 0
+    with upstream_span(name) as span:
+        while True:
+            await limiter.aacquire(tokens)
+            start = time.perf_counter()
+            span.set_attribute("upstream.attempts", attempt + 1)
+            try:
+                result = await fn()
+            except Exception as e:
+                _record_attempt(name, start, e)
+                delay = _should_retry(name, attempt, e)
+                if delay is None:
+                    raise
+            else:
+                _record_attempt(name, start)
+                return result
+            await asyncio.sleep(delay)
+            attempt += 1
+
+
+def retry_after_of(headers) -> Optional[float]:
+    try:
+        return float(headers.get("Retry-After"))
+    except (TypeError, ValueError):
+        return None
+
+
+_http_session: Optional[requests.Session] = None
+_aio_sessions: Dict[Any, Any] = {}
+_session_lock = threading.Lock()
+
+
+def get_http_session() -> requests.Session:
+    """共享的 requests.Session，连接池大小为 UPSTREAM_POOL_SIZE"""
+    global _http_session
+    with _session_lock:
+        if _http_session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=4, pool_maxsize=UPSTREAM_POOL_SIZE)
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            _http_session = session
+        return _http_session
+
+
+def get_aio_session():
+    """当前事件循环共享的 aiohttp.ClientSession（aiohttp 会话绑定事件循环，每个循环一个）"""
+    import aiohttp
+
+    loop = asyncio.get_running_loop()
+    session = _aio_sessions.get(loop)
+    if session is None or session.closed:
+        # 顺带清理已关闭事件循环留下的会话
+        for stale in [key for key in _aio_sessions if key.is_closed()]:
+            del _aio_sessions[stale]
+        session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=UPSTREAM_POOL_SIZE, keepalive_timeout=30),
+            timeout=aiohttp.ClientTimeout(total=UPSTREAM_TIMEOUT),
+        )
+        _aio_sessions[loop] = session
+    return session
+
+
+async def close_upstream_sessions():
+    """关闭当前事件循环的 aiohttp 会话与共享的 requests.Session，在服务关闭时调用"""
+    global _http_session
+    session = _aio_sessions.pop(asyncio.get_running_loop(), None)
+    if session is not None and not session.closed:
+        await session.close()
+    with _session_lock:
+        if _http_session is not None:
+            _http_session.close()
+            _http_session = None
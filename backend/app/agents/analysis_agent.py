@@ -1,93 +1,386 @@
 """
 使用llm进一步完善用户上一餐的分析报告，将分析结果存入用户数据库
+
+视觉报告先被拆成逐道菜的条目，每道菜用 Send 并行分发到独立的 searching ↔ tools 子图，
+再由 reduce 节点合并检索结论交给 summarize；整体耗时约等于最慢的一道菜，而不是所有菜品之和。
+报告无法拆分时回退到整份报告一段对话的原有流程。
+
+每段 searching ↔ tools 循环（逐菜子图各自一段）受三项预算约束：检索轮数、工具调用总数、累计 prompt token 数。
+任一预算耗尽时不再执行模型发起的工具调用，带着已有结论进入 summarize，耗尽事件记入状态的 budget_exhausted 与指标。
+请求截止时间（deadline）按同样的方式处理：模型与工具调用按剩余时间限时，超时即视为 "deadline" 预算耗尽；
+汇总时已无时间时不再调用模型，用视觉克数与本地油盐估算生成部分报告（is_partial）。
 """
+import os
+from typing import Union
+
 from langchain_core.messages import SystemMessage, HumanMessage
-from langchain_tavily import TavilySearch
+from langchain_core.runnables import RunnableConfig, RunnableLambda
 from langgraph.graph import StateGraph, START, END
 from langgraph.prebuilt import ToolNode
-
-from app.agent_utils.agent_prompt import SEARCHING_NODE_PROMPT, SUMMARIZE_NODE_PROMPT
+from langgraph.types import Send
+
+from app.agent_utils import metrics
+from app.agent_utils import pagoda
+from app.agent_utils.deadline import (
+    DEADLINE_MIN_CALL_SECONDS, DEADLINE_RESERVE_SECONDS, DeadlineExceeded, remaining, sync_deadline, with_deadline,
+)
+from app.agent_utils.agent_prompt import (
+    SEARCHING_NODE_PROMPT, DISH_SEARCHING_NODE_PROMPT, SUMMARIZE_NODE_PROMPT, INGREDIENT_CLASSIFY_PROMPT,
+)
 from app.agent_utils.get_llm import get_llm
-from models.schemas import AnalysisState, NutritionReport
+from app.agent_utils.recipe_index import estimate_oil_salt, local_finding, standard_recipe_lookup
+from app.agent_utils.report_parser import parse_vision_report, format_dish_item
+from app.agent_utils.search_cache import CachedTavilySearch
+from app.agent_utils.tool_compaction import compact_tool_messages, estimate_tokens
+from models.schemas import AnalysisState, DishState, DishFinding, IngredientCategories, NutritionReport
+
+SEARCH_MAX_ITERATIONS = int(os.getenv("SEARCH_MAX_ITERATIONS", "4"))
+SEARCH_MAX_TOOL_CALLS = int(os.getenv("SEARCH_MAX_TOOL_CALLS", "10"))
+SEARCH_MAX_PROMPT_TOKENS = int(os.getenv("SEARCH_MAX_PROMPT_TOKENS", "24000"))
 
 
 class AnalysisAgent:
     def __init__(self):
 
-        self.search_tool = TavilySearch(max_results=3)
+        # 同一道菜的标准油盐用量只搜一次，之后命中缓存不再发起网络请求
+        self.search_tool = CachedTavilySearch(max_results=3)
+
+        # 本地标准菜谱参考表优先，网络搜索只用于参考表未收录的长尾菜品
+        self.tools = [standard_recipe_lookup, self.search_tool]
 
-        # 告诉烹饪智能体有这样一个搜索工具
+        # 告诉烹饪智能体有这些工具
         self.searching_llm = get_llm().bind_tools(
-            [self.search_tool],
+            self.tools,
             parallel_tool_calls=True
         )
 
-        # 标准化输出智能体只负责标准化输出，不调用搜索工具
+        # 标准化输出智能体只负责标准化输出，不调用搜索工具；
+        # 宝塔聚合由本地引擎完成，只有解析不出油盐时才回退到它
         self.summarize_llm = get_llm().with_structured_output(NutritionReport)
 
+        # 词典外食材的分类兜底
+        self.classify_llm = get_llm().with_structured_output(IngredientCategories)
+
         self.searching_node_prompt = SEARCHING_NODE_PROMPT
+        self.dish_searching_node_prompt = DISH_SEARCHING_NODE_PROMPT
         self.summarize_node_prompt = SUMMARIZE_NODE_PROMPT
 
         # 工具节点，用于搜索操作
-        self.tool_node = ToolNode([self.search_tool])
+        self.tool_node = ToolNode(self.tools)
 
-        # 初始化工作流图
+        # 初始化工作流图：逐菜子图先于主图构建
+        self.dish_workflow = self._build_dish_graph()
         self.workflow = self._build_graph()
 
 
+    def _searching_messages(self, state: AnalysisState) -> list:
+        """组装搜索节点的对话：首轮加系统提示，之后直接沿用带工具结果的历史消息"""
+        if state.messages:
+            return state.messages
+
+        vision_data = state.vision_report
+        input_prompt = f"""视觉报告如下：{vision_data}，开始分析油盐含量。"""
+        return [
+            SystemMessage(content=self.searching_node_prompt),
+            HumanMessage(content=input_prompt)
+        ]
+
+    def _dish_searching_messages(self, state: DishState) -> list:
+        """逐菜子图的对话：只包含这一道菜的视觉条目"""
+        if state.messages:
+            return state.messages
+
+        input_prompt = f"""视觉报告中的单个条目如下：\n{format_dish_item(state.item)}\n开始分析这道菜的油盐含量。"""
+        return [
+            SystemMessage(content=self.dish_searching_node_prompt),
+            HumanMessage(content=input_prompt)
+        ]
+
+    def _summarize_messages(self, state: AnalysisState) -> list:
+        dish_knowledge = state.extracted_info
+
+        input_prompt = f"""请根据以下事实进行 L1-L5 映射计算：\n{dish_knowledge}"""
+        return [
+            SystemMessage(content=self.summarize_node_prompt),
+            HumanMessage(content=input_prompt)
+        ]
+
     def _searching_node(self, state: AnalysisState) -> dict:
         """
         搜索节点，根据视觉分析报告内容调用搜索工具，获取菜品的油盐用量
         """
+        if state.budget_exhausted:
+            return exhausted_update(state, None, state.vision_report)
+        messages = self._searching_messages(state)
+        try:
+            with sync_deadline(state.deadline, DEADLINE_RESERVE_SECONDS):
+                response = self.searching_llm.invoke(messages)
+        except DeadlineExceeded:
+            return exhausted_update(state, "deadline", state.vision_report)
+        return charge_budget(state, messages, response, fallback_info=state.vision_report)
+
+    async def _asearching_node(self, state: AnalysisState) -> dict:
+        """搜索节点的异步实现"""
+        if state.budget_exhausted:
+            return exhausted_update(state, None, state.vision_report)
+        messages = self._searching_messages(state)
+        try:
+            response = await with_deadline(
+                self.searching_llm.ainvoke(messages), state.deadline, DEADLINE_RESERVE_SECONDS
+            )
+        except DeadlineExceeded:
+            return exhausted_update(state, "deadline", state.vision_report)
+        return charge_budget(state, messages, response, fallback_info=state.vision_report)
+
+    @staticmethod
+    def _compacted(state: Union[AnalysisState, DishState], output: dict) -> dict:
+        """压缩工具返回的网页正文后再写入对话历史"""
+        messages, saved = compact_tool_messages(output["messages"])
+        return {"messages": messages, "compacted_tokens": state.compacted_tokens + saved}
+
+    def _tools_node(self, state: Union[AnalysisState, DishState], config: RunnableConfig) -> dict:
+        """执行模型发起的工具调用；剩余时间不足时放弃，由 searching 带着已有结论结束循环"""
+        try:
+            with sync_deadline(state.deadline, DEADLINE_RESERVE_SECONDS):
+                output = self.tool_node.invoke(state, config)
+        except DeadlineExceeded:
+            return exhausted_update(state, "deadline")
+        return self._compacted(state, output)
+
+    async def _atools_node(self, state: Union[AnalysisState, DishState], config: RunnableConfig) -> dict:
+        try:
+            output = await with_deadline(
+                self.tool_node.ainvoke(state, config), state.deadline, DEADLINE_RESERVE_SECONDS
+            )
+        except DeadlineExceeded:
+            return exhausted_update(state, "deadline")
+        return self._compacted(state, output)
+
+    def _split_node(self, state: AnalysisState) -> dict:
+        """把视觉报告拆成逐道菜的结构化条目"""
+        return {"dish_items": parse_vision_report(state.vision_report)}
+
+    def _dispatch_dishes(self, state: AnalysisState):
+        """每道菜分发一个逐菜子图；拆分失败时回退到整份报告的 searching 流程"""
+        if not state.dish_items:
+            return "searching"
+        return [
+            Send("dish", DishState(username=state.username, item=item, deadline=state.deadline))
+            for item in state.dish_items
+        ]
 
-        vision_data = state.vision_report
-        input_prompt = f"""视觉报告如下：{vision_data}，开始分析油盐含量。"""
+    def _dish_searching_node(self, state: DishState) -> dict:
+        fallback_info = format_dish_item(state.item)
+        if state.budget_exhausted:
+            return exhausted_update(state, None, fallback_info)
+        messages = self._dish_searching_messages(state)
+        try:
+            with sync_deadline(state.deadline, DEADLINE_RESERVE_SECONDS):
+                response = self.searching_llm.invoke(messages)
+        except DeadlineExceeded:
+            return exhausted_update(state, "deadline", fallback_info)
+        return charge_budget(state, messages, response, fallback_info=fallback_info)
+
+    async def _adish_searching_node(self, state: DishState) -> dict:
+        fallback_info = format_dish_item(state.item)
+        if state.budget_exhausted:
+            return exhausted_update(state, None, fallback_info)
+        messages = self._dish_searching_messages(state)
+        try:
+            response = await with_deadline(
+                self.searching_llm.ainvoke(messages), state.deadline, DEADLINE_RESERVE_SECONDS
+            )
+        except DeadlineExceeded:
+            return exhausted_update(state, "deadline", fallback_info)
+        return charge_budget(state, messages, response, fallback_info=fallback_info)
+
+    @staticmethod
+    def _dish_result(item, result: dict) -> dict:
+        """子图结果写回主图：检索结论与带菜名的预算耗尽事件"""
+        update = {"dish_findings": [DishFinding(item=item, extracted_info=result["extracted_info"])]}
+        if result.get("budget_exhausted"):
+            update["budget_exhausted"] = [f"{item.name}: {reason}" for reason in result["budget_exhausted"]]
+        return update
+
+    def _dish_node(self, state: DishState, config: RunnableConfig) -> dict:
+        """
+        执行单道菜的子图，只把最终结论写回主图，对话历史留在子图内；
+        标准菜谱参考表高置信命中时直接换算，不调用模型
+        """
+        extracted_info = local_finding(state.item)
+        if extracted_info is not None:
+            return {"dish_findings": [DishFinding(item=state.item, extracted_info=extracted_info)]}
+        return self._dish_result(state.item, self.dish_workflow.invoke(state, config=config))
+
+    async def _adish_node(self, state: DishState, config: RunnableConfig) -> dict:
+        extracted_info = local_finding(state.item)
+        if extracted_info is not None:
+            return {"dish_findings": [DishFinding(item=state.item, extracted_info=extracted_info)]}
+        return self._dish_result(state.item, await self.dish_workflow.ainvoke(state, config=config))
+
+    @staticmethod
+    def _reduce_node(state: AnalysisState) -> dict:
+        """按视觉报告中的顺序合并各道菜的检索结论，作为 summarize 的输入"""
+        findings = sorted(state.dish_findings, key=lambda finding: finding.item.index)
+        blocks = [
+            f"### {finding.item.category} {finding.item.index + 1}: {finding.item.name}\n"
+            f"视觉条目：\n{format_dish_item(finding.item)}\n"
+            f"检索结论：\n{finding.extracted_info}"
+            for finding in findings
+        ]
+        return {"extracted_info": "\n\n".join(blocks)}
 
-        if not state.messages:
-            # 第一次调用烹饪节点，添加系统提示
-            messages = [
-                SystemMessage(content=self.searching_node_prompt),
-                HumanMessage(content=input_prompt)
-            ]
+    @staticmethod
+    def _pagoda_dishes(state: AnalysisState):
+        """
+        提取确定性聚合所需的各道菜事实；任何一道菜解析不出油盐时返回 None，交给 summarize_llm
+        """
+        if not pagoda.PAGODA_ENGINE:
+            return None
+        if state.dish_findings:
+            dishes = pagoda.facts_from_findings(state.dish_findings)
         else:
-            # 后续调用，直接添加工具调用结果
-            messages = state.messages
+            dishes = pagoda.facts_from_text(state.extracted_info)
+        if not dishes or any(dish.oil is None or dish.salt is None for dish in dishes):
+            metrics.incr("pagoda_llm_fallback")
+            return None
+        return dishes
+
+    @staticmethod
+    def _classify_messages(names: list) -> list:
+        return [
+            SystemMessage(content=INGREDIENT_CLASSIFY_PROMPT),
+            HumanMessage(content="请分类以下食材：\n" + "\n".join(names))
+        ]
 
-        response = self.searching_llm.invoke(messages)
+    @staticmethod
+    def _learn(result: IngredientCategories):
+        pagoda.learn_categories({item.name: item.category for item in result.items})
 
-        return {
-            "messages": [response],
-            "extracted_info": response.content
-        }
+    @staticmethod
+    def _out_of_time(state: AnalysisState) -> bool:
+        """检索阶段已因截止时间放弃，或剩余时间已不够再调用一次模型"""
+        if any(reason.endswith("deadline") for reason in state.budget_exhausted):
+            return True
+        left = remaining(state.deadline)
+        return left is not None and left < DEADLINE_MIN_CALL_SECONDS
 
+    @staticmethod
+    def _partial_response(state: AnalysisState) -> dict:
+        """
+        超时兜底：食材克数取视觉条目，油盐优先取已有的检索结论，其余按参考表或默认用量估算，结果标记 is_partial
+        """
+        findings = {finding.item.index: finding for finding in state.dish_findings}
+        items = state.dish_items or parse_vision_report(state.vision_report)
+        dishes = []
+        for item in items:
+            finding = findings.get(item.index)
+            oil, salt = pagoda.parse_oil_salt(finding.extracted_info) if finding else (None, None)
+            if oil is None or salt is None:
+                oil, salt = estimate_oil_salt(item)
+            dishes.append(pagoda.DishFacts(item.name, item.ingredients, oil, salt))
+        metrics.incr("partial_reports")
+        return {"final_response": pagoda.aggregate(dishes), "is_partial": True}
 
     def _summarize_node(self, state: AnalysisState) -> dict:
         """
         将补全的报告结果映射到标准菜单数据，直接输出结构化 NutritionReport
-        """
 
-        dish_knowledge = state.extracted_info
+        优先用本地宝塔聚合引擎计算，词典外的食材先让 LLM 分类；解析不出油盐时整体交给 summarize_llm。
+        没有剩余时间时直接给出估算的部分报告。
+        """
+        if self._out_of_time(state):
+            return self._partial_response(state)
+
+        dishes = self._pagoda_dishes(state)
+        if dishes is not None:
+            unknown = pagoda.unknown_ingredients(dishes)
+            if unknown:
+                metrics.incr("pagoda_classify_calls")
+                try:
+                    with sync_deadline(state.deadline):
+                        self._learn(self.classify_llm.invoke(self._classify_messages(unknown)))
+                except Exception as e:
+                    # 分类失败（包括超时）时这些食材按 other 处理，只列入 main_ingredients
+                    print(f"[食材分类失败] {unknown}: {e}")
+            metrics.incr("pagoda_engine_reports")
+            return {"final_response": pagoda.aggregate(dishes)}
+
+        try:
+            with sync_deadline(state.deadline):
+                report: NutritionReport = self.summarize_llm.invoke(self._summarize_messages(state))
+        except DeadlineExceeded:
+            return self._partial_response(state)
 
-        input_prompt = f"""请根据以下事实进行 L1-L5 映射计算：\n{dish_knowledge}"""
-        messages = [
-            SystemMessage(content=self.summarize_node_prompt),
-            HumanMessage(content=input_prompt)
-        ]
+        return {"final_response": report}
 
-        report: NutritionReport = self.summarize_llm.invoke(messages)
+    async def _asummarize_node(self, state: AnalysisState) -> dict:
+        """汇总节点的异步实现"""
+        if self._out_of_time(state):
+            return self._partial_response(state)
+
+        dishes = self._pagoda_dishes(state)
+        if dishes is not None:
+            unknown = pagoda.unknown_ingredients(dishes)
+            if unknown:
+                metrics.incr("pagoda_classify_calls")
+                try:
+                    self._learn(await with_deadline(
+                        self.classify_llm.ainvoke(self._classify_messages(unknown)), state.deadline
+                    ))
+                except Exception as e:
+                    print(f"[食材分类失败] {unknown}: {e}")
+            metrics.incr("pagoda_engine_reports")
+            return {"final_response": pagoda.aggregate(dishes)}
+
+        try:
+            report: NutritionReport = await with_deadline(
+                self.summarize_llm.ainvoke(self._summarize_messages(state)), state.deadline
+            )
+        except DeadlineExceeded:
+            return self._partial_response(state)
 
         return {"final_response": report}
 
 
-    def _build_graph(self):
-
-        builder = StateGraph(AnalysisState)
-        builder.add_node("searching", self._searching_node)
-        builder.add_node("tools", self.tool_node)
-        builder.add_node("summarize", self._summarize_node)
+    def _build_dish_graph(self):
+        """逐菜子图：单道菜的 searching ↔ tools 循环，不再调用工具时结束"""
+        builder = StateGraph(DishState)
+        builder.add_node("searching", RunnableLambda(self._dish_searching_node, afunc=self._adish_searching_node))
+        builder.add_node("tools", RunnableLambda(self._tools_node, afunc=self._atools_node))
 
         builder.add_edge(START, "searching")
+        builder.add_conditional_edges(
+            "searching",
+            should_continue,
+            {
+                "tools": "tools",
+                "summarize": END
+            }
+        )
+        builder.add_edge("tools", "searching")
+
+        return builder.compile()
 
+    def _build_graph(self):
+
+        builder = StateGraph(AnalysisState)
+        # 同时注册同步与异步实现：invoke 走前者，ainvoke 走后者
+        builder.add_node("split", self._split_node)
+        builder.add_node("dish", RunnableLambda(self._dish_node, afunc=self._adish_node))
+        builder.add_node("reduce", self._reduce_node)
+        builder.add_node("searching", RunnableLambda(self._searching_node, afunc=self._asearching_node))
+        builder.add_node("tools", RunnableLambda(self._tools_node, afunc=self._atools_node))
+        builder.add_node("summarize", RunnableLambda(self._summarize_node, afunc=self._asummarize_node))
+
+        builder.add_edge(START, "split")
+
+        # map：每道菜一个并行的子图；reduce 等所有子图完成后合并
+        builder.add_conditional_edges("split", self._dispatch_dishes, ["dish", "searching"])
+        builder.add_edge("dish", "reduce")
+        builder.add_edge("reduce", "summarize")
+
+        # 回退流程：整份报告一段对话
         builder.add_conditional_edges(
             "searching",
             should_continue,
@@ -104,18 +397,101 @@ class AnalysisAgent:
 
         return builder.compile()
 
-    def analyze(self, username: str, vision_report: str):
-        """执行入口"""
+    def analyze(self, username: str, vision_report: str, deadline: float = None):
+        """执行入口；deadline 为请求截止时间戳，不传时不限时"""
         initial_state = AnalysisState(
             username=username,
             vision_report=vision_report,
+            deadline=deadline,
         )
         return self.workflow.invoke(initial_state)
 
+    async def aanalyze(self, username: str, vision_report: str, config: RunnableConfig = None,
+                       deadline: float = None):
+        """异步执行入口；作为主图节点调用时传入 config，使子图进度可被流式输出"""
+        initial_state = AnalysisState(
+            username=username,
+            vision_report=vision_report,
+            deadline=deadline,
+        )
+        return await self.workflow.ainvoke(initial_state, config=config)
+
+
+def _prompt_tokens(response, messages: list) -> int:
+    """本次调用的 prompt token 数；ChatTongyi 记录在 response_metadata["token_usage"] 中"""
+    usage = response.response_metadata.get("token_usage") or {}
+    tokens = usage.get("input_tokens") or usage.get("prompt_tokens")
+    if tokens is None and getattr(response, "usage_metadata", None):
+        tokens = response.usage_metadata.get("input_tokens")
+    if tokens is None:
+        # 拿不到用量时按字符数粗略估算
+        tokens = sum(estimate_tokens(str(message.content)) for message in messages)
+    return int(tokens)
+
+
+def _exhausted_budget(retry_count: int, tool_calls: int, prompt_tokens: int):
+    """返回已耗尽的预算名，都未耗尽时返回 None"""
+    if retry_count >= SEARCH_MAX_ITERATIONS:
+        return "iterations"
+    if tool_calls > SEARCH_MAX_TOOL_CALLS:
+        return "tool_calls"
+    if prompt_tokens >= SEARCH_MAX_PROMPT_TOKENS:
+        return "prompt_tokens"
+    return None
+
+
+def charge_budget(state: Union[AnalysisState, DishState], messages: list, response, fallback_info: str) -> dict:
+    """
+    累加一轮检索的预算消耗，生成 searching 节点的状态更新
+
+    模型还想调用工具但预算已耗尽时，在更新中记录 budget_exhausted，由 should_continue 转入 summarize；
+    这一轮没有文字结论时沿用上一轮的结论，都没有则用 fallback_info（视觉条目）兜底。
+    """
+    update = {
+        # 首轮把系统提示与视觉条目一并写入历史，之后各轮沿用同一段对话
+        "messages": ([] if state.messages else messages) + [response],
+        "extracted_info": response.content,
+        "retry_count": state.retry_count + 1,
+        "tool_calls": state.tool_calls + len(response.tool_calls or []),
+        "prompt_tokens": state.prompt_tokens + _prompt_tokens(response, messages),
+        # 本轮发送的历史中压缩掉的部分
+        "prompt_tokens_saved": state.prompt_tokens_saved + state.compacted_tokens,
+    }
+    if response.tool_calls:
+        exhausted = _exhausted_budget(update["retry_count"], update["tool_calls"], update["prompt_tokens"])
+        if exhausted is None:
+            return update
+        update.update(exhausted_update(state, exhausted))
+        update["extracted_info"] = response.content or state.extracted_info or fallback_info
+
+    metrics.observe("search_loop_iterations", update["retry_count"], buckets=metrics.COUNT_BUCKETS)
+    metrics.observe("search_loop_prompt_tokens", update["prompt_tokens"])
+    metrics.observe("search_loop_prompt_tokens_saved", update["prompt_tokens_saved"])
+    return update
+
+
+def exhausted_update(state: Union[AnalysisState, DishState], reason: str = None, fallback_info: str = None) -> dict:
+    """
+    预算耗尽时的状态更新：记录耗尽原因（reason 为 None 表示此前已记录），结论沿用已有的或 fallback_info
+    """
+    update = {}
+    if reason is not None:
+        metrics.incr("search_budget_exhausted")
+        metrics.incr(f"search_budget_exhausted_{reason}")
+        update["budget_exhausted"] = [reason]
+    if fallback_info is not None:
+        update["extracted_info"] = state.extracted_info or fallback_info
+        metrics.observe("search_loop_iterations", state.retry_count, buckets=metrics.COUNT_BUCKETS)
+        metrics.observe("search_loop_prompt_tokens", state.prompt_tokens)
+        metrics.observe("search_loop_prompt_tokens_saved", state.prompt_tokens_saved)
+    return update
+
 
 # 定义条件边的逻辑函数
-def should_continue(state: AnalysisState) -> str:
-    """判断模型是否发起了工具调用"""
+def should_continue(state: Union[AnalysisState, DishState]) -> str:
+    """判断模型是否发起了工具调用；预算耗尽时直接进入汇总"""
+    if state.budget_exhausted:
+        return "summarize"
     last_message = state.messages[-1]
     if last_message.tool_calls:
         return "tools"
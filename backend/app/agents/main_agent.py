@@ -1,21 +1,48 @@
+import asyncio
+import time
+
+from langchain_core.runnables import RunnableConfig, RunnableLambda
 from langgraph.graph import StateGraph, START, END
-from langgraph.checkpoint.memory import MemorySaver
 
 from app.agents.vision_agent import VisionAgent
 from app.agents.analysis_agent import AnalysisAgent
+from app.agent_utils import metrics
+from app.agent_utils.canteen_fast_path import get_canteen_matcher
+from app.agent_utils.deadline import new_deadline
+from app.agent_utils.graph_metrics import graph_metrics
+from app.agent_utils.graph_tracing import graph_tracing
+from app.agent_utils.process_pic import ImageInput
+from app.agent_utils.report_parser import parse_vision_report
+from app.agent_utils.image_preprocess import read_image
+from app.agent_utils.result_cache import get_result_cache, request_scope
+from app.agent_utils.checkpointer import BoundedMemorySaver
+from app.agent_utils.tracing import TRACING
 from models.schemas import VisionAgentState
 
+# 每次运行都挂上的回调：耗时直方图与链路追踪
+GRAPH_CALLBACKS = [graph_metrics, graph_tracing] if TRACING else [graph_metrics]
+
 
 class VisionAnalysisAgent:
     def __init__(self):
         self.vision_agent = VisionAgent()
         self.analysis_agent = AnalysisAgent()
 
-        self.checkpointer = MemorySaver()
-        self.graph = self._init_graph()
+        # 按图片内容寻址的结果缓存，RESULT_CACHE=0 时为 None
+        self.result_cache = get_result_cache()
 
-    def _vision_node(self, state: VisionAgentState) -> dict:
-        vision_result = self.vision_agent.analyze_image(state.image_path)
+        # 食堂快速通道，未开启或没有食堂库时为 None，图中也不会出现对应节点
+        self.canteen_matcher = get_canteen_matcher()
+
+        # 传入 thread_id 时使用带有界 checkpointer 的图（可回溯对话状态）；
+        # 不传时走无 checkpoint 的快速路径，单次分析的中间状态不在内存中保留
+        self.checkpointer = BoundedMemorySaver()
+        builder = self._init_graph()
+        self.graph = builder.compile(checkpointer=self.checkpointer)
+        self.stateless_graph = builder.compile()
+
+    @staticmethod
+    def _vision_update(vision_result) -> dict:
         result = {"vision_report": vision_result}
 
         if not vision_result.is_valid:
@@ -26,43 +53,247 @@ class VisionAnalysisAgent:
 
         return result
 
+    @staticmethod
+    def _image_source(state: VisionAgentState):
+        """优先使用内存中的图片字节，仅在未提供时回退到磁盘路径"""
+        if state.image_bytes is not None:
+            return state.image_bytes
+        return state.image_path
+
+    def _vision_node(self, state: VisionAgentState) -> dict:
+        return self._vision_update(
+            self.vision_agent.analyze_image(self._image_source(state), state.image_mime, state.deadline)
+        )
+
+    async def _avision_node(self, state: VisionAgentState) -> dict:
+        return self._vision_update(
+            await self.vision_agent.aanalyze_image(self._image_source(state), state.image_mime, state.deadline)
+        )
+
+    def _analysis_node(self, state: VisionAgentState) -> dict:
+        start = time.perf_counter()
+        analysis_state = self.analysis_agent.analyze(state.username, state.vision_report.report, state.deadline)
+        metrics.observe("analysis_seconds", time.perf_counter() - start)
+        return self._analysis_update(analysis_state)
+
+    async def _aanalysis_node(self, state: VisionAgentState, config: RunnableConfig) -> dict:
+        start = time.perf_counter()
+        # 透传 config，子图的节点更新才能出现在主图的 astream(subgraphs=True) 中
+        analysis_state = await self.analysis_agent.aanalyze(
+            state.username, state.vision_report.report, config=config, deadline=state.deadline
+        )
+        metrics.observe("analysis_seconds", time.perf_counter() - start)
+        return self._analysis_update(analysis_state)
+
+    @staticmethod
+    def _analysis_update(analysis_state: dict) -> dict:
+        update = {"analysis_results": analysis_state["final_response"]}
+        if analysis_state.get("is_partial"):
+            update["is_partial"] = True
+        return update
+
+    def _canteen_node(self, state: VisionAgentState) -> dict:
+        """
+        食堂快速通道：识别出的菜品都能在食堂库中高置信匹配时直接产出报告，否则交给分析子图
+        """
+        start = time.perf_counter()
+        report = self.canteen_matcher.match(
+            parse_vision_report(state.vision_report.report), state.canteen_name, state.meal_type
+        )
+        elapsed = time.perf_counter() - start
+        metrics.observe("canteen_fast_path_seconds", elapsed)
+        if report is None:
+            metrics.incr("canteen_fast_path_misses")
+            return {}
+
+        metrics.incr("canteen_fast_path_hits")
+        # 节省的耗时按分析子图的平均耗时估算（尚无样本时不计）
+        metrics.incr("canteen_fast_path_saved_seconds", max(0.0, metrics.average("analysis_seconds") - elapsed))
+        return {"analysis_results": report, "fast_path": True}
+
+    async def _acanteen_node(self, state: VisionAgentState) -> dict:
+        # 食堂库定期从 SQLite 重新加载，放到线程中执行
+        return await asyncio.to_thread(self._canteen_node, state)
+
     def _init_graph(self):
         builder = StateGraph(VisionAgentState)
 
-        builder.add_node("vision", self._vision_node)
+        builder.add_node("vision", RunnableLambda(self._vision_node, afunc=self._avision_node))
+
+        after_vision = "canteen" if self.canteen_matcher is not None else "analysis"
 
         def is_valid_pic(state: VisionAgentState):
             if state.vision_report.is_valid:
-                return "analysis"
+                return after_vision
             return END
 
-        builder.add_node("analysis", lambda state: {
-            "analysis_results": self.analysis_agent.analyze(
-                state.username, state.vision_report.report
-            )["final_response"]
-        })
+        def canteen_matched(state: VisionAgentState):
+            if state.fast_path:
+                return END
+            return "analysis"
+
+        builder.add_node("analysis", RunnableLambda(self._analysis_node, afunc=self._aanalysis_node))
 
         builder.add_edge(START, "vision")
         builder.add_conditional_edges(
             "vision",
             is_valid_pic,
             {
-                "analysis": "analysis",
+                after_vision: after_vision,
                 "__end__": END
             }
         )
+
+        if self.canteen_matcher is not None:
+            builder.add_node("canteen", RunnableLambda(self._canteen_node, afunc=self._acanteen_node))
+            builder.add_conditional_edges(
+                "canteen",
+                canteen_matched,
+                {
+                    "analysis": "analysis",
+                    "__end__": END
+                }
+            )
+
         builder.add_edge("analysis", END)
 
-        return builder.compile(checkpointer=self.checkpointer)
+        return builder
 
-    def run(self, username: str, image_path: str = None, thread_id: str = None):
-        """对外统一暴露的封装接口，返回完整状态（包含错误信息）"""
-        config = {"configurable": {"thread_id": thread_id}}
+    def run(self, username: str, image_path: str = None, thread_id: str = None,
+            image_bytes: ImageInput = None, image_mime: str = None,
+            canteen_name: str = None, meal_type: str = None, deadline: float = None):
+        """
+        对外统一暴露的封装接口，返回完整状态（包含错误信息）
+
+        图片可以是磁盘路径 image_path，也可以是内存字节 image_bytes（配合上传时校验过的 image_mime）；
+        canteen_name / meal_type 可选，用于限定食堂快速通道的匹配范围；
+        deadline 为请求截止时间戳，不传时从现在起按 REQUEST_DEADLINE_SECONDS 计算
+        """
+        fp = None
+        if self.result_cache is not None:
+            data = image_bytes if image_bytes is not None else read_image(image_path)
+            fp = self.result_cache.fingerprint(data, request_scope(canteen_name, meal_type))
+            cached = self.result_cache.get(fp)
+            if cached is not None:
+                return self._cached_state(username, cached)
+
+        graph, config = self._select_graph(thread_id)
+        initial_input = VisionAgentState(
+            username=username,
+            image_path=image_path or "",
+            image_bytes=image_bytes,
+            image_mime=image_mime,
+            canteen_name=canteen_name,
+            meal_type=meal_type,
+            deadline=deadline or new_deadline(),
+        )
+        full_state = graph.invoke(initial_input, config=config)
+        self._remember(fp, full_state)
+        return full_state
+
+    async def arun(self, username: str, image_path: str = None, thread_id: str = None,
+                   image_bytes: ImageInput = None, image_mime: str = None,
+                   canteen_name: str = None, meal_type: str = None, deadline: float = None):
+        """run 的异步版本，整条链路（视觉、搜索、汇总）均不阻塞事件循环"""
+        fp, cached = await self._alookup(
+            username, image_path, image_bytes, request_scope(canteen_name, meal_type)
+        )
+        if cached is not None:
+            return cached
+
+        graph, config = self._select_graph(thread_id)
+        initial_input = VisionAgentState(
+            username=username,
+            image_path=image_path or "",
+            image_bytes=image_bytes,
+            image_mime=image_mime,
+            canteen_name=canteen_name,
+            meal_type=meal_type,
+            deadline=deadline or new_deadline(),
+        )
+        full_state = await graph.ainvoke(initial_input, config=config)
+        self._remember(fp, full_state)
+        return full_state
+
+    async def astream(self, username: str, image_path: str = None, thread_id: str = None,
+                      image_bytes: ImageInput = None, image_mime: str = None,
+                      canteen_name: str = None, meal_type: str = None, deadline: float = None):
+        """
+        流式执行：每个节点（包括分析子图内的 searching / tools / summarize）完成时产出 (节点名, 状态更新)，
+        最后一条固定为 ("result", 完整状态)，与 arun 的返回值同形
+        """
+        fp, cached = await self._alookup(
+            username, image_path, image_bytes, request_scope(canteen_name, meal_type)
+        )
+        if cached is not None:
+            yield "result", cached
+            return
+
+        graph, config = self._select_graph(thread_id)
         initial_input = VisionAgentState(
             username=username,
-            image_path=image_path,
+            image_path=image_path or "",
+            image_bytes=image_bytes,
+            image_mime=image_mime,
+            canteen_name=canteen_name,
+            meal_type=meal_type,
+            deadline=deadline or new_deadline(),
         )
-        return self.graph.invoke(initial_input, config=config)
+        full_state = {"username": username, "error_reason": None, "analysis_results": None}
+        async for namespace, chunk in graph.astream(
+            initial_input, config=config, stream_mode="updates", subgraphs=True
+        ):
+            for node, update in chunk.items():
+                # 只有主图的更新才并入最终状态，子图的更新仅用于推送进度
+                if not namespace and update:
+                    full_state.update(update)
+                yield node, update
+
+        self._remember(fp, full_state)
+        yield "result", full_state
+
+    def _select_graph(self, thread_id: str = None):
+        """
+        有 thread_id 时使用带 checkpointer 的图，否则使用无状态的快速图
+
+        两种情况都挂上 GRAPH_CALLBACKS，主图、子图的每个节点以及其中的模型 / 工具调用都会被计时并记为 span
+        """
+        if thread_id is None:
+            return self.stateless_graph, {"callbacks": GRAPH_CALLBACKS}
+        return self.graph, {"configurable": {"thread_id": thread_id}, "callbacks": GRAPH_CALLBACKS}
+
+    async def _alookup(self, username: str, image_path: str, image_bytes: ImageInput, scope: str = ""):
+        """查询结果缓存，返回 (图片指纹, 命中时的状态字典)；scope 为食堂 / 餐次范围，不同范围的结果互不复用"""
+        if self.result_cache is None:
+            return None, None
+
+        if image_bytes is not None:
+            data = image_bytes
+        else:
+            data = await asyncio.to_thread(read_image, image_path)
+        fp = await self.result_cache.afingerprint(data, scope)
+        cached = self.result_cache.get(fp)
+        if cached is not None:
+            return fp, self._cached_state(username, cached)
+        return fp, None
+
+    @staticmethod
+    def _cached_state(username: str, cached) -> dict:
+        """缓存命中时构造与 graph 输出同形的状态字典，保留报告是否来自食堂快速通道"""
+        return {
+            "username": username,
+            "error_reason": None,
+            "analysis_results": cached.report,
+            "fast_path": cached.fast_path,
+            "cache_hit": True,
+        }
+
+    def _remember(self, fp, full_state: dict):
+        """只缓存成功生成的营养报告，无效图片、失败结果与超时估算的部分报告不入缓存"""
+        report = full_state.get("analysis_results")
+        if (fp is not None and report is not None
+                and not full_state.get("error_reason") and not full_state.get("is_partial")):
+            self.result_cache.put(fp, report, bool(full_state.get("fast_path")))
 
 if __name__ == "__main__":
     agent = VisionAnalysisAgent()
@@ -1,6 +1,13 @@
+import asyncio
+from typing import Optional
+
 from app.agent_utils.get_llm import get_vision_llm
-from app.agent_utils.process_pic import process_pic
+from app.agent_utils.process_pic import process_pic, ImageInput
+from app.agent_utils.image_preprocess import preprocess_image, apreprocess_image
+from app.agent_utils.image_quality import check_image_quality, acheck_image_quality
 from app.agent_utils.agent_prompt import VISION_NODE_PROMPT
+from app.agent_utils.deadline import DEADLINE_RESERVE_SECONDS, sync_deadline, with_deadline
+from app.agent_utils.tracing import span
 
 from models.schemas import VisionResponse
 
@@ -12,12 +19,9 @@ class VisionAgent:
         # 1. 获取vl模型
         self.model = get_vision_llm().with_structured_output(VisionResponse)
     
-    def analyze_image(self, image_path: str) -> VisionResponse:
-        """
-        将输入图片转换为base64编码，然后调用vision_llm分析图片中的食物并返回营养信息
-        """
-        img_base64 = process_pic(image_path)
-        message = [
+    @staticmethod
+    def _build_message(img_base64: str) -> list:
+        return [
             {
                 "role": "user",
                 "content": [
@@ -29,10 +33,49 @@ class VisionAgent:
                 ]
             }
         ]
-        # 3. 调用 invoke 后，从结果的 structured_response 键中获取对象   
-        result = self.model.invoke(message)
-                
-        return result
+
+    @staticmethod
+    def _rejected(reason: str) -> VisionResponse:
+        return VisionResponse(is_valid=False, reason=reason, report="")
+
+    def analyze_image(self, image: ImageInput, mime_type: Optional[str] = None,
+                      deadline: Optional[float] = None) -> VisionResponse:
+        """
+        将输入图片（路径或内存字节）归一化并转换为base64编码，然后调用vision_llm分析图片中的食物并返回营养信息
+
+        deadline 为请求截止时间戳，剩余时间不足时抛出 DeadlineExceeded（为后续分析预留 DEADLINE_RESERVE_SECONDS）
+        """
+        with span("image.preprocess"):
+            image, mime_type = preprocess_image(image, mime_type)
+        # 本地预检能确定图片不可用时，不再调用视觉模型
+        with span("image.quality") as current:
+            reason = check_image_quality(image)
+            current.set_attribute("image.rejected", reason is not None)
+        if reason is not None:
+            return self._rejected(reason)
+        with span("image.encode"):
+            img_base64 = process_pic(image, mime_type)
+        # 调用 invoke 后，直接得到结构化的 VisionResponse 对象
+        with sync_deadline(deadline, DEADLINE_RESERVE_SECONDS):
+            return self.model.invoke(self._build_message(img_base64))
+
+    async def aanalyze_image(self, image: ImageInput, mime_type: Optional[str] = None,
+                             deadline: Optional[float] = None) -> VisionResponse:
+        """
+        analyze_image 的异步版本：归一化在进程池、编码在线程池，模型调用走 ainvoke，不阻塞事件循环
+        """
+        with span("image.preprocess"):
+            image, mime_type = await apreprocess_image(image, mime_type)
+        with span("image.quality") as current:
+            reason = await acheck_image_quality(image)
+            current.set_attribute("image.rejected", reason is not None)
+        if reason is not None:
+            return self._rejected(reason)
+        with span("image.encode"):
+            img_base64 = await asyncio.to_thread(process_pic, image, mime_type)
+        return await with_deadline(
+            self.model.ainvoke(self._build_message(img_base64)), deadline, DEADLINE_RESERVE_SECONDS
+        )
 
 
 if __name__ == "__main__":
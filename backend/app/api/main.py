@@ -1,23 +1,118 @@
+import asyncio
+import functools
+import json
 import os
 import uuid
+from contextlib import asynccontextmanager
+from typing import List, Optional
 
-from fastapi import FastAPI, UploadFile, File, Form
+from fastapi import FastAPI, UploadFile, File, Form, Header
 from fastapi.middleware.cors import CORSMiddleware
+from starlette.background import BackgroundTask
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
 
-from app.agents.main_agent import VisionAnalysisAgent
+from app.agent_utils import metrics
+from app.agent_utils.admission import AdmissionController, AdmissionRejected
+from app.agent_utils.deadline import new_deadline
+from app.agent_utils.image_preprocess import shutdown_image_pool, warm_up_image_pool
+from app.agent_utils.job_queue import JobQueue, InMemoryJobStore, SqliteJobStore, QueueFullError
+from app.agent_utils.request_metrics import RequestMetricsMiddleware
+from app.agent_utils.single_flight import SINGLE_FLIGHT, SingleFlight, analysis_key
+from app.agent_utils.tracing import shutdown_tracing, span, usage_stats
+from app.agent_utils.upstream import close_upstream_sessions
 from models.schemas import ApiResponse
 
-app = FastAPI()
-agent = VisionAnalysisAgent()
+# agent 在 lifespan 中后台构建（导入 langchain、创建模型客户端、编译图），
+# 构建期间 /healthz 已可访问，/readyz 返回 503；请求到达时会等待构建完成
+agent = None
+_agent_task: Optional[asyncio.Task] = None
+WARMUP_ON_STARTUP = os.getenv("WARMUP_ON_STARTUP", "1") == "1"
+UPSTREAM_HOSTS = ("dashscope.aliyuncs.com", "api.tavily.com")
 
-# 确保上传目录存在
+# 设置 CHECKPOINT_ANALYSES=1 时每次分析以 {username}_{随机后缀} 为 thread_id 写入有界 checkpointer，
+# 默认走无 checkpoint 的快速路径（单次分析无需回溯状态）
+CHECKPOINT_ANALYSES = os.getenv("CHECKPOINT_ANALYSES", "0") == "1"
+
+# 全局准入控制：限制同时在途的分析数，过载时快速返回 429
+admission = AdmissionController()
+
+# 相同请求合并：同一用户重复上传同一张图片（或携带相同 Idempotency-Key）时共享一次分析，SINGLE_FLIGHT=0 关闭
+single_flight = SingleFlight()
+
+# 异步任务队列配置：JOB_STORE=sqlite 时任务持久化到 JOB_DB_PATH，进程重启后继续执行
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "4"))
+JOB_MAX_PENDING = int(os.getenv("JOB_MAX_PENDING", "1000"))
+JOB_RESULT_TTL = float(os.getenv("JOB_RESULT_TTL", "3600"))
+JOB_STORE = os.getenv("JOB_STORE", "memory")
+JOB_DB_PATH = os.getenv("JOB_DB_PATH", "jobs.db")
+
+# 上传图片默认只在内存中流转；设置 SAVE_UPLOADS=1 时额外落盘一份到上传目录，便于调试
 UPLOAD_DIR = "uploads"
-os.makedirs(UPLOAD_DIR, exist_ok=True)
+SAVE_UPLOADS = os.getenv("SAVE_UPLOADS", "0") == "1"
+if SAVE_UPLOADS:
+    os.makedirs(UPLOAD_DIR, exist_ok=True)
 
 # 允许的图片 MIME 类型与最大文件大小
 ALLOWED_MIME = {"image/jpeg", "image/png", "image/webp", "image/gif"}
 MAX_FILE_SIZE = 10 * 1024 * 1024  # 10 MB
 
+# 批量分析：单次最多图片数与单批并发上限
+BATCH_MAX_IMAGES = int(os.getenv("BATCH_MAX_IMAGES", "20"))
+BATCH_CONCURRENCY = int(os.getenv("BATCH_CONCURRENCY", "4"))
+
+
+def _build_agent():
+    # 延迟导入：main_agent 会拉起 langchain_community / langgraph 等重量级依赖
+    from app.agents.main_agent import VisionAnalysisAgent
+    return VisionAnalysisAgent()
+
+
+async def _resolve_upstream_hosts():
+    """预先解析上游域名；两家 SDK 每次调用都新建会话，无法预建连接，只能先把 DNS 缓存热起来"""
+    loop = asyncio.get_running_loop()
+    results = await asyncio.gather(
+        *(loop.getaddrinfo(host, 443) for host in UPSTREAM_HOSTS), return_exceptions=True
+    )
+    for host, result in zip(UPSTREAM_HOSTS, results):
+        if isinstance(result, Exception):
+            print(f"[预热] 解析 {host} 失败: {result}")
+
+
+async def _warm_up():
+    """构建 agent，同时并行预热图片进程池与上游 DNS"""
+    global agent
+    # 进程池先于构建 agent 的线程拉起，避免在其他线程持有导入锁时 fork
+    await warm_up_image_pool()
+    agent, _ = await asyncio.gather(asyncio.to_thread(_build_agent), _resolve_upstream_hosts())
+    print("[启动] agent 已就绪")
+    return agent
+
+
+async def _get_agent():
+    """返回已构建好的 agent；未开启启动预热时在第一次请求时构建"""
+    global _agent_task
+    if _agent_task is None:
+        _agent_task = asyncio.create_task(_warm_up())
+    return await asyncio.shield(_agent_task)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    global _agent_task
+    if WARMUP_ON_STARTUP:
+        _agent_task = asyncio.create_task(_warm_up())
+    await job_queue.start()
+    yield
+    await job_queue.stop()
+    if _agent_task is not None and not _agent_task.done():
+        _agent_task.cancel()
+    shutdown_image_pool()
+    await close_upstream_sessions()
+    shutdown_tracing()
+
+
+app = FastAPI(lifespan=lifespan)
+
 # 配置 CORS 中间件
 app.add_middleware(
     CORSMiddleware,
@@ -26,42 +121,450 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+# 按路由记录端到端耗时，/metrics 导出
+app.add_middleware(RequestMetricsMiddleware)
 
 
-@app.post("/analyze", response_model=ApiResponse)
-async def analyze_nutrition(username: str = Form(...), image: UploadFile = File(...)):
+async def _read_upload(image: UploadFile):
+    """校验并读取上传图片，返回 (图片字节, 错误响应)，校验通过时错误响应为 None"""
+    with span("image.upload", {"image.mime": image.content_type or ""}) as current:
+        content, error = await _validate_upload(image)
+        current.set_attribute("image.bytes", len(content) if content is not None else 0)
+        current.set_attribute("image.rejected", error is not None)
+        return content, error
+
+
+async def _validate_upload(image: UploadFile):
+    """_read_upload 的实际校验与读取部分"""
     # 1. 安全校验：MIME 类型
     if image.content_type not in ALLOWED_MIME:
-        return ApiResponse(status="error", message=f"不支持的文件类型: {image.content_type}")
+        metrics.incr("upload_rejected", labels={"reason": "mime"})
+        return None, ApiResponse(status="error", message=f"不支持的文件类型: {image.content_type}")
 
     # 2. 读取文件内容（异步）并校验大小
     content = await image.read()
+    metrics.histogram("upload_bytes", len(content), buckets=metrics.SIZE_BUCKETS)
     if len(content) > MAX_FILE_SIZE:
-        return ApiResponse(status="error", message="文件过大，请上传小于 10MB 的图片")
+        metrics.incr("upload_rejected", labels={"reason": "size"})
+        return None, ApiResponse(status="error", message="文件过大，请上传小于 10MB 的图片")
 
-    # 3. 保存到临时路径
-    file_ext = image.filename.rsplit(".", 1)[-1] if "." in image.filename else "jpg"
-    file_path = os.path.join(UPLOAD_DIR, f"{uuid.uuid4()}.{file_ext}")
-    with open(file_path, "wb") as f:
-        f.write(content)
+    # 3. 调试模式下保留一份上传副本（仅写出，分析流程不会再从磁盘读回）
+    if SAVE_UPLOADS:
+        file_ext = image.filename.rsplit(".", 1)[-1] if "." in image.filename else "jpg"
+        file_path = os.path.join(UPLOAD_DIR, f"{uuid.uuid4()}.{file_ext}")
+        await asyncio.to_thread(_save_upload, file_path, content)
+
+    return content, None
+
+
+def _state_to_response(full_state: dict) -> ApiResponse:
+    """将 Agent 返回的完整状态转换为统一响应，并按结果类别计数（无效图片率 = invalid_image / 全部）"""
+    error_reason = full_state.get("error_reason")
+    if error_reason:
+        metrics.incr("analysis_results", labels={"status": "invalid_image"})
+        return ApiResponse(status="invalid_image", message=error_reason)
+
+    report = full_state.get("analysis_results")
+    if report is None:
+        metrics.incr("analysis_results", labels={"status": "error"})
+        return ApiResponse(status="error", message="分析流程未返回结果，请重试")
+    # 检索超时时返回按视觉克数估算的部分报告，由 is_partial 标记
+    if full_state.get("is_partial"):
+        metrics.incr("analysis_results", labels={"status": "partial"})
+        return ApiResponse(
+            status="success",
+            message="分析超时，油盐为估算值",
+            data={**report.model_dump(), "is_partial": True},
+        )
+    metrics.incr("analysis_results", labels={"status": "success"})
+    return ApiResponse(status="success", data={**report.model_dump(), "is_partial": False})
+
+
+def _error_response(e: Exception) -> ApiResponse:
+    """分析过程中的异常转换为错误响应，按异常类别计数"""
+    metrics.incr("analysis_results", labels={"status": "error"})
+    metrics.incr("analysis_errors", labels={"error_class": type(e).__name__})
+    return ApiResponse(status="error", message=str(e))
+
+
+def _reusable(response: ApiResponse) -> bool:
+    """可以直接交给重复请求的结果：完整的成功报告与图片无效的判定；出错与超时的部分报告让重试重新分析"""
+    if response.status == "success":
+        return not (response.data or {}).get("is_partial")
+    return response.status == "invalid_image"
+
+
+async def _run_analysis(username: str, content: bytes, mime_type: str, patient: bool = False,
+                        canteen_name: Optional[str] = None, meal_type: Optional[str] = None,
+                        idempotency_key: Optional[str] = None, batch: bool = False) -> ApiResponse:
+    """
+    执行一次完整分析并转换为统一响应，供 /analyze、批量接口与任务队列共用
+
+    准入被拒绝时抛出 AdmissionRejected，由调用方决定如何响应；patient=True 时只排队不拒绝。
+    batch=True 用于批量接口的单项：配额已按批次扣除，在用户自己的在途上限后排队时不会超时。
+    canteen_name / meal_type 可选，用于限定食堂快速通道的匹配范围。
+    相同用户的相同图片（或相同 idempotency_key）并发到达时只分析一次，完成后的短时间内重复请求直接返回结果。
+    """
+    run = functools.partial(_analyze_once, username, content, mime_type, patient, canteen_name, meal_type, batch)
+    # analysis span 带上用户，其下的模型 / 搜索调用的 token 与费用都计到该用户
+    with span("analysis", _analysis_attributes(canteen_name, meal_type, patient, batch), user=username) as current:
+        if not SINGLE_FLIGHT:
+            response = await run()
+        else:
+            mode = "patient" if patient else "batch" if batch else "now"
+            key = analysis_key(username, content, canteen_name, meal_type, idempotency_key, mode)
+            response = await single_flight.do(key, run, cacheable=_reusable)
+        current.set_attribute("analysis.status", response.status)
+        return response
+
+
+def _analysis_attributes(canteen_name: Optional[str], meal_type: Optional[str], patient: bool = False,
+                         batch: bool = False) -> dict:
+    attributes = {"analysis.patient": patient, "analysis.batch": batch}
+    if canteen_name:
+        attributes["canteen.name"] = canteen_name
+    if meal_type:
+        attributes["meal.type"] = meal_type
+    return attributes
+
+
+async def _analyze_once(username: str, content: bytes, mime_type: str, patient: bool,
+                        canteen_name: Optional[str], meal_type: Optional[str], batch: bool = False) -> ApiResponse:
+    """
+    _run_analysis 的实际执行部分
+
+    截止时间从请求到达时开始计算（排队等待也计入）；后台任务不限等待，不设截止时间；
+    批量接口的单项可能排在同批图片之后，截止时间从拿到名额时开始计算
+    """
+    deadline = None if patient or batch else new_deadline()
+    async with admission.slot(patient, user=username, batch=batch):
+        if batch:
+            deadline = new_deadline()
+        # 图片字节与校验过的 MIME 类型直接进入分析流程
+        # 这里传 bytes 本身（不复制）；memoryview 虽然也被支持，但无法被 checkpointer 序列化
+        try:
+            agent = await _get_agent()
+            full_state = await agent.arun(
+                username=username,
+                image_bytes=content,
+                image_mime=mime_type,
+                thread_id=_thread_id(username),
+                canteen_name=canteen_name,
+                meal_type=meal_type,
+                deadline=deadline,
+            )
+            return _state_to_response(full_state)
+
+        except Exception as e:
+            return _error_response(e)
+
+
+def _thread_id(username: str):
+    return f"{username}_{uuid.uuid4().hex[:8]}" if CHECKPOINT_ANALYSES else None
+
+
+def _rejected_response(e: AdmissionRejected) -> JSONResponse:
+    return JSONResponse(
+        status_code=429,
+        content=ApiResponse(status="error", message=str(e), data={"retry_after": e.retry_after}).model_dump(),
+        headers={"Retry-After": str(e.retry_after)},
+    )
+
+
+job_queue = JobQueue(
+    store=SqliteJobStore(JOB_DB_PATH) if JOB_STORE == "sqlite" else InMemoryJobStore(),
+    # 后台任务已由 worker 数限流，只排队等待名额，不被准入拒绝
+    runner=functools.partial(_run_analysis, patient=True),
+    workers=JOB_WORKERS,
+    max_pending=JOB_MAX_PENDING,
+    result_ttl=JOB_RESULT_TTL,
+    # 已达在途上限的用户先跳过，worker 去执行其他用户的任务，而不是停在准入排队上
+    user_max_running=admission.user_max_inflight,
+    can_run=admission.has_room,
+)
+admission.add_release_listener(job_queue.wake)
 
-    # 4. 调用 Agent，无论成功失败都删除临时文件
+
+@app.post("/analyze", response_model=ApiResponse)
+async def analyze_nutrition(
+    username: str = Form(...),
+    image: UploadFile = File(...),
+    canteen_name: Optional[str] = Form(None),
+    meal_type: Optional[str] = Form(None),
+    idempotency_key: Optional[str] = Header(None),
+):
+    content, error = await _read_upload(image)
+    if error:
+        return error
     try:
-        thread_id = f"{username}_{uuid.uuid4().hex[:8]}"
-        full_state = agent.run(username=username, image_path=file_path, thread_id=thread_id)
+        return await _run_analysis(
+            username, content, image.content_type, canteen_name=canteen_name, meal_type=meal_type,
+            idempotency_key=idempotency_key,
+        )
+    except AdmissionRejected as e:
+        return _rejected_response(e)
 
-        error_reason = full_state.get("error_reason")
-        if error_reason:
-            return ApiResponse(status="invalid_image", message=error_reason)
 
-        report = full_state.get("analysis_results")
-        if report is None:
-            return ApiResponse(status="error", message="分析流程未返回结果，请重试")
-        return ApiResponse(status="success", data=report.model_dump())
+@app.post("/analyze/batch")
+async def analyze_nutrition_batch(
+    images: List[UploadFile] = File(...),
+    usernames: List[str] = Form(...),
+    tags: Optional[List[str]] = Form(None),
+    stream: bool = Form(False),
+    canteen_name: Optional[str] = Form(None),
+    meal_type: Optional[str] = Form(None),
+):
+    """
+    批量分析：多张图片在并发上限内同时分析，单张失败不影响其他图片
 
-    except Exception as e:
+    usernames / tags 与 images 按顺序一一对应；usernames 只传一个时对所有图片生效。
+    canteen_name / meal_type 对整批图片生效。
+    stream=true 时以 NDJSON 逐行返回先完成的结果，否则按上传顺序一次性返回。
+    每个用户每批只扣一次配额；同一用户的图片在其在途上限后排队，不会因为批次自身的并发而超时。
+    """
+    if len(images) > BATCH_MAX_IMAGES:
+        return ApiResponse(status="error", message=f"单次最多上传 {BATCH_MAX_IMAGES} 张图片")
+    if len(usernames) == 1:
+        usernames = usernames * len(images)
+    tags = tags or []
+    if len(usernames) != len(images) or len(tags) not in (0, len(images)):
+        return ApiResponse(status="error", message="usernames / tags 数量需与 images 一致")
+
+    # 先读完全部上传内容：流式响应开始后请求中的上传文件可能已被关闭
+    uploads = [(await _read_upload(image), image.content_type) for image in images]
+    semaphore = asyncio.Semaphore(BATCH_CONCURRENCY)
+
+    # 配额按批次扣除：每个用户一次，配额不足的用户的图片整体拒绝
+    rejected = {}
+    for username in dict.fromkeys(name for name, ((_, error), _) in zip(usernames, uploads) if not error):
+        try:
+            admission.charge(username)
+        except AdmissionRejected as e:
+            rejected[username] = e
+
+    async def analyze_one(index: int) -> dict:
+        (content, error), mime_type = uploads[index]
+        rejection = rejected.get(usernames[index])
+        if error:
+            response = error
+        elif rejection is not None:
+            response = ApiResponse(status="error", message=str(rejection), data={"retry_after": rejection.retry_after})
+        else:
+            async with semaphore:
+                try:
+                    response = await _run_analysis(
+                        usernames[index], content, mime_type, canteen_name=canteen_name, meal_type=meal_type,
+                        batch=True,
+                    )
+                except AdmissionRejected as e:
+                    response = ApiResponse(status="error", message=str(e), data={"retry_after": e.retry_after})
+        return {
+            "index": index,
+            "username": usernames[index],
+            "tag": tags[index] if tags else None,
+            "response": response.model_dump(),
+        }
+
+    tasks = [asyncio.create_task(analyze_one(i)) for i in range(len(images))]
+
+    if not stream:
+        results = await asyncio.gather(*tasks)
+        return ApiResponse(status="success", data={"results": results})
+
+    async def ndjson_stream():
+        try:
+            for finished in asyncio.as_completed(tasks):
+                yield json.dumps(await finished, ensure_ascii=False) + "\n"
+        finally:
+            # 客户端提前断开时取消剩余分析
+            for task in tasks:
+                task.cancel()
+
+    return StreamingResponse(ndjson_stream(), media_type="application/x-ndjson")
+
+
+@app.post("/jobs", response_model=ApiResponse)
+async def submit_job(username: str = Form(...), image: UploadFile = File(...)):
+    """校验图片后入队，立即返回 job_id；结果通过 GET /jobs/{job_id} 轮询"""
+    content, error = await _read_upload(image)
+    if error:
+        return error
+
+    try:
+        job = await job_queue.submit(username, content, image.content_type)
+    except QueueFullError as e:
         return ApiResponse(status="error", message=str(e))
+    return ApiResponse(status="queued", data={"job_id": job.job_id, "queue_depth": job_queue.depth()})
+
+
+@app.get("/jobs/{job_id}", response_model=ApiResponse)
+async def get_job(job_id: str):
+    job = await job_queue.get(job_id)
+    if job is None:
+        return ApiResponse(status="error", message="任务不存在或已过期")
+    return ApiResponse(status=job.status, data=job.model_dump())
+
+
+def _sse(event: str, data) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+def _progress_payload(node: str, update: dict):
+    """把节点的状态更新裁剪为前端需要的进度信息，不需要推送的节点返回 None"""
+    update = update or {}
+    if node == "vision":
+        vision = update.get("vision_report")
+        return vision.model_dump() if vision is not None else None
+    if node == "canteen":
+        return {"fast_path": bool(update.get("fast_path"))}
+    if node == "split":
+        return {"dishes": [item.name for item in update.get("dish_items", [])]}
+    if node == "dish":
+        finding = update["dish_findings"][-1]
+        return {"dish": finding.item.name, "findings": finding.extracted_info}
+    if node == "searching":
+        messages = update.get("messages")
+        if not messages:
+            # 预算耗尽（截止时间 / 次数 / token）时没有新消息，直接按已有结论进入估算
+            return {"queries": [], "findings": update.get("extracted_info", ""),
+                    "budget_exhausted": update.get("budget_exhausted", [])}
+        queries = [call["args"].get("query", "") for call in (messages[-1].tool_calls or [])]
+        return {"queries": queries, "findings": update.get("extracted_info", "")}
+    if node == "tools":
+        return {"results": len(update.get("messages", []))}
+    if node == "summarize":
+        report = update.get("final_response")
+        return report.model_dump() if report is not None else None
+    return None
+
+
+@app.post("/analyze/stream")
+async def analyze_nutrition_stream(
+    username: str = Form(...),
+    image: UploadFile = File(...),
+    canteen_name: Optional[str] = Form(None),
+    meal_type: Optional[str] = Form(None),
+    idempotency_key: Optional[str] = Header(None),
+):
+    """
+    /analyze 的 SSE 版本：vision / canteen / split / searching / tools / dish / summarize 每完成一步推送一条事件，
+    最后以 result 事件返回与 /analyze 相同结构的 ApiResponse
+
+    相同请求已有在途分析或刚完成的结果时不再重新分析，只推送 result 事件；本次完成的结果同样留给之后的重试
+    """
+    deadline = new_deadline()
+    content, error = await _read_upload(image)
+    mime_type = image.content_type
 
-    finally:
-        if os.path.exists(file_path):
-            os.remove(file_path)
+    key = analysis_key(username, content, canteen_name, meal_type, idempotency_key) \
+        if SINGLE_FLIGHT and not error else None
+    shared = single_flight.lookup(key) if key else None
+    if shared is not None:
+        return StreamingResponse(
+            _shared_result_stream(shared),
+            media_type="text/event-stream",
+            headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+        )
+
+    # 准入在开始推流前完成，过载时直接返回 429 而不是建立长连接
+    ticket = None
+    if not error:
+        try:
+            ticket = await admission.acquire(user=username)
+        except AdmissionRejected as e:
+            return _rejected_response(e)
+
+    async def event_stream():
+        if error:
+            yield _sse("result", error.model_dump())
+            return
+
+        with span("analysis", _analysis_attributes(canteen_name, meal_type), user=username) as current:
+            try:
+                agent = await _get_agent()
+                async for node, update in agent.astream(
+                    username=username,
+                    image_bytes=content,
+                    image_mime=mime_type,
+                    thread_id=_thread_id(username),
+                    canteen_name=canteen_name,
+                    meal_type=meal_type,
+                    deadline=deadline,
+                ):
+                    if node == "result":
+                        response = _state_to_response(update)
+                        current.set_attribute("analysis.status", response.status)
+                        if key and _reusable(response):
+                            single_flight.remember(key, response)
+                        yield _sse("result", response.model_dump())
+                        continue
+                    payload = _progress_payload(node, update)
+                    if payload is not None:
+                        yield _sse(node, payload)
+
+            except Exception as e:
+                current.set_attribute("analysis.status", "error")
+                yield _sse("result", _error_response(e).model_dump())
+
+            finally:
+                ticket.release()
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+        # 客户端在推流开始前断开时生成器不会执行，由后台任务兜底归还名额（release 可重复调用）
+        background=BackgroundTask(ticket.release) if ticket else None,
+    )
+
+
+async def _shared_result_stream(shared):
+    """等待合并到的在途分析（或已完成的结果），只推送最终的 result 事件"""
+    try:
+        response = await shared
+    except AdmissionRejected as e:
+        response = ApiResponse(status="error", message=str(e), data={"retry_after": e.retry_after})
+    except Exception as e:
+        response = ApiResponse(status="error", message=str(e))
+    yield _sse("result", response.model_dump())
+
+
+@app.get("/healthz")
+async def healthz():
+    """存活探针：进程能响应即返回 200"""
+    return {"status": "ok"}
+
+
+@app.get("/readyz")
+async def readyz():
+    """就绪探针：agent 构建完成后返回 200，构建中或失败返回 503"""
+    if _agent_task is not None and _agent_task.done() and not _agent_task.cancelled():
+        if _agent_task.exception() is None:
+            return {"status": "ready"}
+        return JSONResponse(status_code=503, content={"status": "failed", "error": str(_agent_task.exception())})
+    return JSONResponse(status_code=503, content={"status": "starting"})
+
+
+@app.get("/stats")
+async def stats():
+    """
+    进程内运行指标（图片预处理前后字节数、耗时等），admission_users 为各用户的排队与放行情况，
+    usage_users 为从链路追踪 span 汇总的各用户请求数、token 数与费用
+    """
+    return {**metrics.snapshot(), "admission_users": admission.user_stats(), "usage_users": usage_stats()}
+
+
+@app.get("/metrics")
+async def prometheus_metrics():
+    """
+    Prometheus 文本格式的指标：/stats 中的全部计数器与观测值，以及
+    http_request_seconds（端到端）、graph_node_seconds（各图节点）、llm_call_seconds / tool_call_seconds、
+    upstream_request_seconds（单次上游请求）、search_loop_iterations、upload_bytes 直方图，
+    analysis_results（按结果类别）与 analysis_errors / *_errors（按异常类别）计数
+    """
+    return PlainTextResponse(metrics.render_prometheus(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+
+def _save_upload(file_path: str, content: bytes):
+    with open(file_path, "wb") as f:
+        f.write(content)
@@ -0,0 +1,74 @@
+"""
+/analyze 单 worker 并发吞吐基准：对比"异步路由里同步调用 agent"（改造前）与"全链路 ainvoke"（改造后）
+
+用法（在 backend 目录下）：
+    python -m benchmarks.bench_async_throughput --requests 20 --latency 2.0
+
+模型调用用固定耗时的假 agent 代替，只衡量事件循环是否被阻塞，不消耗 API 额度。
+"""
+import argparse
+import asyncio
+import io
+import os
+import time
+
+os.environ.setdefault("DASHSCOPE_API_KEY", "bench")
+os.environ.setdefault("TAVILY_API_KEY", "bench")
+
+import httpx
+
+from app.agent_utils.single_flight import SingleFlight
+from app.api import main
+from models.schemas import NutritionReport
+
+
+class BlockingAgent:
+    """改造前：graph.invoke 在事件循环线程里同步执行"""
+
+    def __init__(self, latency: float):
+        self.latency = latency
+
+    async def arun(self, **kwargs):
+        time.sleep(self.latency)
+        return {"error_reason": None, "analysis_results": NutritionReport(dish_name="bench")}
+
+
+class AsyncAgent(BlockingAgent):
+    """改造后：graph.ainvoke 在等待上游时让出事件循环"""
+
+    async def arun(self, **kwargs):
+        await asyncio.sleep(self.latency)
+        return {"error_reason": None, "analysis_results": NutritionReport(dish_name="bench")}
+
+
+async def _fire(n_requests: int) -> float:
+    transport = httpx.ASGITransport(app=main.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+        async def one(i: int):
+            files = {"image": (f"{i}.jpg", io.BytesIO(b"\xff\xd8\xff" + b"0" * 1024), "image/jpeg")}
+            resp = await client.post("/analyze", data={"username": f"u{i}"}, files=files)
+            assert resp.json()["status"] == "success", resp.text
+
+        start = time.perf_counter()
+        await asyncio.gather(*(one(i) for i in range(n_requests)))
+        return time.perf_counter() - start
+
+
+def main_cli():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=20)
+    parser.add_argument("--latency", type=float, default=2.0, help="模拟一次完整分析链路的耗时（秒）")
+    args = parser.parse_args()
+
+    for label, agent_cls in (("blocking (before)", BlockingAgent), ("async (after)", AsyncAgent)):
+        # agent 由 main._get_agent 在首个请求时构建，这里替换构建函数即可
+        main._build_agent = lambda: agent_cls(args.latency)
+        main._agent_task = None
+        # 两轮的请求完全相同，清掉上一轮保留的合并结果，否则改造后的一轮直接命中、测不到真实吞吐
+        main.single_flight = SingleFlight()
+        elapsed = asyncio.run(_fire(args.requests))
+        print(f"{label:<18} {args.requests} 并发请求耗时 {elapsed:6.2f}s, 吞吐 {args.requests / elapsed:6.2f} req/s")
+
+
+if __name__ == "__main__":
+    main_cli()
@@ -0,0 +1,85 @@
+"""
+按用户公平调度基准：一个重度客户端瞬间提交大量分析时，普通用户的排队延迟
+
+用法（在 backend 目录下）：
+    python -m benchmarks.bench_fair_admission
+    python -m benchmarks.bench_fair_admission --heavy 80 --light-users 16 --service 0.3
+
+直接驱动 AdmissionController，分析本身用固定耗时（带 ±20% 抖动）的 sleep 代替：
+- 改造前：所有请求进入同一个 FIFO 队列，没有按用户的在途上限与配额
+- 公平队列（不限配额）：加权公平队列 + 单用户在途上限，重度客户端的请求全部排队执行
+- 按用户公平：默认配置，在上面的基础上再加单用户排队上限与令牌桶配额，超出部分直接返回 429
+重度客户端在 t=0 一次提交 --heavy 个请求，普通用户每隔 --interval 秒发起一次，共 --light-requests 次。
+"""
+import argparse
+import asyncio
+import random
+import time
+
+from app.agent_utils.admission import AdmissionController, AdmissionRejected
+
+
+def _percentile(values, q: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))] if values else 0.0
+
+
+async def _scenario(controller: AdmissionController, args, per_user: bool) -> dict:
+    latencies = {"light": [], "heavy": []}
+    rejected = {"light": 0, "heavy": 0}
+
+    async def request(kind: str, user: str):
+        start = time.perf_counter()
+        try:
+            async with controller.slot(user=user if per_user else None):
+                await asyncio.sleep(args.service * random.uniform(0.8, 1.2))
+        except AdmissionRejected:
+            rejected[kind] += 1
+            return
+        latencies[kind].append(time.perf_counter() - start)
+
+    async def light_user(index: int):
+        tasks = []
+        await asyncio.sleep(random.uniform(0, args.interval))
+        for _ in range(args.light_requests):
+            tasks.append(asyncio.create_task(request("light", f"user{index}")))
+            await asyncio.sleep(args.interval)
+        await asyncio.gather(*tasks)
+
+    heavy = [asyncio.create_task(request("heavy", "script")) for _ in range(args.heavy)]
+    await asyncio.gather(*(light_user(i) for i in range(args.light_users)), *heavy)
+    return {"latencies": latencies, "rejected": rejected}
+
+
+def main_cli():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--heavy", type=int, default=60, help="重度客户端一次提交的请求数")
+    parser.add_argument("--light-users", type=int, default=8)
+    parser.add_argument("--light-requests", type=int, default=5, help="每个普通用户的请求数")
+    parser.add_argument("--interval", type=float, default=1.0, help="普通用户两次请求的间隔秒数")
+    parser.add_argument("--service", type=float, default=0.2, help="单次分析耗时（秒）")
+    parser.add_argument("--inflight", type=int, default=4, help="全局在途上限")
+    args = parser.parse_args()
+
+    unbounded = 10 ** 6
+    modes = (
+        ("改造前（FIFO）", False, dict(max_queue=unbounded, queue_timeout=unbounded,
+                                    user_max_inflight=unbounded, user_max_queue=unbounded, user_rate=0)),
+        ("公平队列（不限配额）", True, dict(max_queue=unbounded, queue_timeout=unbounded,
+                                    user_max_queue=unbounded, user_rate=0)),
+        ("按用户公平", True, dict(max_queue=unbounded, queue_timeout=unbounded)),
+    )
+    for label, per_user, kwargs in modes:
+        random.seed(0)
+        controller = AdmissionController(max_inflight=args.inflight, **kwargs)
+        result = asyncio.run(_scenario(controller, args, per_user))
+        light, heavy = result["latencies"]["light"], result["latencies"]["heavy"]
+        print(
+            f"{label:<14} 普通用户 p50 {_percentile(light, 0.5):5.2f}s  p99 {_percentile(light, 0.99):5.2f}s"
+            f"（完成 {len(light)}，拒绝 {result['rejected']['light']}）"
+            f"  重度客户端 完成 {len(heavy)}，拒绝 {result['rejected']['heavy']}"
+        )
+
+
+if __name__ == "__main__":
+    main_cli()
@@ -0,0 +1,71 @@
+"""
+启动导入耗时基准：用 `python -X importtime` 在子进程中导入 app.api.main，统计总耗时与最慢的模块
+
+用法（在 backend 目录下）：
+    python -m benchmarks.bench_import_time
+    python -m benchmarks.bench_import_time --module app.agents.main_agent --top 20
+    python -m benchmarks.bench_import_time --max-ms 400     # 超过阈值时退出码为 1，可用于 CI
+
+agent 改为在 lifespan 中后台构建后，导入 app.api.main 不再拉起 langchain / langgraph / chromadb。
+"""
+import argparse
+import os
+import subprocess
+import sys
+
+
+def _measure(module: str):
+    """返回 (总耗时 ms, [(累计耗时 ms, 自身耗时 ms, 模块名), ...])"""
+    env = dict(os.environ)
+    env.setdefault("DASHSCOPE_API_KEY", "bench")
+    env.setdefault("TAVILY_API_KEY", "bench")
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True, text=True, env=env,
+    )
+    if proc.returncode != 0:
+        raise RuntimeError(f"导入 {module} 失败:\n{proc.stderr[-2000:]}")
+
+    rows = []
+    total_us = 0
+    for line in proc.stderr.splitlines():
+        # 格式: "import time:      self [us] |  cumulative | imported package"
+        if not line.startswith("import time:") or "[us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|", 2)
+        self_us, cumulative_us = int(self_us), int(cumulative_us)
+        total_us += self_us
+        rows.append((cumulative_us / 1000, self_us / 1000, name.rstrip()))
+    return total_us / 1000, rows
+
+
+def main_cli():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--module", default="app.api.main")
+    parser.add_argument("--top", type=int, default=15)
+    parser.add_argument("--repeat", type=int, default=3, help="取多次测量的最小值，减少磁盘缓存的干扰")
+    parser.add_argument("--max-ms", type=float, default=None)
+    args = parser.parse_args()
+
+    best_total, best_rows = None, None
+    for _ in range(args.repeat):
+        total, rows = _measure(args.module)
+        if best_total is None or total < best_total:
+            best_total, best_rows = total, rows
+
+    print(f"{'cumulative(ms)':>14} {'self(ms)':>9}  module")
+    for cumulative, self_ms, name in sorted(best_rows, key=lambda r: r[0], reverse=True)[:args.top]:
+        print(f"{cumulative:14.1f} {self_ms:9.1f}  {name}")
+    print(f"导入 {args.module} 总耗时 {best_total:.1f} ms（{len(best_rows)} 个模块）")
+
+    heavy = [name.strip() for _, _, name in best_rows if name.strip().split(".")[0] in
+             ("langchain_community", "langgraph", "chromadb", "dashscope", "langchain_tavily")]
+    if heavy:
+        print(f"注意：导入期间加载了重量级依赖 {sorted({h.split('.')[0] for h in heavy})}")
+
+    if args.max_ms is not None and best_total > args.max_ms:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main_cli()
@@ -0,0 +1,59 @@
+"""
+图片归一化耗时基准：不同分辨率原图的预处理耗时与压缩前后字节数
+
+用法（在 backend 目录下）：
+    python -m benchmarks.bench_preprocess --rounds 5
+    python -m benchmarks.bench_preprocess --image ../food_pic/饺子.jpg
+"""
+import argparse
+import io
+import statistics
+import time
+
+import numpy as np
+from PIL import Image
+
+from app.agent_utils.image_preprocess import normalize_image, IMAGE_MAX_EDGE
+
+# 常见手机照片尺寸（约 1 / 3 / 12 / 48 MP）
+SIZES = [(1280, 960), (2048, 1536), (4032, 3024), (8000, 6000)]
+
+
+def _synthetic_photo(width: int, height: int) -> bytes:
+    """渐变 + 噪声，JPEG 压缩后的体积接近真实照片"""
+    rng = np.random.default_rng(0)
+    y, x = np.mgrid[0:height, 0:width]
+    base = np.stack([(x * 255 // width), (y * 255 // height), ((x + y) * 127 // (width + height))], axis=-1)
+    noise = rng.integers(-40, 40, size=base.shape)
+    pixels = np.clip(base + noise, 0, 255).astype(np.uint8)
+    out = io.BytesIO()
+    Image.fromarray(pixels, "RGB").save(out, format="JPEG", quality=95)
+    return out.getvalue()
+
+
+def _bench(label: str, data: bytes, rounds: int):
+    timings = []
+    for _ in range(rounds):
+        start = time.perf_counter()
+        out, _ = normalize_image(data)
+        timings.append(time.perf_counter() - start)
+    print(f"{label:<14} {len(data) / 1024:9.0f} KB -> {len(out) / 1024:7.0f} KB "
+          f"({len(out) / len(data):6.1%})  中位耗时 {statistics.median(timings) * 1000:7.1f} ms")
+
+
+def main_cli():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rounds", type=int, default=5)
+    parser.add_argument("--image", help="额外测一张真实图片")
+    args = parser.parse_args()
+
+    print(f"IMAGE_MAX_EDGE={IMAGE_MAX_EDGE}")
+    for width, height in SIZES:
+        _bench(f"{width}x{height}", _synthetic_photo(width, height), args.rounds)
+    if args.image:
+        with open(args.image, "rb") as f:
+            _bench("real", f.read(), args.rounds)
+
+
+if __name__ == "__main__":
+    main_cli()
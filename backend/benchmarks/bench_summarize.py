@@ -0,0 +1,86 @@
+"""
+summarize 阶段基准：对比 "本地宝塔聚合引擎" 与 "qwen-plus 结构化输出" 两种汇总方式下分析子图的端到端耗时
+
+用法（在 backend 目录下）：
+    python -m benchmarks.bench_summarize                          # 模型用固定耗时的替身，不消耗 API 额度
+    python -m benchmarks.bench_summarize --summarize-latency 6    # 按实测的 summarize 调用耗时调整替身
+    python -m benchmarks.bench_summarize --live --runs 3          # 真实调用千问与 Tavily（需要 .env 中的 API Key）
+
+替身模式下检索节点返回与 DISH_SEARCHING_NODE_PROMPT 同格式的结论，summarize 替身返回空报告，只衡量耗时。
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import time
+
+from langchain_core.messages import AIMessage
+from langchain_core.runnables import RunnableLambda
+
+from app.agent_utils import pagoda
+from models.schemas import NutritionReport
+
+VISION_REPORT = (
+    "---\n- 类别: 主食\n- 名称: 米饭\n- 食材组成: 米饭 (150g)\n---\n"
+    "- 类别: 菜品\n- 名称: 西红柿炒鸡蛋\n- 食材组成: 西红柿 (100g), 鸡蛋 (60g), 葱花 (3g)\n---\n"
+    "- 类别: 菜品\n- 名称: 红烧肉\n- 食材组成: 五花肉 (90g), 土豆 (40g)\n---\n"
+    "- 类别: 菜品\n- 名称: 清炒西兰花\n- 食材组成: 西兰花 (80g), 蒜末 (5g)\n---\n"
+)
+
+
+def _stub_models(agent, search_latency: float, summarize_latency: float):
+    async def search(messages):
+        await asyncio.sleep(search_latency)
+        return AIMessage(content="- 油盐含量：油(8 g), 盐(1.5 g)")
+
+    async def summarize(messages):
+        await asyncio.sleep(summarize_latency)
+        return NutritionReport()
+
+    agent.searching_llm = RunnableLambda(lambda m: asyncio.run(search(m)), afunc=search)
+    agent.summarize_llm = RunnableLambda(lambda m: asyncio.run(summarize(m)), afunc=summarize)
+
+
+async def _run(agent, runs: int):
+    samples = []
+    for i in range(runs):
+        start = time.perf_counter()
+        await agent.aanalyze(f"bench_{i}", VISION_REPORT)
+        samples.append(time.perf_counter() - start)
+    return samples
+
+
+def main_cli():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--search-latency", type=float, default=2.0, help="替身检索调用耗时（秒）")
+    parser.add_argument("--summarize-latency", type=float, default=4.0, help="替身 summarize 调用耗时（秒）")
+    parser.add_argument("--live", action="store_true", help="使用真实模型与搜索")
+    args = parser.parse_args()
+
+    if not args.live:
+        os.environ.setdefault("DASHSCOPE_API_KEY", "bench")
+        os.environ.setdefault("TAVILY_API_KEY", "bench")
+
+    from app.agents.analysis_agent import AnalysisAgent
+    agent = AnalysisAgent()
+    if not args.live:
+        _stub_models(agent, args.search_latency, args.summarize_latency)
+
+    dishes = pagoda.facts_from_text(
+        "- 菜品名称：米饭+西红柿炒鸡蛋\n- 食材组成：米饭(150 g), 西红柿(100 g), 鸡蛋(60 g)\n- 油盐含量：油(8 g), 盐(1.5 g)"
+    )
+    start = time.perf_counter()
+    for _ in range(1000):
+        pagoda.aggregate(dishes)
+    print(f"本地聚合单次耗时 {(time.perf_counter() - start):.3f} ms（1000 次平均）")
+
+    for label, enabled in (("llm summarize", False), ("pagoda engine", True)):
+        pagoda.PAGODA_ENGINE = enabled
+        samples = asyncio.run(_run(agent, args.runs))
+        print(f"{label:<14} 分析子图端到端 中位数 {statistics.median(samples):6.2f}s  "
+              f"最大 {max(samples):6.2f}s  ({args.runs} 次)")
+
+
+if __name__ == "__main__":
+    main_cli()
@@ -0,0 +1,99 @@
+"""
+工具结果压缩基准：对比开启 / 关闭压缩时，一次分析中检索循环累计发送的 prompt token 数
+
+用法（在 backend 目录下）：
+    python -m benchmarks.bench_tool_compaction                # 3 道菜、每道菜 3 轮检索
+    python -m benchmarks.bench_tool_compaction --rounds 4     # 调整每道菜的检索轮数
+
+模型与 Tavily 都使用替身：模型前几轮只发起搜索，最后一轮给出结论；Tavily 返回 3 条长网页正文。
+替身响应不带 token_usage，prompt token 数按 estimate_tokens 估算，与线上拿不到用量时的口径一致。
+"""
+import argparse
+import asyncio
+import os
+
+from langchain_core.messages import AIMessage, ToolMessage
+from langchain_core.runnables import RunnableLambda
+
+VISION_REPORT = (
+    "---\n- 类别: 菜品\n- 名称: 红烧肉\n- 食材组成: 五花肉 (90g), 土豆 (40g)\n---\n"
+    "- 类别: 菜品\n- 名称: 鱼香肉丝\n- 食材组成: 猪肉 (70g), 木耳 (20g), 胡萝卜 (20g)\n---\n"
+    "- 类别: 菜品\n- 名称: 地三鲜\n- 食材组成: 茄子 (60g), 土豆 (50g), 青椒 (30g)\n---\n"
+)
+
+_PAGE = (
+    "{dish}是一道经典的家常菜，历史悠久，各地做法略有不同。准备食材：主料 500 克切块备用。"
+    "锅中放入食用油 30 毫升烧热，下入主料翻炒。加入生抽两勺、老抽一勺、盐 5 克，小火慢炖。"
+    "出锅前撒上葱花即可，这道菜色香味俱全，深受大家喜爱。"
+) * 8 + "Related posts: click here to read more recipes from our kitchen. " * 40
+
+
+def _fake_search(query: str) -> dict:
+    dish = query.split()[0]
+    return {
+        "query": query,
+        "follow_up_questions": None,
+        "answer": None,
+        "images": [],
+        "results": [
+            {"url": f"https://example.com/{i}", "title": f"{dish}的做法 {i}", "content": _PAGE.format(dish=dish),
+             "score": 0.9, "raw_content": None}
+            for i in range(3)
+        ],
+        "response_time": 0.5,
+    }
+
+
+def _stub(agent, rounds: int):
+    from langchain_tavily import TavilySearch
+
+    async def search_tool(self, query: str, run_manager=None, **kwargs):
+        return _fake_search(query)
+
+    TavilySearch._arun = search_tool
+
+    async def searching(messages):
+        done = sum(isinstance(m, ToolMessage) for m in messages)
+        if done < rounds - 1:
+            dish = messages[1].content.split("名称: ")[1].split("\n")[0]
+            return AIMessage(content="", tool_calls=[{
+                "name": "tavily_search", "args": {"query": f"{dish} 标准做法 用油量 用盐量 第{done + 1}轮"},
+                "id": f"call_{done}",
+            }])
+        return AIMessage(content="- 油盐含量：油(8 g), 盐(1.5 g)")
+
+    agent.searching_llm = RunnableLambda(lambda m: asyncio.run(searching(m)), afunc=searching)
+
+
+def main_cli():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rounds", type=int, default=3, help="每道菜的检索轮数（含最后给出结论的一轮）")
+    args = parser.parse_args()
+
+    os.environ.setdefault("DASHSCOPE_API_KEY", "bench")
+    os.environ.setdefault("TAVILY_API_KEY", "bench")
+    os.environ["SEARCH_CACHE"] = "0"
+    os.environ["SEARCH_MAX_ITERATIONS"] = str(max(args.rounds, 4))
+
+    from app.agent_utils import metrics, recipe_index, tool_compaction
+    from app.agents.analysis_agent import AnalysisAgent
+
+    # 关闭参考表直出，让每道菜都走检索循环
+    recipe_index.RECIPE_MATCH_THRESHOLD = 2
+    agent = AnalysisAgent()
+    _stub(agent, args.rounds)
+
+    for label, enabled in (("raw results", False), ("compacted", True)):
+        tool_compaction.TOOL_COMPACTION = enabled
+        before = metrics.snapshot()["observations"].get("search_loop_prompt_tokens", {"sum": 0})["sum"]
+        asyncio.run(agent.aanalyze("bench", VISION_REPORT))
+        observations = metrics.snapshot()["observations"]
+        total = observations["search_loop_prompt_tokens"]["sum"] - before
+        print(f"{label:<12} 每次分析检索循环累计 prompt tokens ≈ {total:8.0f}")
+
+    saved = metrics.snapshot()["observations"]["search_loop_prompt_tokens_saved"]
+    print(f"压缩省下的 prompt tokens（按状态中的 prompt_tokens_saved 统计）≈ {saved['sum']:.0f}")
+
+
+if __name__ == "__main__":
+    main_cli()
@@ -0,0 +1,194 @@
+"""
+上游调用层基准：本地替身服务器模拟 DashScope 与 Tavily 的配额限制，对比直接调用与经过上游调用层的表现
+
+用法（在 backend 目录下）：
+    python -m benchmarks.bench_upstream_rate_limit                    # 每种客户端并发 40 个请求
+    python -m benchmarks.bench_upstream_rate_limit --requests 80 --error-rate 0.2
+
+替身服务器（127.0.0.1 随机端口，HTTP/1.1 keep-alive）：
+- /api/v1/services/aigc/text-generation/generation 返回 DashScope 格式的响应（含 usage）
+- /search 返回 Tavily 格式的搜索结果
+- 每个服务每秒最多受理 --server-rps 个请求，超出返回 429；另按 --error-rate 随机注入 429 / 503
+对比的客户端：
+- ChatTongyi（自带 tenacity 重试，但 429/5xx 时 check_response 抛 KeyError，实际不会重试）与 UpstreamChatTongyi
+- TavilySearch（无重试，每次请求新建连接）与 CachedTavilySearch（关闭缓存，仅保留上游调用层）
+经过上游调用层的客户端出现任何失败时以退出码 1 结束，可作为回归检查。
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import threading
+import time
+from collections import defaultdict, deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class StandInState:
+    def __init__(self, rps: int, error_rate: float):
+        self.rps = rps
+        self.error_rate = error_rate
+        self.lock = threading.Lock()
+        self.windows = defaultdict(deque)
+        self.counts = defaultdict(int)
+
+    def admit(self, service: str) -> int:
+        """返回本次请求的状态码：超出每秒配额或命中随机注入时为 429 / 503"""
+        with self.lock:
+            now = time.monotonic()
+            window = self.windows[service]
+            while window and now - window[0] > 1.0:
+                window.popleft()
+            self.counts[f"{service}_requests"] += 1
+            if len(window) >= self.rps:
+                self.counts[f"{service}_429"] += 1
+                return 429
+            window.append(now)
+            roll = random.random()
+            if roll < self.error_rate * 2 / 3:
+                self.counts[f"{service}_429"] += 1
+                return 429
+            if roll < self.error_rate:
+                self.counts[f"{service}_503"] += 1
+                return 503
+            return 200
+
+    def reset(self):
+        with self.lock:
+            self.windows.clear()
+            self.counts.clear()
+
+
+def _handler(state: StandInState):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def setup(self):
+            super().setup()
+            with state.lock:
+                state.counts["connections"] += 1
+
+        def log_message(self, *args):
+            pass
+
+        def _reply(self, status: int, body: dict, headers: dict = None):
+            payload = json.dumps(body, ensure_ascii=False).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(payload)))
+            for name, value in (headers or {}).items():
+                self.send_header(name, value)
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def do_POST(self):
+            body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+            time.sleep(0.02)
+            if self.path.endswith("/generation"):
+                self._dashscope(body)
+            elif self.path.endswith("/search"):
+                self._tavily(body)
+            else:
+                self._reply(404, {"detail": {"error": "not found"}})
+
+        def _dashscope(self, body: dict):
+            status = state.admit("dashscope")
+            if status != 200:
+                code = "Throttling.RateQuota" if status == 429 else "InternalError"
+                self._reply(status, {"request_id": "stand-in", "code": code, "message": "injected"})
+                return
+            self._reply(200, {
+                "request_id": "stand-in",
+                "output": {"choices": [{"finish_reason": "stop",
+                                        "message": {"role": "assistant", "content": "- 油盐含量：油(8 g), 盐(1.5 g)"}}]},
+                "usage": {"input_tokens": 120, "output_tokens": 12, "total_tokens": 132},
+            })
+
+        def _tavily(self, body: dict):
+            status = state.admit("tavily")
+            if status != 200:
+                self._reply(status, {"detail": {"error": "injected"}})
+                return
+            self._reply(200, {
+                "query": body.get("query"), "follow_up_questions": None, "answer": None, "images": [],
+                "results": [{"url": "https://example.com", "title": "做法", "content": "盐 5 克，油 30 毫升",
+                             "score": 0.9, "raw_content": None}],
+                "response_time": 0.02,
+            })
+
+    return Handler
+
+
+async def _burst(label: str, make_call, n: int, state: StandInState, service: str):
+    from app.agent_utils import metrics
+
+    state.reset()
+    before = metrics.snapshot()["counters"]
+    start = time.perf_counter()
+    results = await asyncio.gather(*(make_call(i) for i in range(n)), return_exceptions=True)
+    elapsed = time.perf_counter() - start
+    ok = sum(1 for r in results if not isinstance(r, Exception) and not (isinstance(r, dict) and "error" in r))
+    after = metrics.snapshot()["counters"]
+    retries = sum(after.get(k, 0) - before.get(k, 0) for k in after if k.startswith("upstream_") and k.endswith("_retries"))
+    print(
+        f"{label:<22} 成功 {ok:>3}/{n}  服务端收到 {state.counts[f'{service}_requests']:>4} 次"
+        f"（429 {state.counts[f'{service}_429']:>3}，503 {state.counts[f'{service}_503']:>3}）"
+        f"  客户端重试 {retries:>3.0f}  新建连接 {state.counts['connections']:>3}  耗时 {elapsed:5.1f}s"
+    )
+    return ok
+
+
+def main_cli():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=40, help="每种客户端的并发请求数")
+    parser.add_argument("--server-rps", type=int, default=10, help="替身服务器每个服务每秒受理的请求数")
+    parser.add_argument("--error-rate", type=float, default=0.1, help="随机注入 429/503 的比例")
+    args = parser.parse_args()
+
+    state = StandInState(args.server_rps, args.error_rate)
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _handler(state))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base_url = f"http://127.0.0.1:{server.server_address[1]}"
+
+    # dashscope 在导入时读取接口地址，必须先设置环境变量再导入
+    os.environ["DASHSCOPE_HTTP_BASE_URL"] = f"{base_url}/api/v1"
+    os.environ.setdefault("DASHSCOPE_API_KEY", "bench")
+    os.environ.setdefault("TAVILY_API_KEY", "bench")
+    os.environ["SEARCH_CACHE"] = "0"
+    # 客户端配额略低于服务端（每秒 80%），突发量 1 秒
+    client_rpm = args.server_rps * 60 * 0.8
+    os.environ["UPSTREAM_LIMITS"] = json.dumps({"qwen-plus": [client_rpm, None], "tavily": [client_rpm, None]})
+    os.environ["UPSTREAM_BURST_SECONDS"] = "1"
+
+    from langchain_community.chat_models.tongyi import ChatTongyi
+    from langchain_tavily import TavilySearch
+
+    from app.agent_utils.search_cache import CachedTavilySearch
+    from app.agent_utils.tongyi_client import UpstreamChatTongyi
+    from app.agent_utils.upstream import close_upstream_sessions
+
+    plain_llm = ChatTongyi(model="qwen-plus", temperature=0)
+    upstream_llm = UpstreamChatTongyi(model="qwen-plus", temperature=0)
+    plain_search = TavilySearch(max_results=1, api_base_url=base_url)
+    upstream_search = CachedTavilySearch(max_results=1, api_base_url=base_url)
+
+    async def run():
+        n = args.requests
+        await _burst("ChatTongyi", lambda i: plain_llm.ainvoke(f"红烧肉 {i}"), n, state, "dashscope")
+        layer_ok = await _burst("UpstreamChatTongyi", lambda i: upstream_llm.ainvoke(f"红烧肉 {i}"), n, state, "dashscope")
+        await _burst("TavilySearch", lambda i: plain_search.ainvoke({"query": f"红烧肉 {i}"}), n, state, "tavily")
+        layer_ok += await _burst("CachedTavilySearch", lambda i: upstream_search.ainvoke({"query": f"红烧肉 {i}"}), n, state, "tavily")
+        await close_upstream_sessions()
+        return layer_ok == 2 * n
+
+    passed = asyncio.run(run())
+    server.shutdown()
+    if not passed:
+        print("FAIL: 经过上游调用层的请求出现失败")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main_cli()
@@ -0,0 +1,136 @@
+"""
+本地规则回归检查：跳过模型直接出结果的本地规则不能把另一道菜或调料的数据当作结论
+
+用法（在 backend 目录下）：
+    python -m benchmarks.check_local_rules
+
+- 标准菜谱参考表：近似但不同的菜名（错一个字、多一个字、原先被误列为别名的菜）不能走 local_finding 直接换算，
+  但仍应作为 standard_recipe_lookup 工具的候选交给模型判断
+- 食堂快速通道：近似菜名、或食材对不上库中主料的菜不能走快速通道（用临时 SQLite 食堂库）
+- 检索结论解析：酱油、蚝油等调料与 "食材组成" 行中的克数不能当作烹调用油 / 用盐（直接进入宝塔 L5）
+任何一项不符时以退出码 1 结束。
+"""
+import os
+import sys
+import tempfile
+
+from app.agent_utils.canteen_fast_path import CanteenMatcher
+from app.agent_utils.pagoda import parse_oil_salt
+from app.agent_utils.database_utils.canteen_db_sql import CanteenDB
+from app.agent_utils.recipe_index import RECIPE_CANDIDATE_THRESHOLD, get_recipe_index, local_finding
+from models.schemas import DishItem, IngredientAmount
+
+# (菜名, 不应被直接采用的参考菜)
+RECIPE_NEAR_MISSES = [
+    ("番茄炒鸭蛋", "西红柿炒鸡蛋"),
+    ("清炒土豆丝", "酸辣土豆丝"),
+    ("红烧牛肉饭", "红烧牛肉"),
+    ("鱼香茄子", "肉末茄子"),
+    ("青椒肉丝", "青椒炒肉"),
+    ("扬州炒饭", "炒饭"),
+]
+# (菜名, 应出现在工具候选中的参考菜)：错别字级别的近似仍交给模型判断
+RECIPE_TOOL_CANDIDATES = [
+    ("番茄炒鸭蛋", "西红柿炒鸡蛋"),
+    ("西红柿炒鸡旦", "西红柿炒鸡蛋"),
+]
+# (菜名, 应直接采用的参考菜)：菜名与别名完全一致
+RECIPE_EXACT = [
+    ("西红柿炒鸡蛋", "西红柿炒鸡蛋"),
+    ("番茄炒蛋", "西红柿炒鸡蛋"),
+    ("酸辣土豆丝", "酸辣土豆丝"),
+    ("红烧牛肉", "红烧牛肉"),
+]
+
+# 食堂库中的菜：(菜名, 主料, L1-L4 克数)
+CANTEEN_DISHES = [
+    ("红烧牛肉", ["牛肉", "胡萝卜"], (0, 30, 120, 0)),
+    ("番茄炒蛋", ["番茄", "鸡蛋"], (0, 100, 60, 0)),
+]
+# (菜名, 视觉食材, 是否应走快速通道)
+CANTEEN_CASES = [
+    ("红烧牛肉", [("牛肉", 100), ("胡萝卜", 30), ("酱油", 5)], True),
+    ("西红柿炒鸡蛋", [("西红柿", 100), ("鸡蛋", 60)], False),
+    ("番茄炒蛋", [("西红柿", 100), ("鸡蛋", 60)], True),
+    ("红烧牛肉饭", [("米饭", 200), ("牛肉", 60)], False),
+    ("红烧牛肉", [("米饭", 200), ("牛肉", 60)], False),
+]
+
+# (检索结论, 应解析出的 (油, 盐))
+OIL_SALT_CASES = [
+    ("- 油盐含量：油约12 g（含酱油5 g），盐2 g", (12.0, 2.0)),
+    ("- 食材组成：牛肉(100 g), 酱油(10 g)\n- 烹调用油约12 g，盐2 g", (12.0, 2.0)),
+    ("- 油盐含量：油(8 g), 盐(1.5 g)", (8.0, 1.5)),
+    ("- 油盐含量：油约 10 g 左右，盐约 2 g", (10.0, 2.0)),
+    ("- 食材组成：食用油(10 g), 盐(3 g)\n- 描述：蚝油5 g 调味", (None, None)),
+]
+
+
+def _item(name: str, ingredients=None) -> DishItem:
+    ingredients = ingredients if ingredients is not None else [(name, 200)]
+    return DishItem(index=0, category="菜品", name=name,
+                    ingredients=[IngredientAmount(name=n, grams=g) for n, g in ingredients])
+
+
+def check_recipes() -> list:
+    failures = []
+    index = get_recipe_index()
+    for name, other in RECIPE_NEAR_MISSES:
+        if local_finding(_item(name)) is not None:
+            failures.append(f"参考表：{name} 被直接按 {index.best_match(name).recipe.name} 换算")
+    for name, expected in RECIPE_TOOL_CANDIDATES:
+        if not any(m.recipe.name == expected and m.score >= RECIPE_CANDIDATE_THRESHOLD for m in index.search(name)):
+            failures.append(f"参考表：{name} 的工具候选中没有 {expected}")
+    for name, expected in RECIPE_EXACT:
+        finding = local_finding(_item(name))
+        if finding is None or f"「{expected}」" not in finding:
+            failures.append(f"参考表：{name} 未直接采用 {expected}")
+    return failures
+
+
+def check_canteen() -> list:
+    failures = []
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, "canteen.db")
+        with CanteenDB(db_path) as db:
+            db.save_canteen_data({"检查食堂": {"1号窗口": {"午餐/晚餐": [
+                {
+                    "dish_name": name,
+                    "main_ingredients": main,
+                    "seasonings": [],
+                    "feature_tags": [],
+                    "pagoda_nutrition_vector": {
+                        **{layer: {"total_value": grams, "ingredients": [], "details": {}}
+                           for layer, grams in zip(("L1", "L2", "L3", "L4"), layers)},
+                        "L5": {"oil": 10, "salt": 2},
+                    },
+                }
+                for name, main, layers in CANTEEN_DISHES
+            ]}}})
+        matcher = CanteenMatcher(db_path)
+        for name, ingredients, expected in CANTEEN_CASES:
+            hit = matcher.match([_item(name, ingredients)]) is not None
+            if hit != expected:
+                failures.append(f"食堂快速通道：{name} {ingredients} {'未' if expected else '不应'}命中")
+    return failures
+
+
+def check_oil_salt() -> list:
+    failures = []
+    for text, expected in OIL_SALT_CASES:
+        parsed = parse_oil_salt(text)
+        if parsed != expected:
+            failures.append(f"检索结论解析：{text!r} 得到 {parsed}，应为 {expected}")
+    return failures
+
+
+def main_cli():
+    failures = check_recipes() + check_canteen() + check_oil_salt()
+    for failure in failures:
+        print(f"FAIL {failure}")
+    print(f"{'通过' if not failures else f'{len(failures)} 项不符'}")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main_cli()
@@ -0,0 +1,83 @@
+"""
+checkpointer 内存浸泡测试：连续跑 N 次与主图同构的 graph（每次新的 thread_id），观察 RSS 是否保持平稳
+
+用法（在 backend 目录下）：
+    python -m benchmarks.soak_checkpointer --mode bounded --requests 10000
+    python -m benchmarks.soak_checkpointer --mode memory --requests 2000   # 改造前的 MemorySaver，作为对照
+    python -m benchmarks.soak_checkpointer --mode none                      # 无 checkpoint 快速路径
+
+节点不调用模型，只返回与真实链路同样形状的状态（图片字节 + 视觉报告 + NutritionReport）。
+退出码非 0 表示最后 10% 请求期间 RSS 增长超过 --max-growth-mb。
+"""
+import argparse
+import gc
+import os
+import sys
+
+from langgraph.checkpoint.memory import MemorySaver
+from langgraph.graph import StateGraph, START, END
+
+from app.agent_utils.checkpointer import BoundedMemorySaver
+from models.schemas import VisionAgentState, VisionResponse, NutritionReport
+
+
+def _rss_mb() -> float:
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1]) / 1024
+    return 0.0
+
+
+def _build_graph(checkpointer):
+    report = "- 类别: 主食\n- 名称: 米饭\n- 食材组成: 米饭 (150g)\n" * 20
+
+    builder = StateGraph(VisionAgentState)
+    builder.add_node("vision", lambda state: {
+        "vision_report": VisionResponse(is_valid=True, reason="", report=report),
+        "error_reason": None,
+    })
+    builder.add_node("analysis", lambda state: {
+        "analysis_results": NutritionReport(dish_name="米饭", description=report[:200]),
+    })
+    builder.add_edge(START, "vision")
+    builder.add_edge("vision", "analysis")
+    builder.add_edge("analysis", END)
+    return builder.compile(checkpointer=checkpointer)
+
+
+def main_cli():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--mode", choices=["bounded", "memory", "none"], default="bounded")
+    parser.add_argument("--requests", type=int, default=10000)
+    parser.add_argument("--image-kb", type=int, default=256)
+    parser.add_argument("--max-growth-mb", type=float, default=20.0)
+    args = parser.parse_args()
+
+    checkpointer = {"bounded": BoundedMemorySaver, "memory": MemorySaver, "none": lambda: None}[args.mode]()
+    graph = _build_graph(checkpointer)
+    image = os.urandom(args.image_kb * 1024)
+
+    tail_start = int(args.requests * 0.9)
+    tail_rss = None
+    for i in range(1, args.requests + 1):
+        config = {"configurable": {"thread_id": f"soak_{i}"}} if checkpointer is not None else None
+        graph.invoke(VisionAgentState(username="soak", image_bytes=image, image_mime="image/jpeg"), config=config)
+
+        if i == tail_start:
+            gc.collect()
+            tail_rss = _rss_mb()
+        if i % max(1, args.requests // 10) == 0:
+            gc.collect()
+            extra = ""
+            if isinstance(checkpointer, BoundedMemorySaver):
+                extra = f"  threads={checkpointer.thread_count} bytes={checkpointer.total_bytes / 1024 / 1024:.1f}MB"
+            print(f"[{args.mode}] {i:>6} 次请求  RSS={_rss_mb():8.1f} MB{extra}")
+
+    growth = _rss_mb() - (tail_rss or 0)
+    print(f"最后 10% 请求期间 RSS 增长 {growth:.1f} MB")
+    sys.exit(0 if growth <= args.max_growth_mb else 1)
+
+
+if __name__ == "__main__":
+    main_cli()
@@ -1,7 +1,7 @@
 from __future__ import annotations
 
 import operator
-from typing import Annotated, List, Optional
+from typing import Annotated, List, Optional, Union
 
 from pydantic import BaseModel, ConfigDict, Field
 
@@ -47,23 +47,97 @@ class NutritionReport(BaseModel):
     description: str = ""
 
 
+# ── 3.1 词典外食材的 LLM 分类结果（确定性聚合的兜底）─────────────
+class IngredientCategory(BaseModel):
+    name: str = Field(description="食材名，与输入保持一致")
+    category: str = Field(
+        description="grains / tubers / vegetables / fruits / animal_meat / seafood / eggs / dairy / soy_nuts / seasoning / other 之一"
+    )
+
+
+class IngredientCategories(BaseModel):
+    items: List[IngredientCategory] = []
+
+
 # ── 4. 主图谱 LangGraph 状态（替代 VisionAgentState TypedDict）──
 class VisionAgentState(BaseModel):
+    # image_bytes 允许直接放入上传内容的 bytes / memoryview，避免落盘再读回
+    model_config = ConfigDict(arbitrary_types_allowed=True)
+
     username: str = ""
     image_path: str = ""
+    image_bytes: Optional[Union[bytes, memoryview]] = None
+    image_mime: Optional[str] = None
     error_reason: Optional[str] = None
     vision_report: Optional[VisionResponse] = None
     analysis_results: Optional[NutritionReport] = None
+    cache_hit: bool = False
+    # 食堂快速通道：客户端可选传入食堂与餐别，缩小匹配范围
+    canteen_name: Optional[str] = None
+    meal_type: Optional[str] = None
+    fast_path: bool = False
+    # 请求截止时间戳（time.time()），见 app/agent_utils/deadline.py；超时后给出的估算报告 is_partial 为 True
+    deadline: Optional[float] = None
+    is_partial: bool = False
 
 
 # ── 5. 分析子图 LangGraph 状态（替代 AgentState TypedDict）──────
+class IngredientAmount(BaseModel):
+    name: str
+    grams: float = 0.0
+
+
+class DishItem(BaseModel):
+    """视觉报告中的一个条目（一道菜或一份主食）"""
+    index: int = 0
+    category: str = ""  # 主食 / 菜品
+    name: str = ""
+    ingredients: List[IngredientAmount] = []
+    visual_features: str = ""
+
+
+class DishFinding(BaseModel):
+    """单道菜的检索结论，由逐菜子图产出"""
+    item: DishItem
+    extracted_info: str = ""
+
+
+class DishState(BaseModel):
+    """逐菜子图的状态：每道菜独立一段 searching ↔ tools 对话"""
+    username: str = ""
+    item: DishItem
+    deadline: Optional[float] = None
+    extracted_info: str = ""
+    messages: Annotated[list, operator.add] = []
+    # 检索循环的预算计数，见 AnalysisState
+    retry_count: int = 0
+    tool_calls: int = 0
+    prompt_tokens: int = 0
+    compacted_tokens: int = 0
+    prompt_tokens_saved: int = 0
+    budget_exhausted: Annotated[List[str], operator.add] = []
+
+
 class AnalysisState(BaseModel):
     username: str = ""
     vision_report: str = ""
+    deadline: Optional[float] = None
+    dish_items: List[DishItem] = []
+    dish_findings: Annotated[List[DishFinding], operator.add] = []
     extracted_info: str = ""
     messages: Annotated[list, operator.add] = []
     final_response: Optional[NutritionReport] = None
+    # searching ↔ tools 循环的预算计数：retry_count 为已执行的检索轮数
     retry_count: int = 0
+    tool_calls: int = 0
+    prompt_tokens: int = 0
+    # 工具结果压缩：compacted_tokens 为历史消息中已省去的 token 数，每轮检索都会少发这么多，累计到 prompt_tokens_saved
+    compacted_tokens: int = 0
+    prompt_tokens_saved: int = 0
+    # 预算耗尽事件，如 "iterations" / "deadline" / "红烧肉: tool_calls"
+    budget_exhausted: Annotated[List[str], operator.add] = []
+    # 检索超时后由视觉克数与本地油盐估算得到的报告
+    is_partial: bool = False
     errors: List[str] = []
     save_status: bool = False
 
@@ -73,3 +147,13 @@ class ApiResponse(BaseModel):
     status: str
     message: str = ""
     data: Optional[dict] = None
+
+
+# ── 7. 异步分析任务 ─────────────────────────────────────────────
+class JobInfo(BaseModel):
+    job_id: str
+    username: str = ""
+    status: str = "queued"  # queued / running / done / failed
+    result: Optional[dict] = None  # 结束后为 ApiResponse 的 dict 形式
+    created_at: float = 0.0
+    updated_at: float = 0.0